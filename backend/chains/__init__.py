@@ -1,5 +1,13 @@
+from typing import Optional
+
+from models import chain_registry
+
 ######## PI-Rating ########
 from .pi_ratings import ProbabilityImpactRatingV1
+from .pi_ratings_bulk import ProbabilityImpactRatingBulkV1
+from .pi_ratings_stream import ProbabilityImpactRatingStreamV1
+from .pi_ratings_cascade import ProbabilityImpactRatingCascadeV1
+from .pi_ratings_decomposed import ProbabilityImpactRatingDecomposedV1
 from .pi_ratings_test_monarch_w_rag import ProbabilityImpactRatingTestMonarchRAG
 from .pi_ratings_test_monarch_wo_rag import ProbabilityImpactRatingTestMonarchWoRAG
 from .pi_ratings_test_democrat_w_rag import ProbabilityImpactRatingTestDemocratRAG
@@ -13,9 +21,15 @@ from .checklists import CheckListV1
 __all__ = ["configure_chains"]
 
 
-def configure_chains(chains: list = [], **kwargs) -> list:
+def configure_chains(chains: Optional[list] = None, **kwargs) -> list:
+    """`kwargs`(모델 설정)에 해당하는 체인 route 목록. 같은 설정의 체인은 `chain_registry`에서 한 번만 구성됩니다."""
+    chains = [] if chains is None else chains
     _chains = [
         ProbabilityImpactRatingV1(),
+        ProbabilityImpactRatingBulkV1(),
+        ProbabilityImpactRatingStreamV1(),
+        ProbabilityImpactRatingCascadeV1(),
+        ProbabilityImpactRatingDecomposedV1(),
         # ProbabilityImpactRatingTestMonarchRAG(),
         # ProbabilityImpactRatingTestMonarchWoRAG(),
         # ProbabilityImpactRatingTestDemocratRAG(),
@@ -28,6 +42,6 @@ def configure_chains(chains: list = [], **kwargs) -> list:
         CheckListV1()
     ]
     for _chain in _chains:
-        chain = _chain.configure(**kwargs)
+        chain = chain_registry.configure(_chain, **kwargs)
         chains.append(chain)
     return chains
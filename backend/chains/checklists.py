@@ -1,9 +1,20 @@
-from schemas import RiskAssessmentOutput, ChecklistOutput
-from models import ChainBase
+import os
+from collections import Counter
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from schemas import RiskAssessmentOutput, Checklist, ChecklistOutput
+from models import ChainBase, to_plain
 from utils import get_logger
 
 logger = get_logger(__name__)
 
+CHECKLIST_CHUNK_SIZE: int = int(os.getenv("CHECKLIST_CHUNK_SIZE", "5"))  # 0이면 표 전체를 한 번에 (체크리스트 행 전체를 생성)
+CHECKLIST_MAX_CONCURRENCY: int = int(os.getenv("CHECKLIST_MAX_CONCURRENCY", "4"))
+
 
 def merge_process_category(data):
     if data["공종"] and data["공정"]:
@@ -15,20 +26,40 @@ def merge_process_category(data):
 
 
 
+class ChecklistItem(BaseModel):
+    번호: int = Field(description="입력 위험성평가표 항목의 번호")
+    체크리스트_항목: str = Field(description="해당 위험성평가표 항목의 체크리스트 항목")
+
+
+class ChecklistItemsOutput(BaseModel):
+    체크리스트: List[ChecklistItem] = Field(description="입력 위험성평가표의 항목마다 하나씩, 번호로 구분한 체크리스트 항목")
+
+
+
 class CheckListV1(ChainBase):
+    """
+    위험성평가표 → 항목별 체크리스트.
+
+    `chunk_size`개씩 나눈 표를 `max_concurrency` 만큼 병렬로 보내고, 모델은 `번호`별 `체크리스트_항목`만 생성합니다.
+    원래 항목의 나머지 필드는 서버에서 `번호`로 다시 붙입니다. 빠진 항목은 한 번 더 요청합니다.
+    `CHECKLIST_CHUNK_SIZE=0`이면 표 전체를 한 번에 보내고 체크리스트 행 전체를 생성합니다.
+    """
+    chunk_size: ClassVar[int] = CHECKLIST_CHUNK_SIZE
+    max_concurrency: ClassVar[int] = CHECKLIST_MAX_CONCURRENCY
+
+    _items_chain: Runnable
+
     def chain_call(self, model, embeddings):
         self.model = model
         self.embeddings = embeddings
 
         # Prompt
         self.prompt = "checklist"
-        prompt_template = self.template_call("chat", [
-            ("system", self.prompt["system"]),
-            ("user", self.prompt["user"].format(
-                process_category="{process_category}",
-                risk_assessment_table="{risk_assessment_table}",
-            ))
-        ])
+        prompt_template = self.prompt_chain()
+
+        if self.chunk_size > 0:
+            self._items_chain = prompt_template | self.model.with_structured_output(ChecklistItemsOutput)
+            return RunnableLambda(self.checklist, afunc=self.achecklist, name="checklist")
 
         # Output Configuration
         structured_output = self.model.with_structured_output(ChecklistOutput)
@@ -42,6 +73,74 @@ class CheckListV1(ChainBase):
         # Final Chain
         chain = chain_init | self.printer | prompt_template | self.printer | structured_output | self.printer
         return chain
+
+    # ── 항목 단위 생성 ─────────────────────────────────────────
+    @staticmethod
+    def items_input(process_category: str, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {"process_category": process_category, "risk_assessment_table": rows}
+
+    def chunks(self, rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        return [rows[i:i + self.chunk_size] for i in range(0, len(rows), self.chunk_size)]
+
+    @staticmethod
+    def collect(found: Dict[int, str], chunks: List[List[Dict[str, Any]]], outputs: List[ChecklistItemsOutput]) -> Dict[int, str]:
+        """청크에 보낸 항목의 `번호`로 온 결과만 받음"""
+        for chunk, output in zip(chunks, outputs):
+            numbers = {row["번호"] for row in chunk}
+            for item in output.체크리스트:
+                if item.번호 in numbers and item.체크리스트_항목.strip():
+                    found.setdefault(item.번호, item.체크리스트_항목)
+        return found
+
+    @staticmethod
+    def missing(rows: List[Dict[str, Any]], found: Dict[int, str]) -> List[Dict[str, Any]]:
+        return [row for row in rows if row["번호"] not in found]
+
+    def join(self, process_category: str, rows: List[Dict[str, Any]], found: Dict[int, str]) -> ChecklistOutput:
+        """다시 요청해도 빠진 항목이 있으면 502 (받은 항목은 `detail.checklist`로 함께 반환)"""
+        missing = [row["번호"] for row in self.missing(rows, found)]
+        if missing:
+            raise HTTPException(status_code=502, detail={
+                "message": f"Checklist items missing for rows {missing}",
+                "missing": missing,
+                "checklist": [{**row, "체크리스트_항목": found[row["번호"]]} for row in rows if row["번호"] in found],
+            })
+        return ChecklistOutput(
+            평가대상=process_category,
+            체크리스트=[Checklist.model_validate({**row, "체크리스트_항목": found[row["번호"]]}) for row in rows],
+        )
+
+    def prepare(self, data: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        """(평가대상, `번호`를 키로 쓸 수 있는 항목 목록). 번호가 겹치면 기록하고 순서대로 다시 매김"""
+        data = to_plain(data)
+        rows = data["위험성평가표"]
+        if duplicates := sorted(number for number, count in Counter(row["번호"] for row in rows).items() if count > 1):
+            logger.warning(f"🔸 Duplicate 번호 {duplicates} in {len(rows)} rows; renumbering 1..{len(rows)}")
+            rows = [{**row, "번호": number} for number, row in enumerate(rows, start=1)]
+        return merge_process_category(data), rows
+
+    def batch_config(self, config: Optional[RunnableConfig]) -> RunnableConfig:
+        return {**(config or {}), "max_concurrency": self.max_concurrency}
+
+    def checklist(self, data: Dict[str, Any], config: RunnableConfig) -> ChecklistOutput:
+        process_category, rows = self.prepare(data)
+        chunks = self.chunks(rows)
+        outputs = self._items_chain.batch([self.items_input(process_category, chunk) for chunk in chunks], self.batch_config(config))
+        found = self.collect({}, chunks, outputs)
+        if missing := self.missing(rows, found):
+            logger.warning(f"🔸 Checklist items missing for {len(missing)} rows; retrying them")
+            self.collect(found, [missing], [self._items_chain.invoke(self.items_input(process_category, missing), config)])
+        return self.join(process_category, rows, found)
+
+    async def achecklist(self, data: Dict[str, Any], config: RunnableConfig) -> ChecklistOutput:
+        process_category, rows = self.prepare(data)
+        chunks = self.chunks(rows)
+        outputs = await self._items_chain.abatch([self.items_input(process_category, chunk) for chunk in chunks], self.batch_config(config))
+        found = self.collect({}, chunks, outputs)
+        if missing := self.missing(rows, found):
+            logger.warning(f"🔸 Checklist items missing for {len(missing)} rows; retrying them")
+            self.collect(found, [missing], [await self._items_chain.ainvoke(self.items_input(process_category, missing), config)])
+        return self.join(process_category, rows, found)
     
     def _register_chain(self, **kwargs):
         incorporation = kwargs.get("incorporation")
@@ -52,12 +151,15 @@ class CheckListV1(ChainBase):
 
         untag = lambda x: x.split(":")[0] if ":" in x else x
 
+        path = f"/{untag(model)}/checklist"
+        chain = self.build_chain(
+            model=f"{incorporation}/{model}",
+            embeddings=f"{incorporation}/{embeddings}"
+        )
+
         self.chain = {
-            "chain": self.chain_call(
-                model=f"{incorporation}/{model}",
-                embeddings=f"{incorporation}/{embeddings}"
-            ),
-            "path": f"/{untag(model)}/checklist",
+            "chain": self.with_response_cache(chain, namespace=path),
+            "path": path,
             "input_type": RiskAssessmentOutput,
             "output_type": ChecklistOutput
         }
@@ -3,7 +3,7 @@
 from langchain_core.runnables import RunnablePassthrough
 
 from schemas import RiskAssessmentEvalInputV2, RiskAssessmentOutput, risk_assessment_map  # , MultiLabelAccidentClassificationOutputV2
-from models import ChainBase
+from models import ChainBase, render_content
 from utils import get_logger
 
 
@@ -25,6 +25,9 @@ class EvalMultiRAG(ChainBase):
     def ds_num(self, value: int):
         self._ds_num = value
 
+    def registry_key(self) -> tuple:
+        return super().registry_key() + (self.ds_num,)
+
     def chain_call(self, model, embeddings):
         self.model = model
         self.embeddings = embeddings
@@ -34,32 +37,17 @@ class EvalMultiRAG(ChainBase):
 
         # Retrieval
         reference_retriever = self.faiss_retrieval(file_name=f"faiss_K+S+O_Train_v7_{self.ds_num}")
+        reference_packer = self.pack_context(f"faiss_K+S+O_Train_v7_{self.ds_num}", render=render_content)
         
         # Prompt
         self.prompt = "pi_rating_test_w_reference_v4"
-        def make_template(data):
-            _prompt = [
-                ("system", self.prompt["system"]),
-                ("user", self.prompt["user"].format(
-                    process_major_category=data["process_major_category"],
-                    process_sub_category=data["process_sub_category"],
-                    equipment= data["equipment"],
-                    material= data["material"],
-                    hazard= data["hazard"],
-                    reference=data["reference"],
-                    mitigation= data["mitigation"],
-                ))
-            ]
-            prompt_template = self.template_call("chat", _prompt)
-            logger.debug(f"🔹 {_prompt = }")
-            logger.debug(f"🔹 {prompt_template = }")
-            return prompt_template
 
         # Reference Retriever
         reference_chain = (
             RunnablePassthrough()
             | self.get_dict2str(mapping=risk_assessment_map)
             | reference_retriever
+            | reference_packer
             | self.format_table
         )
 
@@ -75,7 +63,7 @@ class EvalMultiRAG(ChainBase):
         })
 
         # Final Prompt Chain
-        prompt_chain = lambda x: make_template(x) | RunnablePassthrough()
+        prompt_chain = self.prompt_chain()
 
         # Final Chain
         chain = chain_init | prompt_chain | structured_output | self.printer
@@ -91,7 +79,7 @@ class EvalMultiRAG(ChainBase):
         untag = lambda x: x.split(":")[0] if ":" in x else x
         
         self.chain = {
-            "chain": self.chain_call(
+            "chain": self.build_chain(
                 model=f"{incorporation}/{model}",
                 embeddings=f"{incorporation}/{embeddings}"
             ),
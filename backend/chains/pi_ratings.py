@@ -1,106 +1,239 @@
 """250515_위험성평가 체인"""
 
+import os
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, ClassVar, Dict, List, Optional, Union
 
-from langchain_core.messages import HumanMessage
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda, RunnablePassthrough
 
 from schemas import RiskAssessmentInput, RiskAssessmentOutput, risk_assessment_map
-from models import ChainBase
-from utils import get_logger, print_return
+from models import (ChainBase, 
+                    FaissBatchRetriever, 
+                    ImageHazardCache, 
+                    IMAGES_PLACEHOLDER, 
+                    canonical_hash, 
+                    compile_chat_prompt, 
+                    image_hazard_cache, 
+                    image_messages, 
+                    inline)
+from utils import get_logger, image_processor, model_call, trace
 
 
 logger = get_logger(__name__)
 
+SPECULATIVE_RETRIEVAL: bool = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+
 
 
 class RetrievalOutput(BaseModel):
     risk_items: List[str] = Field(description="사진 속 위험요인 목록")
+
+
+class PhotoRiskItems(BaseModel):
+    photo: int = Field(description="사진 번호 (`사진 N`의 N)")
+    risk_items: List[str] = Field(description="이 사진 속 위험요인 목록")
+
+
+class PhotosRetrievalOutput(BaseModel):
+    photos: List[PhotoRiskItems] = Field(description="사진별 위험요인. 받은 사진마다 하나씩")
  
 
 
+@inline
+@trace
+def merge_risks(args: RetrievalOutput):
+    merged_risks = "\n- ".join(args.risk_items)
+    return merged_risks
+
+
+def valid_assessment(output: RiskAssessmentOutput) -> bool:
+    """hedging에서 쓸 수 있는 결과인지 (위험성평가표가 비어 있으면 다른 backend 결과를 기다림)"""
+    return isinstance(output, RiskAssessmentOutput) and bool(output.위험성평가표)
+
+
+@inline
+@trace
+def merge_dicts_as_str(kwargs):
+    return "\n".join([f"{k}: {v}" for k, v in kwargs.items()])
+
+
+
 class ProbabilityImpactRatingV1(ChainBase):
+    reference_index: ClassVar[str] = "faiss_K+S+O_3_large_v7_4"  # faiss_K+S+O_Train_v7"
+    prompt_name: ClassVar[str] = "cy_rma_v3"
+    image_prompt: ClassVar[str] = "사진에서 유해 위험요인을 **한국어**로 식별하십시오. 사진이 없다면 '사진 없음'이라고 답하십시오."
+    photos_prompt: ClassVar[str] = "각 사진(`사진 N`)에서 유해 위험요인을 **한국어**로 식별하십시오. 사진마다 번호를 붙여 따로 답하십시오."
+    reference_k: ClassVar[int] = 7
+    hazard_k: ClassVar[int] = 3  # speculative 모드에서 위험요인 하나당 추가로 찾는 문서 수
+    speculative_retrieval: ClassVar[bool] = SPECULATIVE_RETRIEVAL
+
+    _image_model: BaseLanguageModel
+    _structured_output: Runnable
+    _prompt_chain: Runnable
+    _prompt_stage: Runnable
+    _reference_packer: Runnable
+
+    def image_prompt_chain(self) -> Runnable:
+        """`{"site_image": [...]}` → 사진 위험요인 추출 프롬프트 (템플릿은 한 번만 생성)"""
+        template = compile_chat_prompt(self.image_prompt, name=f"{type(self).__name__}.image_prompt")
+        return inline(lambda x: template.invoke({IMAGES_PLACEHOLDER: image_messages(x["site_image"])}))
+
+    @property
+    def image_prompt_version(self) -> str:
+        """이미지 위험요인 캐시 key에 들어가는 버전 (프롬프트나 모델이 바뀌면 새로 채움)"""
+        model_name = getattr(self._image_model, "model_name", None) or type(self._image_model).__name__
+        return canonical_hash([self.image_prompt, model_name])[:16]
+
+    def extract_image_risks(self) -> Runnable:
+        """`{"site_image": [...]}` → `RetrievalOutput` (vision 호출 한 번)"""
+        return (
+            self.image_prompt_chain()
+            | self.printer 
+            | self._image_model.with_structured_output(RetrievalOutput) 
+            | self.printer
+        )
+
+    def extract_photo_risks(self) -> Runnable:
+        """`{"site_image": [...]}` → `PhotosRetrievalOutput` (여러 장을 vision 호출 한 번으로, 사진별로 나눠서)"""
+        template = compile_chat_prompt(self.photos_prompt, name=f"{type(self).__name__}.photos_prompt")
+        return (
+            inline(lambda x: template.invoke({IMAGES_PLACEHOLDER: image_messages(x["site_image"], numbered=True)}))
+            | self.printer
+            | self._image_model.with_structured_output(PhotosRetrievalOutput)
+            | self.printer
+        )
+
+    def image_risk_items_chain(self, cache: ImageHazardCache = image_hazard_cache) -> Runnable:
+        """
+        현장 사진 → `RetrievalOutput`.
+        사진별 결과를 dHash로 캐시하고, 캐시에 없는 사진만 모아 vision 모델에 한 번 보냅니다 (사진별로 나눠 받아 각각 캐시).
+        """
+        extract = self.extract_image_risks()
+        extract_photos = self.extract_photo_risks()
+        version = self.image_prompt_version
+
+        def lookup(hashes):
+            found = [None if h is None else cache.get(version, h) for h in hashes]
+            return found, [i for i, risk_items in enumerate(found) if risk_items is None]
+
+        def request(images, missing) -> Dict[str, Any]:
+            return {"site_image": [images[i] for i in missing]}
+
+        def per_photo(missing, output: Union[RetrievalOutput, PhotosRetrievalOutput]) -> List[Optional[List[str]]]:
+            if isinstance(output, RetrievalOutput):
+                return [output.risk_items]
+            photos = {photo.photo: photo.risk_items for photo in output.photos}
+            return [photos.get(number) for number in range(1, len(missing) + 1)]
+
+        def merge(hashes, found, missing, outputs: List[Optional[List[str]]]) -> RetrievalOutput:
+            for i, risk_items in zip(missing, outputs):
+                if risk_items is None:
+                    logger.warning(f"🔸 No risk items returned for photo {i + 1}; not caching it")
+                    found[i] = []
+                    continue
+                found[i] = risk_items
+                if hashes[i] is not None:
+                    cache.set(version, hashes[i], risk_items)
+            return RetrievalOutput(risk_items=list(dict.fromkeys(item for risk_items in found for item in risk_items)))
+
+        def cached_risks(data, config: RunnableConfig) -> RetrievalOutput:
+            images = data["site_image"]
+            if not images:
+                return extract.invoke(data, config)
+            hashes = image_processor.hashes(images)
+            found, missing = lookup(hashes)
+            if not missing:
+                return merge(hashes, found, missing, [])
+            chain = extract if len(missing) == 1 else extract_photos
+            return merge(hashes, found, missing, per_photo(missing, chain.invoke(request(images, missing), config)))
+
+        async def acached_risks(data, config: RunnableConfig) -> RetrievalOutput:
+            images = data["site_image"]
+            if not images:
+                return await extract.ainvoke(data, config)
+            hashes = await image_processor.ahashes(images)
+            found, missing = lookup(hashes)
+            if not missing:
+                return merge(hashes, found, missing, [])
+            chain = extract if len(missing) == 1 else extract_photos
+            return merge(hashes, found, missing, per_photo(missing, await chain.ainvoke(request(images, missing), config)))
+
+        return RunnableLambda(cached_risks, afunc=acached_risks, name="image_risks")
+
+    def image_risks_chain(self) -> Runnable:
+        """현장 사진 → 유해 위험요인 목록 문자열"""
+        return self.image_risk_items_chain() | merge_risks
+
+    def speculative_reference_chain(self, retriever: FaissBatchRetriever) -> Runnable:
+        """
+        사진 분석을 기다리지 않고 작업 정보만으로 검색을 먼저 시작합니다.
+        위험요인이 나오면 위험요인별로 `hazard_k`개만 추가 검색(짧은 문구라 임베딩 캐시에 잘 걸림)하고,
+        두 결과를 문서별로 합쳐 relevance 순으로 `reference_k`개를 고릅니다.
+        """
+        dict2str = self.get_dict2str(mapping=risk_assessment_map)
+        image_chain = self.image_risk_items_chain()
+
+        def text_query(data) -> str:
+            return merge_dicts_as_str({"작업 정보": dict2str(data)})
+
+        def text(data):
+            return retriever.retrieve_with_relevance([text_query(data)], k=self.reference_k)[0]
+
+        async def atext(data):
+            return (await retriever.aretrieve_with_relevance([text_query(data)], k=self.reference_k))[0]
+
+        def hazards(data, config: RunnableConfig):
+            if not data["site_image"]:
+                return []
+            risk_items = image_chain.invoke(data, config).risk_items
+            return [pair for pairs in retriever.retrieve_with_relevance(risk_items, k=self.hazard_k) for pair in pairs]
+
+        async def ahazards(data, config: RunnableConfig):
+            if not data["site_image"]:
+                return []
+            risk_items = (await image_chain.ainvoke(data, config)).risk_items
+            return [pair for pairs in await retriever.aretrieve_with_relevance(risk_items, k=self.hazard_k) for pair in pairs]
+
+        def rerank(results) -> List:
+            best = {}
+            for doc, score in results["text"] + results["hazards"]:
+                key = doc.id or doc.page_content
+                if key not in best or score > best[key][1]:
+                    best[key] = (doc, score)
+            ranked = sorted(best.values(), key=lambda pair: pair[1], reverse=True)
+            return [doc for doc, _ in ranked[:self.reference_k]]
+
+        return (
+            self.parallel_init({
+                "text": RunnableLambda(text, afunc=atext, name="text_retrieval"),
+                "hazards": RunnableLambda(hazards, afunc=ahazards, name="hazard_retrieval"),
+            })
+            | inline(rerank)
+            | self._reference_packer
+            | self.format_docs
+        )
+
     def chain_call(self, model, embeddings):
         self.model = model
         self.embeddings = embeddings
 
-        image_model = self.model if "gpt-" in model else ChatOpenAI(model="gpt-4.1")
+        self._image_model = self.model if "gpt-" in model else model_call("openai/gpt-4.1")
 
         # Output Configuration
-        structured_output = self.model.with_structured_output(RiskAssessmentOutput)
+        structured_output = self._structured_output = self.hedged(
+            lambda model: model.with_structured_output(RiskAssessmentOutput), validate=valid_assessment
+        )
 
         # Retrieval
-        reference_retriever = self.faiss_retrieval(file_name="faiss_K+S+O_3_large_v7_4")  # faiss_K+S+O_Train_v7")
+        reference_retriever = self.faiss_retrieval(file_name=self.reference_index)
+        reference_packer = self._reference_packer = self.pack_context(self.reference_index)
         
         # Prompt
-        self.prompt = "cy_rma_v3"
-        def make_template(data):
-            _prompt = [
-                ("system", self.prompt["system"]),
-                ("user", self.prompt["user"].format(
-                    process_major_category=data["process_major_category"],
-                    process_sub_category=data["process_sub_category"],
-                    equipment= data["equipment"],
-                    material= data["material"],
-                    task_description= data["task_description"],
-                    # count=data["count"],
-                    reference=data["reference"],
-                ))
-            ]
-            for _image in data["site_image"]:
-                _prompt.append(
-                    HumanMessage(content=[{
-                        "type": "image_url",
-                        "image_url": {"url": _image},
-                    }])
-                )
-            prompt_template = self.template_call("chat", _prompt)
-            logger.debug(f"🔹 {_prompt = }")
-            logger.debug(f"🔹 {prompt_template = }")
-            return prompt_template
-        
-        def find_risks_from_image(images):
-            _prompt = [
-                ("system", "사진에서 유해 위험요인을 **한국어**로 식별하십시오. 사진이 없다면 '사진 없음'이라고 답하십시오."),
-            ]
-            for _image in images:
-                _prompt.append(
-                    HumanMessage(content=[{
-                        "type": "image_url",
-                        "image_url": {"url": _image},
-                    }])
-                )
-            retriever_prompt = self.template_call("chat", _prompt)
-            logger.debug(f"🔹 {_prompt = }")
-            logger.debug(f"🔹 {retriever_prompt = }")
-            return retriever_prompt
-       
-        def call_merge_risks():
-            @print_return
-            def merge_risks(args: RetrievalOutput):
-                merged_risks = "\n- ".join(args.risk_items)
-                logger.debug(f"🔹 merge_risks: {args = }, {merged_risks = }")
-                return merged_risks
-            return merge_risks
-
-        def call_merge_dicts_as_str():
-            @print_return
-            def merge_dicts_as_str(kwargs):
-                logger.debug(f"🔹 merge_dicts_as_str: {kwargs = }")
-                return "\n".join([f"{k}: {v}" for k, v in kwargs.items()])
-            return merge_dicts_as_str
+        self.prompt = self.prompt_name
 
         # Identify Risks from Image
-        from_image_chain = (
-            lambda x: find_risks_from_image(x["site_image"]) 
-            | RunnablePassthrough() 
-            | self.printer 
-            | image_model.with_structured_output(RetrievalOutput) 
-            | self.printer 
-            | call_merge_risks()
-        )
+        from_image_chain = self.image_risks_chain()
 
         # Reference Retriever
         reference_chain_head = self.parallel_init({
@@ -110,12 +243,15 @@ class ProbabilityImpactRatingV1(ChainBase):
         reference_chain_tail = (
             self.printer
             | RunnablePassthrough()
-            | call_merge_dicts_as_str()
+            | merge_dicts_as_str
             | self.printer
             | reference_retriever
+            | reference_packer
             | self.format_docs
         )
         reference_chain = reference_chain_head | reference_chain_tail
+        if self.speculative_retrieval and isinstance(reference_retriever, FaissBatchRetriever):
+            reference_chain = self.speculative_reference_chain(reference_retriever)
 
         # Input Configuration
         chain_init = self.parallel_init({
@@ -130,10 +266,11 @@ class ProbabilityImpactRatingV1(ChainBase):
         })
 
         # Final Prompt Chain
-        prompt_chain = lambda x: make_template(x) | RunnablePassthrough()
+        prompt_chain = self._prompt_chain = self.prompt_chain(images_key="site_image")
 
-        # Final Chain
-        chain = chain_init | prompt_chain | structured_output
+        # Final Chain (사진은 한 번만 받아서 줄인 뒤 두 vision 단계가 같이 사용)
+        prompt_stage = self._prompt_stage = self.image_stage() | chain_init | prompt_chain
+        chain = prompt_stage | structured_output
         return chain
     
     def _register_chain(self, **kwargs):
@@ -146,19 +283,22 @@ class ProbabilityImpactRatingV1(ChainBase):
 
         untag = lambda x: x.split(":")[0] if ":" in x else x
         
+        path = f"/{untag(model)}/pi-ratings"
+        chain = self.build_chain(
+            model=model if isollama else f"{incorporation}/{model}",
+            embeddings=f"{incorporation}/{embeddings}"
+        )
+        
         self.chain = {
-            "chain": self.chain_call(
-                model=model if isollama else f"{incorporation}/{model}",
-                embeddings=f"{incorporation}/{embeddings}"
-            ),
-            "path": f"/{untag(model)}/pi-ratings",
+            "chain": self.with_response_cache(chain, namespace=path, mapping=risk_assessment_map),
+            "path": path,
             "input_type": RiskAssessmentInput,
             "output_type": RiskAssessmentOutput
         }
         
         
 
-__all__ = ["ProbabilityImpactRatingV1"]
+__all__ = ["ProbabilityImpactRatingV1", "PhotoRiskItems", "PhotosRetrievalOutput", "RetrievalOutput", "merge_risks", "merge_dicts_as_str", "valid_assessment"]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+"""위험성평가 일괄(bulk) 체인"""
+
+import asyncio, contextvars, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, AsyncIterator, Callable, ClassVar, Dict, Iterator, List, Set
+
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable, RunnableGenerator
+
+from schemas import BulkRiskAssessmentInput, BulkRiskAssessmentResult, risk_assessment_map
+from models import FaissBatchRetriever, to_plain
+from utils import get_logger, image_processor
+
+from .pi_ratings import ProbabilityImpactRatingV1, merge_dicts_as_str
+
+
+logger = get_logger(__name__)
+
+BULK_MAX_CONCURRENCY: int = int(os.getenv("BULK_MAX_CONCURRENCY", "8"))
+NO_IMAGE: str = "사진 없음"
+
+
+
+class ReferenceBatch:
+    """
+    작업별 파이프라인이 같은 시점에 요청한 검색 질의를 모아 임베딩 요청·FAISS 검색 한 번으로 처리 (같은 질의는 한 번만).
+    """
+    def __init__(self, retriever: FaissBatchRetriever, format: Callable[[List[Document]], str]):
+        self.retriever = retriever
+        self.format = format
+        self._results: Dict[str, asyncio.Future] = {}
+        self._queued: List[str] = []
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def _flush(self):
+        await asyncio.sleep(0)  # 같은 tick에 도착한 질의까지 모음
+        queries, self._queued = self._queued, []
+        try:
+            searched = await self.retriever.aretrieve_many(queries)
+        except Exception as e:
+            for query in queries:
+                self._results[query].set_exception(e)
+            return
+        for query, docs in zip(queries, searched):
+            self._results[query].set_result(self.format(docs))
+
+    async def get(self, query: str) -> str:
+        future = self._results.get(query)
+        if future is None:
+            future = self._results[query] = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())  # 기다리던 작업이 취소돼도 경고 없이
+            self._queued.append(query)
+            if len(self._queued) == 1:
+                task = asyncio.create_task(self._flush())
+                self._flushes.add(task)
+                task.add_done_callback(self._flushes.discard)
+        return await asyncio.shield(future)
+
+
+
+class ProbabilityImpactRatingBulkV1(ProbabilityImpactRatingV1):
+    """
+    여러 작업의 위험성평가를 한 요청으로 처리합니다.
+
+    작업마다 사진 축소 → 이미지 위험요인 (사진이 있을 때만) → 참고자료 검색 → LLM 호출을 이어서 실행하고,
+    동시에 진행하는 작업은 `max_concurrency`개로 제한합니다. 끝나는 순서대로 결과를 내보내므로 앞 작업이 느려도 기다리지 않습니다.
+    같은 시점의 검색 질의는 `ReferenceBatch`로 모아 임베딩·FAISS 검색 한 번으로 처리합니다.
+    """
+    max_concurrency: ClassVar[int] = BULK_MAX_CONCURRENCY
+
+    _reference_retriever: FaissBatchRetriever
+    _image_risks: Runnable
+
+    def chain_call(self, model, embeddings):
+        super().chain_call(model, embeddings)
+        self._reference_retriever = FaissBatchRetriever(self.faiss_vectorstore(self.reference_index), k=self.reference_k)
+        self._image_risks = self.image_risks_chain()
+        # 결과를 한 건씩 list로 내보내므로 `/invoke`는 전체 목록, `/stream`은 완료 순서대로 한 건씩 받게 됨
+        return RunnableGenerator(self.bulk, self.abulk, name="pi_ratings_bulk")
+
+    def query(self, item: Dict[str, Any], hazards: str) -> str:
+        return merge_dicts_as_str({"위험 요인": hazards, "작업 정보": self.get_dict2str(mapping=risk_assessment_map)(item)})
+
+    @staticmethod
+    def failed(index: int, error: Exception) -> BulkRiskAssessmentResult:
+        logger.warning(f"🔸 bulk item {index} failed: {error}")
+        return BulkRiskAssessmentResult(index=index, error=str(error))
+
+    # ── async ─────────────────────────────────────────────────
+    async def abulk(self, inputs: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[List[BulkRiskAssessmentResult]]:
+        async for data in inputs:
+            async for result in self.arun(to_plain(data)["items"]):
+                yield [result]
+
+    async def arun(self, items: List[Dict[str, Any]]) -> AsyncIterator[BulkRiskAssessmentResult]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        references = ReferenceBatch(self._reference_retriever, lambda docs: self.format_docs(self._reference_packer(docs)))
+
+        async def pipeline(index: int, item: Dict[str, Any]) -> BulkRiskAssessmentResult:
+            try:
+                async with semaphore:
+                    item = {**item, "site_image": await image_processor.aprepare(item["site_image"])}
+                    hazards = await self._image_risks.ainvoke(item) if item["site_image"] else NO_IMAGE
+                    data = {**item, "reference": await references.get(self.query(item, hazards))}
+                    prompt_value = await self._prompt_chain.ainvoke(data)
+                    return BulkRiskAssessmentResult(index=index, output=await self._structured_output.ainvoke(prompt_value))
+            except Exception as e:
+                return self.failed(index, e)
+
+        tasks = [asyncio.create_task(pipeline(index, item)) for index, item in enumerate(items)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # ── sync (`/invoke`·`/batch`를 동기로 부르는 경우) ──────────────
+    def bulk(self, inputs: Iterator[Dict[str, Any]]) -> Iterator[List[BulkRiskAssessmentResult]]:
+        for data in inputs:
+            for result in self.run(to_plain(data)["items"]):
+                yield [result]
+
+    def run(self, items: List[Dict[str, Any]]) -> Iterator[BulkRiskAssessmentResult]:
+        def pipeline(index: int, item: Dict[str, Any]) -> BulkRiskAssessmentResult:
+            try:
+                item = {**item, "site_image": image_processor.prepare(item["site_image"])}
+                hazards = self._image_risks.invoke(item) if item["site_image"] else NO_IMAGE
+                docs = self._reference_retriever.retrieve_many([self.query(item, hazards)])[0]
+                data = {**item, "reference": self.format_docs(self._reference_packer(docs))}
+                return BulkRiskAssessmentResult(index=index, output=self._structured_output.invoke(self._prompt_chain.invoke(data)))
+            except Exception as e:
+                return self.failed(index, e)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = [executor.submit(contextvars.copy_context().run, pipeline, index, item) for index, item in enumerate(items)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _register_chain(self, **kwargs):
+        incorporation = kwargs.get("incorporation")
+        model = kwargs.get("model")
+        embeddings = kwargs.get("embeddings")
+        isollama = kwargs.get("isollama", False)
+
+        logger.debug(f"🔹 {incorporation = }, {model = }, {embeddings = }")
+
+        untag = lambda x: x.split(":")[0] if ":" in x else x
+
+        self.chain = {
+            "chain": self.build_chain(
+                model=model if isollama else f"{incorporation}/{model}",
+                embeddings=f"{incorporation}/{embeddings}"
+            ),
+            "path": f"/{untag(model)}/pi-ratings/bulk",
+            "input_type": BulkRiskAssessmentInput,
+            "output_type": List[BulkRiskAssessmentResult]
+        }
+
+
+
+__all__ = ["ProbabilityImpactRatingBulkV1"]
@@ -0,0 +1,297 @@
+"""위험성평가 cascade 체인 (싼 모델 초안 → 검증 → 실패한 행만 비싼 모델로)"""
+
+import json, os, re, time
+from collections import Counter
+from typing import Any, ClassVar, Dict, FrozenSet, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompt_values import ChatPromptValue, PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_community.vectorstores import FAISS
+
+from schemas import RiskAssessmentInput, RiskAssessmentOutput, risk_assessment_map
+from schemas.pi_rating import RiskItemV3
+from models import backend_key, backend_registry, cascade_stats, message_usage
+from utils import get_logger, model_call, normalize_text
+
+from .pi_ratings import ProbabilityImpactRatingV1
+
+
+logger = get_logger(__name__)
+
+CASCADE_DRAFT_MODEL: str = os.getenv("CASCADE_DRAFT_MODEL", "openai/gpt-4o-mini")
+CASCADE_MAX_FAILED_RATIO: float = float(os.getenv("CASCADE_MAX_FAILED_RATIO", "0.5"))  # 넘으면 요청 전체를 다시 생성
+CASCADE_LAW_INDEX: str = os.getenv("CASCADE_LAW_INDEX", "faiss_law_openai")
+CASCADE_LAW_NAMES: str = os.getenv("CASCADE_LAW_NAMES", "산업안전보건기준에 관한 규칙,안전보건규칙")  # 법령 인덱스가 담고 있는 법령 (이름·약칭)
+
+LEVELS: Dict[str, int] = {"낮음(1)": 1, "중간(2)": 2, "높음(3)": 3}
+RISK_LEVELS: Dict[int, str] = {1: "낮음(1)", 2: "낮음(2)", 3: "중간(3)", 4: "중간(4)", 6: "높음(6)", 9: "높음(9)"}
+REQUIRED_FIELDS: Tuple[str, ...] = ("공정대분류", "공정세부분류", "유해위험요인", "감소대책", "관련근거")
+ARTICLE_PATTERN = re.compile(r"제\s*(\d+)\s*조(?:\s*의\s*(\d+))?")
+LAW_NOISE = re.compile(r"\([^)]*\)|제\s*\d+\s*(?:항|호|목)|[\s「」『』\"',;/·]|및|또는")  # 조문 제목, 항·호·목, 괄호·구분자
+LAW_SUFFIX = re.compile(r"(?:법률|법|령|규칙|고시|규정|기준)$")
+REASONS: Dict[str, str] = {
+    "schema": "스키마에 맞지 않는 값 (허용되지 않은 위험가능성·위험중대성 등)",
+    "incomplete": "비어 있는 필드",
+    "inconsistent_risk": "위험성이 위험가능성 × 위험중대성과 다름",
+    "unknown_article": "법령 인덱스에 없는 조문을 관련근거로 인용",
+    "unverifiable_article": "법령 인덱스가 다루지 않는 법령(또는 법령 이름 없이)의 조문을 관련근거로 인용",
+    "duplicate_hazard": "다른 항목과 같은 유해위험요인",
+}
+
+
+
+class RiskRowsOutput(BaseModel):
+    위험성평가표: List[RiskItemV3] = Field(description="다시 작성한 위험성평가표 항목. 요청받은 항목만, 요청받은 순서대로")
+
+
+
+def article_key(match: re.Match) -> str:
+    number, branch = match.groups()
+    return f"제{number}조" + (f"의{branch}" if branch else "")
+
+
+def law_name(text: str) -> str:
+    return LAW_NOISE.sub("", text)
+
+
+def law_citations(text: str) -> List[Tuple[Optional[str], str]]:
+    """
+    관련근거 → `[(법령 이름, 조문)]`. 법령 이름은 조문 바로 앞에 적힌 것 (공백·괄호 제거)이고,
+    `안전보건규칙 제38조, 제39조`처럼 이름 없이 이어진 조문은 앞 조문의 법령, 처음부터 이름이 없으면 None.
+    """
+    citations, law, end = [], None, 0
+    for match in ARTICLE_PATTERN.finditer(text):
+        name = law_name(text[end:match.start()])
+        if LAW_SUFFIX.search(name):
+            law = name
+        citations.append((law, article_key(match)))
+        end = match.end()
+    return citations
+
+
+def law_articles(store: FAISS) -> FrozenSet[str]:
+    """법령 인덱스의 조문 번호 (문서마다 `제N조(제목) ...`로 시작). pickle·mmap docstore 모두 id로 조회"""
+    articles = set()
+    for doc_id in store.index_to_docstore_id.values():
+        doc = store.docstore.search(doc_id)
+        match = ARTICLE_PATTERN.search(doc.page_content[:200]) if isinstance(doc, Document) else None
+        if match:
+            articles.add(article_key(match))
+    return frozenset(articles)
+
+
+LAW_NAMES: FrozenSet[str] = frozenset(law_name(name) for name in CASCADE_LAW_NAMES.split(",") if name.strip())
+
+
+def check_rows(rows: List[Optional[RiskItemV3]], articles: Optional[FrozenSet[str]], laws: FrozenSet[str] = LAW_NAMES) -> Dict[int, List[str]]:
+    """
+    행 번호(0부터) → 실패 사유 목록. `rows`의 None은 스키마 검증에 실패한 행.
+    `articles`는 법령 인덱스(`laws`에 해당하는 법령)의 조문이며, 다른 법령의 조문은 확인할 수 없으므로 통과시키지 않음.
+    """
+    failures: Dict[int, List[str]] = {}
+    seen = set()
+    for index, row in enumerate(rows):
+        if row is None:
+            failures[index] = ["schema"]
+            continue
+        reasons = []
+        if any(not str(getattr(row, field)).strip() for field in REQUIRED_FIELDS):
+            reasons.append("incomplete")
+        if RISK_LEVELS.get(LEVELS[row.위험가능성] * LEVELS[row.위험중대성]) != row.위험성:
+            reasons.append("inconsistent_risk")
+        if articles is not None:
+            citations = law_citations(row.관련근거)
+            if any(law in laws and article not in articles for law, article in citations):
+                reasons.append("unknown_article")
+            if any(law not in laws for law, _ in citations):
+                reasons.append("unverifiable_article")
+        hazard = normalize_text(row.유해위험요인)
+        if hazard in seen:
+            reasons.append("duplicate_hazard")
+        seen.add(hazard)
+        if reasons:
+            failures[index] = reasons
+    return failures
+
+
+def parse_draft(raw: AIMessage) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]], List[Optional[RiskItemV3]]]:
+    """초안 JSON → (위험성평가표를 뺀 나머지 필드, 행 원문, 행별 검증 결과). 한 행이 틀려도 나머지 행은 살림"""
+    try:
+        data = json.loads(raw.content)
+        raw_rows = list(data.pop("위험성평가표"))
+        data = RiskAssessmentOutput.model_validate({**data, "위험성평가표": []}).model_dump(exclude={"위험성평가표"})
+    except (TypeError, ValueError, KeyError, AttributeError):  # ValidationError 포함
+        return None, [], []
+    rows = []
+    for raw_row in raw_rows:
+        try:
+            rows.append(RiskItemV3.model_validate(raw_row))
+        except ValidationError:
+            rows.append(None)
+    return data, raw_rows, rows
+
+
+
+class ProbabilityImpactRatingCascadeV1(ProbabilityImpactRatingV1):
+    """
+    `ProbabilityImpactRatingV1`과 같은 입력·프롬프트로 `CASCADE_DRAFT_MODEL`이 먼저 생성하고 로컬 검증합니다.
+
+    - 스키마·필수 필드, 위험성 = 위험가능성 × 위험중대성, 관련근거 조문이 법령 인덱스에 있는지
+      (인덱스가 다루는 `CASCADE_LAW_NAMES` 법령만 확인할 수 있고 나머지 법령의 조문은 실패), 유해위험요인 중복
+    - 실패한 행만 체인의 모델(expert)로 다시 생성해 제자리에 넣고, 실패가 `CASCADE_MAX_FAILED_RATIO`를 넘거나
+      초안 자체를 읽을 수 없으면 요청 전체를 expert로 다시 생성
+    - `번호`는 마지막에 1부터 다시 매김. escalation 비율·아낀 비용·지연 시간은 `/v1/health/cascade`
+    """
+    draft_model: ClassVar[str] = CASCADE_DRAFT_MODEL
+    law_index: ClassVar[str] = CASCADE_LAW_INDEX
+    max_failed_ratio: ClassVar[float] = CASCADE_MAX_FAILED_RATIO
+
+    _route: str = "cascade"
+    _draft_llm: BaseLanguageModel
+    _draft: Runnable
+    _expert: Runnable
+    _expert_rows: Runnable
+    _articles: Optional[FrozenSet[str]] = None
+
+    def chain_call(self, model, embeddings):
+        super().chain_call(model, embeddings)
+        self._draft_llm = model_call(self.draft_model)
+        # dict 스키마: SDK가 응답 전체를 pydantic으로 검증하지 않으므로 틀린 행이 있어도 나머지 행을 살릴 수 있음
+        self._draft = self._draft_llm.with_structured_output(RiskAssessmentOutput.model_json_schema(), include_raw=True)
+        self._expert = self.model.with_structured_output(RiskAssessmentOutput, include_raw=True)
+        self._expert_rows = self.model.with_structured_output(RiskRowsOutput, include_raw=True)
+        try:
+            self._articles = law_articles(self.faiss_vectorstore(self.law_index))
+        except Exception as e:
+            logger.warning(f"🔸 Law index {self.law_index} unavailable; skipping 관련근거 check: {e}")
+        return self._prompt_stage | RunnableLambda(self.cascade, afunc=self.acascade, name="cascade")
+
+    # ── 단계별 helper (sync / async 공용) ─────────────────────────
+    def review(self, draft: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]], List[Optional[RiskItemV3]], Dict[int, List[str]]]:
+        header, raw_rows, rows = parse_draft(draft["raw"])
+        return header, raw_rows, rows, check_rows(rows, self._articles)
+
+    def plan(self, header: Optional[Dict[str, Any]], rows: List[Optional[RiskItemV3]], failures: Dict[int, List[str]]) -> str:
+        if header is None or not rows or len(failures) > self.max_failed_ratio * len(rows):
+            return "full"
+        return "row" if failures else "none"
+
+    def fix_prompt(self, prompt_value: PromptValue, raw_rows: List[Dict[str, Any]], rows: List[Optional[RiskItemV3]], failures: Dict[int, List[str]]) -> ChatPromptValue:
+        kept = [row.유해위험요인 for index, row in enumerate(rows) if index not in failures]
+        failed = "\n".join(
+            f"- {json.dumps(raw_rows[index], ensure_ascii=False)}\n  사유: {', '.join(REASONS[reason] for reason in reasons)}"
+            for index, reasons in failures.items()
+        )
+        instruction = (
+            "아래 위험성평가표 항목은 검증을 통과하지 못했습니다. 같은 작업 정보와 참고자료를 바탕으로 각 항목을 고쳐 "
+            "같은 순서로 다시 작성하고, 고친 항목만 `위험성평가표`로 반환하십시오.\n"
+            f"이미 확정된 유해위험요인 (중복 금지): {', '.join(kept) or '없음'}\n"
+            f"검증 실패 항목:\n{failed}"
+        )
+        return ChatPromptValue(messages=[*prompt_value.to_messages(), HumanMessage(content=instruction)])
+
+    def merge(self, header: Dict[str, Any], rows: List[Optional[RiskItemV3]], failures: Dict[int, List[str]], fixed: Optional[RiskRowsOutput]) -> RiskAssessmentOutput:
+        """실패한 행 자리에 다시 생성한 행을 순서대로 넣음 (모자라면 그 행은 버리고, 중복은 다시 걸러냄)"""
+        replacements = iter(fixed.위험성평가표 if fixed is not None else [])
+        merged, seen = [], set()
+        for index, row in enumerate(rows):
+            row = next(replacements, None) if index in failures else row
+            if row is None or normalize_text(row.유해위험요인) in seen:
+                continue
+            seen.add(normalize_text(row.유해위험요인))
+            merged.append(row)
+        return RiskAssessmentOutput(**{**header, "위험성평가표": merged})
+
+    @staticmethod
+    def renumber(output: RiskAssessmentOutput) -> RiskAssessmentOutput:
+        for number, row in enumerate(output.위험성평가표, start=1):
+            row.번호 = number
+        return output
+
+    @staticmethod
+    def parsed(result: Dict[str, Any]) -> Any:
+        if result.get("parsing_error") is not None:
+            raise result["parsing_error"]
+        return result["parsed"]
+
+    def finish(self, output: RiskAssessmentOutput, escalation: str, rows: int, failures: Dict[int, List[str]], draft: Dict[str, Any], expert: Optional[Dict[str, Any]], started: float, expert_seconds: Optional[float] = None) -> RiskAssessmentOutput:
+        cascade_stats.record(
+            route=self._route,
+            escalation=escalation,
+            rows=rows,
+            escalated_rows=rows if escalation == "full" else len(failures),
+            reasons=Counter(reason for reasons in failures.values() for reason in reasons),
+            draft_model=self.draft_model.split("/")[-1],
+            expert_model=self.model_name,
+            draft_usage=message_usage(draft["raw"]),
+            expert_usage=message_usage(expert["raw"]) if expert else message_usage(None),
+            seconds=time.perf_counter() - started,
+            expert_seconds=expert_seconds,
+        )
+        return self.renumber(output)
+
+    # ── 실행 ──────────────────────────────────────────────────
+    def cascade(self, prompt_value: PromptValue, config: RunnableConfig) -> RiskAssessmentOutput:
+        started = time.perf_counter()
+        draft = self._draft.invoke(prompt_value, config)
+        header, raw_rows, rows, failures = self.review(draft)
+        backend_registry.record(backend_key(self._draft_llm), time.perf_counter() - started, ok=header is not None)
+
+        escalation = self.plan(header, rows, failures)
+        if escalation == "full":
+            expert_started = time.perf_counter()
+            expert = self._expert.invoke(prompt_value, config)
+            expert_seconds = time.perf_counter() - expert_started
+            return self.finish(self.parsed(expert), escalation, len(rows), failures, draft, expert, started, expert_seconds)
+        if escalation == "row":
+            expert = self._expert_rows.invoke(self.fix_prompt(prompt_value, raw_rows, rows, failures), config)
+            return self.finish(self.merge(header, rows, failures, self.parsed(expert)), escalation, len(rows), failures, draft, expert, started)
+        return self.finish(self.merge(header, rows, failures, None), escalation, len(rows), failures, draft, None, started)
+
+    async def acascade(self, prompt_value: PromptValue, config: RunnableConfig) -> RiskAssessmentOutput:
+        started = time.perf_counter()
+        draft = await self._draft.ainvoke(prompt_value, config)
+        header, raw_rows, rows, failures = self.review(draft)
+        backend_registry.record(backend_key(self._draft_llm), time.perf_counter() - started, ok=header is not None)
+
+        escalation = self.plan(header, rows, failures)
+        if escalation == "full":
+            expert_started = time.perf_counter()
+            expert = await self._expert.ainvoke(prompt_value, config)
+            expert_seconds = time.perf_counter() - expert_started
+            return self.finish(self.parsed(expert), escalation, len(rows), failures, draft, expert, started, expert_seconds)
+        if escalation == "row":
+            expert = await self._expert_rows.ainvoke(self.fix_prompt(prompt_value, raw_rows, rows, failures), config)
+            return self.finish(self.merge(header, rows, failures, self.parsed(expert)), escalation, len(rows), failures, draft, expert, started)
+        return self.finish(self.merge(header, rows, failures, None), escalation, len(rows), failures, draft, None, started)
+
+    def _register_chain(self, **kwargs):
+        incorporation = kwargs.get("incorporation")
+        model = kwargs.get("model")
+        embeddings = kwargs.get("embeddings")
+        isollama = kwargs.get("isollama", False)
+
+        logger.debug(f"🔹 {incorporation = }, {model = }, {embeddings = }")
+
+        untag = lambda x: x.split(":")[0] if ":" in x else x
+
+        path = self._route = f"/{untag(model)}/pi-ratings/cascade"
+        chain = self.build_chain(
+            model=model if isollama else f"{incorporation}/{model}",
+            embeddings=f"{incorporation}/{embeddings}"
+        )
+
+        self.chain = {
+            "chain": self.with_response_cache(chain, namespace=path, mapping=risk_assessment_map),
+            "path": path,
+            "input_type": RiskAssessmentInput,
+            "output_type": RiskAssessmentOutput
+        }
+
+
+
+__all__ = ["ProbabilityImpactRatingCascadeV1", "RiskRowsOutput", "check_rows", "law_articles", "law_citations"]
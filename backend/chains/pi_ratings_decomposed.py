@@ -0,0 +1,229 @@
+"""위험성평가 분할 체인 (긴 작업내용 → 세부 작업별 병렬 생성 → 하나의 위험성평가표)"""
+
+import os, re
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from schemas import RiskAssessmentInput, RiskAssessmentOutput, risk_assessment_map
+from models import FaissBatchRetriever, to_plain
+from utils import get_logger, model_call, normalize_text
+
+from .pi_ratings import ProbabilityImpactRatingV1, merge_dicts_as_str
+from .pi_ratings_bulk import NO_IMAGE
+
+
+logger = get_logger(__name__)
+
+DECOMPOSE_SPLITTER: str = os.getenv("DECOMPOSE_SPLITTER", "rule")  # rule | llm
+DECOMPOSE_MODEL: str = os.getenv("DECOMPOSE_MODEL", "openai/gpt-4o-mini")  # `llm` 분할에 쓰는 모델
+DECOMPOSE_MAX_SUBTASKS: int = int(os.getenv("DECOMPOSE_MAX_SUBTASKS", "4"))
+DECOMPOSE_MIN_CHARS: int = int(os.getenv("DECOMPOSE_MIN_CHARS", "2"))  # 문장 속에서 이보다 짧은 조각은 앞 조각에 붙임
+
+BULLET = re.compile(r"^\s*(?:[-•·*▪■□○●◦]|\d+[.)]|[①-⑳]|[가-하][.)])\s*")
+SENTENCE_END = re.compile(r"(?<=[.!?。;])\s+|\s*\n+\s*")
+CLAUSE_END = re.compile(r"(?<=[며고])\s*,\s+")  # "…절취가 포함되며, 구조물 공사로는 …"
+PREAMBLE = re.compile(r"(?:다음과|아래와)\s*같")
+
+
+
+class SubtaskOutput(BaseModel):
+    subtasks: List[str] = Field(description="작업내용을 공종·작업 단위로 나눈 세부 작업 목록. 원문 표현을 그대로 사용")
+
+
+
+def split_task_description(text: str, max_subtasks: int = DECOMPOSE_MAX_SUBTASKS, min_chars: int = DECOMPOSE_MIN_CHARS) -> List[str]:
+    """
+    작업내용 → 세부 작업 목록 (규칙 기반).
+
+    줄·글머리표·문장, 그리고 `~며,` / `~고,`로 이어진 절 단위로 나누고
+    "다음과 같습니다"나 `…:` 같은 머리말은 버립니다. 문장 속 짧은 조각만 앞 조각에 붙이고 (줄·글머리표 항목은 짧아도 그대로),
+    `max_subtasks`개를 넘으면 이웃끼리 고르게 묶습니다.
+    """
+    lines = [line for line in (text or "").splitlines() if line.strip()]
+    listed = len(lines) > 1 or any(BULLET.match(line) for line in lines)
+
+    pieces: List[Tuple[str, bool]] = []  # (조각, 줄·글머리표 항목인지)
+    for line in lines:
+        for sentence in SENTENCE_END.split(BULLET.sub("", line)):
+            for clause in CLAUSE_END.split(sentence):
+                clause = clause.strip(" ,.")
+                if clause and not clause.endswith(":") and not (PREAMBLE.search(clause) and len(clause) < 30):
+                    pieces.append((clause, listed))
+
+    subtasks: List[str] = []
+    for piece, item in pieces:
+        if subtasks and not item and len(piece) < min_chars:
+            subtasks[-1] = f"{subtasks[-1]}, {piece}"
+        else:
+            subtasks.append(piece)
+
+    if len(subtasks) > max_subtasks > 0:
+        size, extra = divmod(len(subtasks), max_subtasks)
+        groups, start = [], 0
+        for group in range(max_subtasks):
+            end = start + size + (group < extra)
+            groups.append(", ".join(subtasks[start:end]))
+            start = end
+        subtasks = groups
+    return subtasks
+
+
+
+class ProbabilityImpactRatingDecomposedV1(ProbabilityImpactRatingV1):
+    """
+    하루 작업 전체가 적힌 긴 `task_description`을 세부 작업으로 나눠 위험성평가를 병렬로 생성합니다.
+
+    0. 사진은 한 번만 받아서 축소하고, 이미지 위험요인도 한 번만 추출 (검색에만 쓰고 세부 작업 호출에는 사진을 다시 보내지 않음)
+    1. 작업내용을 세부 작업으로 분할 (`DECOMPOSE_SPLITTER`: 규칙 기반 `rule` 또는 싼 모델 `llm`)
+    2. 세부 작업별 검색 질의를 임베딩·FAISS 검색 한 번으로 처리
+    3. 세부 작업별 LLM 호출을 `max_concurrency` 만큼 병렬로 실행
+    4. 결과를 합쳐 같은 유해위험요인은 한 번만 남기고 `번호`를 1부터 다시 매김
+
+    세부 작업이 하나뿐이면 일반 위험성평가와 같이 한 번만 호출합니다.
+    """
+    splitter: ClassVar[str] = DECOMPOSE_SPLITTER
+    max_subtasks: ClassVar[int] = DECOMPOSE_MAX_SUBTASKS
+    max_concurrency: ClassVar[int] = DECOMPOSE_MAX_SUBTASKS
+
+    _reference_retriever: FaissBatchRetriever
+    _image_stage: Runnable
+    _image_risks: Runnable
+    _generate: Runnable
+    _split_chain: Optional[Runnable] = None
+
+    def chain_call(self, model, embeddings):
+        super().chain_call(model, embeddings)
+        self._reference_retriever = FaissBatchRetriever(self.faiss_vectorstore(self.reference_index), k=self.reference_k)
+        self._image_stage = self.image_stage()
+        self._image_risks = self.image_risks_chain()
+        self._generate = self._prompt_chain | self._structured_output
+        if self.splitter == "llm":
+            self._split_chain = model_call(DECOMPOSE_MODEL).with_structured_output(SubtaskOutput)
+        return RunnableLambda(self.decompose, afunc=self.adecompose, name="pi_ratings_decomposed")
+
+    # ── 분할 ──────────────────────────────────────────────────
+    def split_prompt(self, text: str) -> str:
+        return (
+            "다음 건설 현장 작업내용을 위험성평가를 따로 작성할 수 있는 세부 작업(공종·작업 단위)으로 나누십시오. "
+            f"최대 {self.max_subtasks}개로, 각 항목은 원문 표현을 그대로 사용하고 머리말은 제외하십시오.\n\n{text}"
+        )
+
+    def subtasks(self, text: str, output: Optional[SubtaskOutput] = None) -> List[str]:
+        if output is not None:
+            subtasks = [subtask.strip() for subtask in output.subtasks if subtask.strip()][:self.max_subtasks]
+            if subtasks:
+                return subtasks
+        return split_task_description(text, self.max_subtasks) or [text]
+
+    def split(self, text: str, config: Optional[RunnableConfig] = None) -> List[str]:
+        output = None
+        if self._split_chain is not None:
+            try:
+                output = self._split_chain.invoke(self.split_prompt(text), config)
+            except Exception as e:
+                logger.warning(f"🔸 Task split failed; falling back to rules: {e}")
+        return self.subtasks(text, output)
+
+    async def asplit(self, text: str, config: Optional[RunnableConfig] = None) -> List[str]:
+        output = None
+        if self._split_chain is not None:
+            try:
+                output = await self._split_chain.ainvoke(self.split_prompt(text), config)
+            except Exception as e:
+                logger.warning(f"🔸 Task split failed; falling back to rules: {e}")
+        return self.subtasks(text, output)
+
+    # ── 세부 작업 입력 ─────────────────────────────────────────
+    def queries(self, data: Dict[str, Any], subtasks: List[str], hazards: str) -> List[str]:
+        dict2str = self.get_dict2str(mapping=risk_assessment_map)
+        return [
+            merge_dicts_as_str({"위험 요인": hazards, "작업 정보": dict2str({**data, "task_description": subtask})})
+            for subtask in subtasks
+        ]
+
+    def items(self, data: Dict[str, Any], subtasks: List[str], searched: List[List[Any]]) -> List[Dict[str, Any]]:
+        """세부 작업별 생성 입력. 사진은 위험요인 추출·검색에만 쓰고 세부 작업 호출마다 다시 보내지 않음"""
+        base = {key: value for key, value in data.items() if key != "site_image"}
+        return [
+            {**base, "task_description": subtask, "reference": self.format_docs(self._reference_packer(docs))}
+            for subtask, docs in zip(subtasks, searched)
+        ]
+
+    def batch_config(self, config: Optional[RunnableConfig]) -> RunnableConfig:
+        return {**(config or {}), "max_concurrency": self.max_concurrency}
+
+    # ── 병합 ──────────────────────────────────────────────────
+    def merge(self, data: Dict[str, Any], subtasks: List[str], outputs: List[Any]) -> RiskAssessmentOutput:
+        """세부 작업 순서대로 행을 이어 붙이고, 같은 유해위험요인·기타 제언은 처음 것만 남긴 뒤 `번호`를 다시 매김"""
+        results = []
+        for subtask, output in zip(subtasks, outputs):
+            if isinstance(output, BaseException):
+                logger.warning(f"🔸 Subtask failed ({subtask[:30]}…): {output}")
+            else:
+                results.append(output)
+        if not results:
+            raise next(output for output in outputs if isinstance(output, BaseException))
+
+        rows, seen = [], set()
+        for output in results:
+            for row in output.위험성평가표:
+                key = normalize_text(row.유해위험요인)
+                if key in seen:
+                    continue
+                seen.add(key)
+                rows.append(row.model_copy(update={"번호": len(rows) + 1}))
+
+        logger.debug(f"🔹 decomposed: {len(subtasks)} subtasks → {len(rows)} rows")
+        return RiskAssessmentOutput(
+            공종=results[0].공종,
+            공정=results[0].공정,
+            작업명=data.get("task_description", ""),
+            위험성평가표=rows,
+            기타=list(dict.fromkeys(note for output in results for note in output.기타)),
+        )
+
+    # ── 실행 ──────────────────────────────────────────────────
+    def decompose(self, data: Dict[str, Any], config: RunnableConfig) -> RiskAssessmentOutput:
+        data = self._image_stage.invoke(to_plain(data), config)
+        hazards = self._image_risks.invoke(data, config) if data["site_image"] else NO_IMAGE
+        subtasks = self.split(data.get("task_description", ""), config)
+        searched = self._reference_retriever.retrieve_many(self.queries(data, subtasks, hazards))
+        outputs = self._generate.batch(self.items(data, subtasks, searched), self.batch_config(config), return_exceptions=True)
+        return self.merge(data, subtasks, outputs)
+
+    async def adecompose(self, data: Dict[str, Any], config: RunnableConfig) -> RiskAssessmentOutput:
+        data = await self._image_stage.ainvoke(to_plain(data), config)
+        hazards = await self._image_risks.ainvoke(data, config) if data["site_image"] else NO_IMAGE
+        subtasks = await self.asplit(data.get("task_description", ""), config)
+        searched = await self._reference_retriever.aretrieve_many(self.queries(data, subtasks, hazards))
+        outputs = await self._generate.abatch(self.items(data, subtasks, searched), self.batch_config(config), return_exceptions=True)
+        return self.merge(data, subtasks, outputs)
+
+    def _register_chain(self, **kwargs):
+        incorporation = kwargs.get("incorporation")
+        model = kwargs.get("model")
+        embeddings = kwargs.get("embeddings")
+        isollama = kwargs.get("isollama", False)
+
+        logger.debug(f"🔹 {incorporation = }, {model = }, {embeddings = }")
+
+        untag = lambda x: x.split(":")[0] if ":" in x else x
+
+        path = f"/{untag(model)}/pi-ratings/decomposed"
+        chain = self.build_chain(
+            model=model if isollama else f"{incorporation}/{model}",
+            embeddings=f"{incorporation}/{embeddings}"
+        )
+
+        self.chain = {
+            "chain": self.with_response_cache(chain, namespace=path, mapping=risk_assessment_map),
+            "path": path,
+            "input_type": RiskAssessmentInput,
+            "output_type": RiskAssessmentOutput
+        }
+
+
+
+__all__ = ["ProbabilityImpactRatingDecomposedV1", "SubtaskOutput", "split_task_description"]
@@ -0,0 +1,81 @@
+"""위험성평가 행 단위 스트리밍 체인"""
+
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+from langchain_core.runnables import RunnableGenerator
+
+from schemas import RiskAssessmentInput, RiskAssessmentOutput, RiskAssessmentStreamEvent, risk_assessment_map
+from models import StructuredRowStream, json_stream_model
+from utils import get_logger
+
+from .pi_ratings import ProbabilityImpactRatingV1
+
+
+logger = get_logger(__name__)
+
+
+
+class ProbabilityImpactRatingStreamV1(ProbabilityImpactRatingV1):
+    """
+    `ProbabilityImpactRatingV1`과 같은 입력·프롬프트로, 위험성평가표 항목이 생성되는 대로 한 건씩 내보냅니다.
+
+    - `/stream`: `row` 이벤트(항목 하나)가 완성 순서대로, 마지막에 `final` 이벤트(검증된 전체 결과)
+    - `/invoke`: 같은 이벤트 목록 전체
+    - 다른 위험성평가 route와 같이 응답 캐시와 hedging(`HEDGING`)을 거침 (캐시 hit이면 이벤트 목록을 한 번에)
+    """
+    _row_stream: StructuredRowStream
+
+    def chain_call(self, model, embeddings):
+        super().chain_call(model, embeddings)
+        self._row_stream = StructuredRowStream(
+            model=self.hedged(lambda model: json_stream_model(model, RiskAssessmentOutput)),
+            schema=RiskAssessmentOutput,
+            key="위험성평가표",
+            fallback=self._structured_output,
+        )
+        return RunnableGenerator(self.rows, self.arows, name="pi_ratings_stream")
+
+    @staticmethod
+    def event(kind: str, index: int, value: Any) -> List[RiskAssessmentStreamEvent]:
+        if kind == "row":
+            return [RiskAssessmentStreamEvent(event="row", index=index, row=value)]
+        return [RiskAssessmentStreamEvent(event="final", output=value)]
+
+    def rows(self, inputs: Iterator[Dict[str, Any]]) -> Iterator[List[RiskAssessmentStreamEvent]]:
+        for data in inputs:
+            prompt_value = self._prompt_stage.invoke(data)
+            for kind, index, value in self._row_stream.stream(prompt_value):
+                yield self.event(kind, index, value)
+
+    async def arows(self, inputs: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[List[RiskAssessmentStreamEvent]]:
+        async for data in inputs:
+            prompt_value = await self._prompt_stage.ainvoke(data)
+            async for kind, index, value in self._row_stream.astream(prompt_value):
+                yield self.event(kind, index, value)
+
+    def _register_chain(self, **kwargs):
+        incorporation = kwargs.get("incorporation")
+        model = kwargs.get("model")
+        embeddings = kwargs.get("embeddings")
+        isollama = kwargs.get("isollama", False)
+
+        logger.debug(f"🔹 {incorporation = }, {model = }, {embeddings = }")
+
+        untag = lambda x: x.split(":")[0] if ":" in x else x
+
+        path = f"/{untag(model)}/pi-ratings/rows"
+        chain = self.build_chain(
+            model=model if isollama else f"{incorporation}/{model}",
+            embeddings=f"{incorporation}/{embeddings}"
+        )
+
+        self.chain = {
+            "chain": self.with_response_cache(chain, namespace=path, mapping=risk_assessment_map),
+            "path": path,
+            "input_type": RiskAssessmentInput,
+            "output_type": List[RiskAssessmentStreamEvent]
+        }
+
+
+
+__all__ = ["ProbabilityImpactRatingStreamV1"]
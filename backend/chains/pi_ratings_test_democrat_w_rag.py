@@ -24,23 +24,6 @@ class ProbabilityImpactRatingTestDemocratRAG(ChainBase):
         
         # Prompt
         self.prompt = "pi_rating_test_w_reference_v4"
-        def make_template(data):
-            _prompt = [
-                ("system", self.prompt["system"]),
-                ("user", self.prompt["user"].format(
-                    process_major_category=data["process_major_category"],
-                    process_sub_category=data["process_sub_category"],
-                    equipment= data["equipment"],
-                    material= data["material"],
-                    hazard= data["hazard"],
-                    reference=data["reference"],
-                    mitigation= data["mitigation"],
-                ))
-            ]
-            prompt_template = self.template_call("chat", _prompt)
-            logger.debug(f"🔹 {_prompt = }")
-            logger.debug(f"🔹 {prompt_template = }")
-            return prompt_template
 
         # Reference Retriever
         reference_chain = (
@@ -62,7 +45,7 @@ class ProbabilityImpactRatingTestDemocratRAG(ChainBase):
         })
 
         # Final Prompt Chain
-        prompt_chain = lambda x: make_template(x) | RunnablePassthrough()
+        prompt_chain = self.prompt_chain()
 
         # Final Chain
         chain = chain_init | prompt_chain | structured_output | self.printer
@@ -78,7 +61,7 @@ class ProbabilityImpactRatingTestDemocratRAG(ChainBase):
         untag = lambda x: x.split(":")[0] if ":" in x else x
         
         self.chain = {
-            "chain": self.chain_call(
+            "chain": self.build_chain(
                 model=f"{incorporation}/{model}",
                 embeddings=f"{incorporation}/{embeddings}"
             ),
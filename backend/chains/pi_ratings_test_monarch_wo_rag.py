@@ -1,7 +1,5 @@
 """250603_위험성평가 체인"""
 
-from langchain_core.runnables import RunnablePassthrough
-
 from schemas import RiskAssessmentEvalInputV2, RiskAssessmentEvalOutputV3
 from models import ChainBase
 from utils import get_logger
@@ -21,22 +19,6 @@ class ProbabilityImpactRatingTestMonarchWoRAG(ChainBase):
        
         # Prompt
         self.prompt = "pi_rating_test_no_guitar_wo_reference_v1"
-        def make_template(data):
-            _prompt = [
-                ("system", self.prompt["system"]),
-                ("user", self.prompt["user"].format(
-                    process_major_category=data["process_major_category"],
-                    process_sub_category=data["process_sub_category"],
-                    equipment= data["equipment"],
-                    material= data["material"],
-                    hazard= data["hazard"],
-                    mitigation= data["mitigation"],
-                ))
-            ]
-            prompt_template = self.template_call("chat", _prompt)
-            logger.debug(f"🔹 {_prompt = }")
-            logger.debug(f"🔹 {prompt_template = }")
-            return prompt_template
 
         # Input Configuration
         chain_init = self.parallel_init({
@@ -49,7 +31,7 @@ class ProbabilityImpactRatingTestMonarchWoRAG(ChainBase):
         })
 
         # Final Prompt Chain
-        prompt_chain = lambda x: make_template(x) | RunnablePassthrough()
+        prompt_chain = self.prompt_chain()
 
         # Final Chain
         chain = chain_init | self.printer | prompt_chain | self.printer | structured_output | self.printer
@@ -65,7 +47,7 @@ class ProbabilityImpactRatingTestMonarchWoRAG(ChainBase):
         untag = lambda x: x.split(":")[0] if ":" in x else x
         
         self.chain = {
-            "chain": self.chain_call(
+            "chain": self.build_chain(
                 model=f"{incorporation}/{model}",
                 embeddings=f"{incorporation}/{embeddings}"
             ),
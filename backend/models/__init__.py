@@ -1,2 +1,14 @@
+from .cache import *
+from .runnables import *
+from .vectorstore import *
+from .lazy import *
+from .metering import *
+from .coalesce import *
+from .prompts import *
+from .packing import *
+from .hedging import *
+from .cascade import *
+from .streaming import *
 from .chain import *
+from .registry import *
 from .router import *
\ No newline at end of file
@@ -0,0 +1,488 @@
+import asyncio, copy, hashlib, json, os, threading, time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import get_config_list
+
+from utils import span
+
+
+RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+RESPONSE_CACHE_DISTANCE: float = float(os.getenv("RESPONSE_CACHE_DISTANCE", "0.05"))  # cosine distance
+RESPONSE_CACHE_SIMILARITY: bool = os.getenv("RESPONSE_CACHE_SIMILARITY", "false").lower() == "true"
+RESPONSE_CACHE_HASH_IMAGES: bool = os.getenv("RESPONSE_CACHE_HASH_IMAGES", "false").lower() == "true"
+IMAGE_HAZARD_CACHE_SIZE: int = int(os.getenv("IMAGE_HAZARD_CACHE_SIZE", "4096"))
+IMAGE_HAZARD_DISTANCE: int = int(os.getenv("IMAGE_HAZARD_DISTANCE", "4"))  # dHash Hamming distance (64bit 중)
+
+
+
+def to_plain(data: Any) -> Any:
+    """pydantic 모델 등을 JSON 직렬화 가능한 기본 자료형으로 변환"""
+    if isinstance(data, BaseModel):
+        return data.model_dump()
+    if isinstance(data, dict):
+        return {str(k): to_plain(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_plain(v) for v in data]
+    return data
+
+
+def canonical_hash(data: Any) -> str:
+    """입력 데이터를 key 순서와 무관한 JSON으로 만든 뒤 sha256"""
+    raw = json.dumps(to_plain(data), sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    created: float
+    namespace: str
+    image_digest: Optional[str] = None
+
+
+
+class VectorIndex:
+    """
+    `(namespace, image_digest)` 하나의 정규화된 임베딩 행렬 (key당 한 행).
+    빈 행은 0으로 두고 재사용하므로 조회는 행렬-벡터 곱 한 번입니다.
+    """
+    def __init__(self, dim: int):
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.keys: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, key: str, vector: np.ndarray):
+        row = self.rows.get(key)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                row = len(self.keys)
+                self.keys.append(None)
+                if row >= len(self.matrix):
+                    self.matrix = np.vstack([self.matrix, np.zeros_like(self.matrix)])
+        self.matrix[row] = vector
+        self.keys[row] = key
+        self.rows[key] = row
+
+    def remove(self, key: str):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.matrix[row] = 0.0
+            self.keys[row] = None
+            self.free.append(row)
+
+    def nearest(self, vector: np.ndarray) -> Tuple[float, Optional[str]]:
+        """(cosine distance, key). 빈 행이 뽑히면 (유사도 0 이하뿐) 결과 없음"""
+        if not self.rows or vector.shape[0] != self.matrix.shape[1]:
+            return 1.0, None
+        similarities = self.matrix[:len(self.keys)] @ vector
+        row = int(np.argmax(similarities))
+        return 1.0 - float(similarities[row]), self.keys[row]
+
+
+def normalized(vector: List[float]) -> Optional[np.ndarray]:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else None
+
+
+
+class ResponseCache:
+    """
+    체인 응답 캐시.
+
+    - 정확히 같은 입력(`namespace` + canonical input hash)은 그대로 재사용합니다.
+    - `lookup_similar`는 같은 namespace·같은 이미지 조합 안에서 임베딩 거리가 `max_distance` 이하인 응답을 찾습니다.
+    - TTL이 지난 항목은 조회 시 버리고, `maxsize`를 넘으면 가장 오래 쓰이지 않은 항목부터 제거합니다.
+    """
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._indexes: Dict[Tuple[str, Optional[str]], VectorIndex] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created > self.ttl
+
+    def _drop(self, key: str, entry: CacheEntry):
+        """항목의 벡터를 지우고, 비게 된 index는 버림 (사진 조합마다 생기는 index가 쌓이지 않도록)"""
+        index_key = (entry.namespace, entry.image_digest)
+        index = self._indexes.get(index_key)
+        if index is not None:
+            index.remove(key)
+            if not len(index):
+                del self._indexes[index_key]
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[Any]:
+        """정확히 같은 key. 뒤이어 `lookup_similar`를 부를 때는 `count_miss=False` (hit/miss는 거기서 한 번만 집계)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                self._drop(key, entry)
+                entry = None
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def lookup_similar(self, namespace: str, vector: List[float], max_distance: float, image_digest: Optional[str] = None) -> Optional[Any]:
+        query = normalized(vector)
+        now = time.time()
+        with self._lock:
+            entry = None if query is None else self._nearest(namespace, image_digest, query, max_distance, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.similar_hits += 1
+            return entry.value
+
+    def _nearest(self, namespace: str, image_digest: Optional[str], query: np.ndarray, max_distance: float, now: float) -> Optional[CacheEntry]:
+        """`max_distance` 안의 가장 가까운 유효 항목 (lock 안에서 호출)"""
+        while (index := self._indexes.get((namespace, image_digest))) is not None:
+            distance, key = index.nearest(query)
+            if key is None or distance > max_distance:
+                return None
+            entry = self._entries[key]
+            if not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]  # 만료된 항목이 가장 가까우면 지우고 다음 후보
+            self._drop(key, entry)
+        return None
+
+    def set(self, key: str, value: Any, namespace: str, image_digest: Optional[str] = None, vector: Optional[List[float]] = None):
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._drop(key, previous)
+            self._entries[key] = CacheEntry(value=value, created=time.time(), namespace=namespace, image_digest=image_digest)
+            self._entries.move_to_end(key)
+            array = normalized(vector) if vector is not None else None
+            if array is not None:
+                index = self._indexes.get((namespace, image_digest))
+                if index is None or index.matrix.shape[1] != array.shape[0]:
+                    index = self._indexes[(namespace, image_digest)] = VectorIndex(array.shape[0])
+                index.add(key, array)
+            while len(self._entries) > self.maxsize:
+                evicted, entry = self._entries.popitem(last=False)
+                self._drop(evicted, entry)
+                self.evictions += 1
+
+    def bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        served = self.hits + self.similar_hits
+        total = served + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": round(served / total, 4) if total else None,
+        }
+
+
+response_cache = ResponseCache()
+
+
+
+class ImageHazardCache:
+    """
+    사진별 위험요인(`risk_items`) 캐시. key는 `(프롬프트 버전, 사진 dHash)`.
+
+    정확히 같은 hash가 없으면 같은 프롬프트 버전 안에서 Hamming 거리가 `max_distance` 이하인 사진을 찾습니다.
+    `maxsize`를 넘으면 가장 오래 쓰이지 않은 항목부터 제거합니다.
+    """
+    def __init__(self, maxsize: int = IMAGE_HAZARD_CACHE_SIZE, max_distance: int = IMAGE_HAZARD_DISTANCE):
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self._entries: OrderedDict[Tuple[str, int], List[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, version: str, image_hash: int) -> Optional[List[str]]:
+        with self._lock:
+            key = (version, image_hash)
+            if key not in self._entries and self.max_distance > 0:
+                near = [
+                    ((candidate ^ image_hash).bit_count(), (entry_version, candidate))
+                    for entry_version, candidate in self._entries
+                    if entry_version == version
+                ]
+                near = [item for item in near if item[0] <= self.max_distance]
+                if near:
+                    key = min(near)[1]
+                    self.near_hits += 1
+                    self._entries.move_to_end(key)
+                    return list(self._entries[key])
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return list(self._entries[key])
+
+    def set(self, version: str, image_hash: int, risk_items: List[str]):
+        with self._lock:
+            self._entries[(version, image_hash)] = list(risk_items)
+            self._entries.move_to_end((version, image_hash))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        served = self.hits + self.near_hits
+        total = served + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(served / total, 4) if total else None,
+        }
+
+
+image_hazard_cache = ImageHazardCache()
+
+
+
+Prepared = Tuple[str, Optional[str], dict]  # (cache key, image digest, plain input)
+
+
+class CachedChain(Runnable):
+    """
+    `ResponseCache`를 거치는 체인 (`ChainBase.with_response_cache`가 반환).
+
+    `prepare(input)`이 `None`이면 캐시를 건너뛰고, `embed`가 있으면 정확히 같은 key가 없을 때 유사 입력을 찾습니다.
+    `batch`/`abatch`는 hit을 먼저 채우고 miss만 (같은 key는 한 번만) 모아 `chain.batch` 한 번으로 보냅니다.
+    `stream`/`astream`은 hit이면 결과 하나를, miss면 안쪽 체인의 chunk를 그대로 흘려보내고 끝까지 받은 뒤 합친 결과를 캐시합니다.
+    """
+    def __init__(self,
+                 chain: Runnable,
+                 namespace: str,
+                 prepare: Callable[[Any], Optional[Prepared]],
+                 embed: Optional[Callable[[dict], List[float]]] = None,
+                 aembed: Optional[Callable[[dict], Awaitable[List[float]]]] = None,
+                 max_distance: float = RESPONSE_CACHE_DISTANCE,
+                 cache: ResponseCache = response_cache):
+        self.chain = chain
+        self.namespace = namespace
+        self.prepare = prepare
+        self.embed = embed
+        self.aembed = aembed
+        self.max_distance = max_distance
+        self.cache = cache
+        self.name = "response_cache"
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None):
+        return self.chain.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None):
+        return self.chain.get_output_schema(config)
+
+    # ── 조회·저장 ──────────────────────────────────────────────
+    def _lookup(self, prepared: Prepared) -> Tuple[Optional[Any], Optional[List[float]]]:
+        """(hit, 유사도 조회에 쓴 벡터)"""
+        key, image_digest, plain = prepared
+        hit = self.cache.get(key, count_miss=self.embed is None)
+        if hit is not None or self.embed is None:
+            return hit, None
+        vector = self.embed(plain)
+        return self.cache.lookup_similar(self.namespace, vector, self.max_distance, image_digest), vector
+
+    async def _alookup(self, prepared: Prepared) -> Tuple[Optional[Any], Optional[List[float]]]:
+        key, image_digest, plain = prepared
+        hit = self.cache.get(key, count_miss=self.aembed is None)
+        if hit is not None or self.aembed is None:
+            return hit, None
+        vector = await self.aembed(plain)
+        return self.cache.lookup_similar(self.namespace, vector, self.max_distance, image_digest), vector
+
+    def _store(self, prepared: Prepared, result: Any, vector: Optional[List[float]]):
+        key, image_digest, _ = prepared
+        self.cache.set(key, result, self.namespace, image_digest, vector)
+
+    # ── invoke ────────────────────────────────────────────────
+    # 요청 단위 root span (하위 `@trace` 단계들이 같은 trace로 묶임)
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        with span(self.namespace):
+            prepared = self.prepare(input)
+            if prepared is None:
+                return self.chain.invoke(input, config, **kwargs)
+            hit, vector = self._lookup(prepared)
+            if hit is not None:
+                return copy.deepcopy(hit)
+            result = self.chain.invoke(input, config, **kwargs)
+            self._store(prepared, result, vector)
+            return result
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        with span(self.namespace):
+            prepared = self.prepare(input)
+            if prepared is None:
+                return await self.chain.ainvoke(input, config, **kwargs)
+            hit, vector = await self._alookup(prepared)
+            if hit is not None:
+                return copy.deepcopy(hit)
+            result = await self.chain.ainvoke(input, config, **kwargs)
+            self._store(prepared, result, vector)
+            return result
+
+    # ── stream ────────────────────────────────────────────────
+    @staticmethod
+    def _combine(final: Any, chunk: Any) -> Tuple[Any, bool]:
+        """(합친 결과, 합칠 수 있었는지). 합칠 수 없는 chunk가 오면 그 stream은 캐시하지 않음"""
+        if final is None:
+            return chunk, True
+        try:
+            return final + chunk, True
+        except TypeError:
+            return None, False
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        with span(self.namespace, stream=True):
+            prepared = self.prepare(input)
+            if prepared is None:
+                yield from self.chain.stream(input, config, **kwargs)
+                return
+            hit, vector = self._lookup(prepared)
+            if hit is not None:
+                yield copy.deepcopy(hit)
+                return
+            final, combinable = None, True
+            for chunk in self.chain.stream(input, config, **kwargs):
+                yield chunk
+                if combinable:
+                    final, combinable = self._combine(final, chunk)
+            if combinable and final is not None:
+                self._store(prepared, final, vector)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        with span(self.namespace, stream=True):
+            prepared = self.prepare(input)
+            if prepared is None:
+                async for chunk in self.chain.astream(input, config, **kwargs):
+                    yield chunk
+                return
+            hit, vector = await self._alookup(prepared)
+            if hit is not None:
+                yield copy.deepcopy(hit)
+                return
+            final, combinable = None, True
+            async for chunk in self.chain.astream(input, config, **kwargs):
+                yield chunk
+                if combinable:
+                    final, combinable = self._combine(final, chunk)
+            if combinable and final is not None:
+                self._store(prepared, final, vector)
+
+    # ── batch ─────────────────────────────────────────────────
+    def _pending(self, prepared: List[Optional[Prepared]], looked_up: List[tuple], results: List[Any]) -> Dict[Any, List[int]]:
+        """hit은 `results`에 채우고, miss는 `{key: [index, ...]}` (캐시를 건너뛰는 입력은 index를 key로)"""
+        pending: Dict[Any, List[int]] = {}
+        for index, (item, (hit, _)) in enumerate(zip(prepared, looked_up)):
+            if hit is not None:
+                results[index] = copy.deepcopy(hit)
+            else:
+                pending.setdefault(item[0] if item is not None else index, []).append(index)
+        return pending
+
+    def _fill(self, pending: Dict[Any, List[int]], outputs: List[Any], prepared: List[Optional[Prepared]], looked_up: List[tuple], results: List[Any]):
+        for indexes, output in zip(pending.values(), outputs):
+            first = indexes[0]
+            if prepared[first] is not None and not isinstance(output, Exception):
+                self._store(prepared[first], output, looked_up[first][1])
+            for position, index in enumerate(indexes):
+                results[index] = output if position == 0 else copy.deepcopy(output)
+
+    def batch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        if not inputs:
+            return []
+        configs = get_config_list(config, len(inputs))
+        with span(self.namespace, batch=len(inputs)):
+            prepared = [self.prepare(input) for input in inputs]
+            looked_up = [self._lookup(item) if item is not None else (None, None) for item in prepared]
+            results: List[Any] = [None] * len(inputs)
+            pending = self._pending(prepared, looked_up, results)
+            if pending:
+                firsts = [indexes[0] for indexes in pending.values()]
+                outputs = self.chain.batch([inputs[i] for i in firsts], [configs[i] for i in firsts], return_exceptions=return_exceptions, **kwargs)
+                self._fill(pending, outputs, prepared, looked_up, results)
+            return results
+
+    async def abatch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        if not inputs:
+            return []
+        configs = get_config_list(config, len(inputs))
+        with span(self.namespace, batch=len(inputs)):
+            prepared = [self.prepare(input) for input in inputs]
+
+            async def lookup(item: Optional[Prepared]) -> tuple:
+                return await self._alookup(item) if item is not None else (None, None)
+
+            looked_up = list(await asyncio.gather(*(lookup(item) for item in prepared)))
+            results: List[Any] = [None] * len(inputs)
+            pending = self._pending(prepared, looked_up, results)
+            if pending:
+                firsts = [indexes[0] for indexes in pending.values()]
+                outputs = await self.chain.abatch([inputs[i] for i in firsts], [configs[i] for i in firsts], return_exceptions=return_exceptions, **kwargs)
+                self._fill(pending, outputs, prepared, looked_up, results)
+            return results
+
+
+
+__all__ = [
+    "CachedChain",
+    "ResponseCache",
+    "response_cache",
+    "ImageHazardCache",
+    "image_hazard_cache",
+    "canonical_hash",
+    "to_plain",
+    "RESPONSE_CACHE_DISTANCE",
+    "RESPONSE_CACHE_SIMILARITY",
+    "RESPONSE_CACHE_HASH_IMAGES",
+]
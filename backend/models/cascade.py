@@ -0,0 +1,115 @@
+"""
+모델 cascade 집계.
+
+싼 모델(draft)로 먼저 생성하고 로컬 검증을 통과하지 못한 요청(또는 행)만 비싼 모델(expert)로 다시 생성할 때,
+escalation 비율과 "처음부터 expert로 생성했을 때" 대비 아낀 비용·지연 시간을 route별로 집계합니다.
+
+- 비용 기준선: draft가 쓴 토큰을 expert 단가로 계산한 값 (`utils.usage_cost`)
+- 지연 시간 기준선: 요청 전체를 expert로 다시 생성할 때 잰 expert 호출 시간의 route별 최근 중앙값 (표본이 `CASCADE_LATENCY_SAMPLES`개보다 적으면 집계하지 않음)
+"""
+
+import os, statistics, threading
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Optional
+
+from langchain_core.messages import BaseMessage
+
+from utils import get_logger, usage_cost
+
+
+
+logger = get_logger(__name__)
+
+CASCADE_LATENCY_SAMPLES: int = int(os.getenv("CASCADE_LATENCY_SAMPLES", "5"))
+CASCADE_LATENCY_WINDOW: int = int(os.getenv("CASCADE_LATENCY_WINDOW", "100"))
+
+
+
+def message_usage(message: Optional[BaseMessage]) -> Dict[str, int]:
+    """AIMessage `usage_metadata` → `usage_cost` 인자"""
+    metadata = getattr(message, "usage_metadata", None) or {}
+    return {
+        "prompt_tokens": metadata.get("input_tokens", 0),
+        "cached_tokens": (metadata.get("input_token_details") or {}).get("cache_read", 0) or 0,
+        "completion_tokens": metadata.get("output_tokens", 0),
+    }
+
+
+
+class CascadeStats:
+    def __init__(self, min_samples: int = CASCADE_LATENCY_SAMPLES, window: int = CASCADE_LATENCY_WINDOW):
+        self.min_samples = min_samples
+        self.window = window
+        self._routes: Dict[str, Dict[str, Any]] = {}
+        self._expert_seconds: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, route: str) -> Dict[str, Any]:
+        return self._routes.setdefault(route, {
+            "requests": 0, "accepted": 0, "row_escalations": 0, "full_escalations": 0,
+            "rows": 0, "escalated_rows": 0, "reasons": Counter(),
+            "cost": 0.0, "baseline_cost": 0.0, "seconds": 0.0, "baseline_seconds": 0.0, "timed_requests": 0,
+        })
+
+    def record(self,
+               route: str,
+               escalation: str,
+               rows: int,
+               escalated_rows: int,
+               reasons: Counter,
+               draft_model: str,
+               expert_model: str,
+               draft_usage: Dict[str, int],
+               expert_usage: Dict[str, int],
+               seconds: float,
+               expert_seconds: Optional[float] = None):
+        """
+        `escalation`: `none` (draft 그대로), `row` (실패한 행만), `full` (요청 전체).
+        `expert_seconds`: `full`일 때 expert 호출에 걸린 시간 (지연 시간 기준선 표본)
+        """
+        cost = (usage_cost(draft_model, **draft_usage) or 0.0) + (usage_cost(expert_model, **expert_usage) or 0.0)
+        baseline_cost = usage_cost(expert_model, **draft_usage) or 0.0
+        with self._lock:
+            samples = self._expert_seconds.setdefault(route, deque(maxlen=self.window))
+            if expert_seconds is not None:
+                samples.append(expert_seconds)
+            baseline_seconds = statistics.median(samples) if len(samples) >= self.min_samples else None
+            entry = self._entry(route)
+            entry["requests"] += 1
+            entry["accepted" if escalation == "none" else f"{escalation}_escalations"] += 1
+            entry["rows"] += rows
+            entry["escalated_rows"] += escalated_rows
+            entry["reasons"].update(reasons)
+            entry["cost"] += cost
+            entry["baseline_cost"] += baseline_cost
+            if baseline_seconds is not None:
+                entry["seconds"] += seconds
+                entry["baseline_seconds"] += baseline_seconds
+                entry["timed_requests"] += 1
+        logger.debug(f"🔹 Cascade {route}: {escalation} ({escalated_rows}/{rows} rows, {dict(reasons)})")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {route: {**entry, "reasons": dict(entry["reasons"])} for route, entry in self._routes.items()}
+        return {
+            route: {
+                "requests": entry["requests"],
+                "accepted": entry["accepted"],
+                "row_escalations": entry["row_escalations"],
+                "full_escalations": entry["full_escalations"],
+                "escalation_rate": round(1 - entry["accepted"] / entry["requests"], 4) if entry["requests"] else None,
+                "escalated_row_rate": round(entry["escalated_rows"] / entry["rows"], 4) if entry["rows"] else None,
+                "reasons": entry["reasons"],
+                "cost": round(entry["cost"], 6),
+                "cost_saved": round(entry["baseline_cost"] - entry["cost"], 6),
+                "seconds_saved": round(entry["baseline_seconds"] - entry["seconds"], 3) if entry["timed_requests"] else None,
+            }
+            for route, entry in routes.items()
+        }
+
+
+cascade_stats = CascadeStats()
+
+
+
+__all__ = ["CascadeStats", "cascade_stats", "message_usage"]
@@ -1,34 +1,48 @@
-import base64, os, re
-from typing import Any, Callable, Dict, List, Optional, Union
+import base64, re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-import yaml
-from pydantic import BaseModel
-from langchain_core.runnables import RunnableParallel
+from pydantic import BaseModel, ConfigDict
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda, RunnableParallel
 # from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from langchain_community.vectorstores import FAISS  # , Chroma
+from langchain_community.vectorstores import FAISS
 from langchain_core.vectorstores import VectorStore, VectorStoreRetriever  # , InMemoryVectorStore
 from langchain.prompts import BasePromptTemplate, PromptTemplate, ChatPromptTemplate, FewShotPromptTemplate, PipelinePromptTemplate
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.embeddings import Embeddings
-from rich.console import Console
-from rich.table import Table
-from rich.box import ROUNDED
 
-from utils import model_call, print_return  # , quantized_model_call
+from utils import ImageProcessor, image_processor, model_call, ollama_call, ollama_host, plain_table, trace  # , quantized_model_call
+from .cache import (CachedChain, 
+                    ResponseCache, 
+                    response_cache, 
+                    canonical_hash, 
+                    to_plain, 
+                    RESPONSE_CACHE_DISTANCE, 
+                    RESPONSE_CACHE_SIMILARITY, 
+                    RESPONSE_CACHE_HASH_IMAGES)
+from .hedging import HEDGING, HedgedRunnable, backend_key, secondary_address
+from .lazy import LazyChain, LAZY_CHAINS
+from .packing import CONTEXT_PACKING, ContextPacker, context_budget, render_metadata
+from .prompts import IMAGES_PLACEHOLDER, image_messages, prompt_registry
+from .runnables import BatchedRunnableParallel, InlineLambda, inline, inline_method
+from .vectorstore import FaissBatchRetriever, vectorstore_registry
 
 
-PROMPT_PATH: str = "prompts.yaml"
-FAISS_PATH: str = "assets/faiss"
-OLLAMA_URL = "http://snucem1.iptime.org:11434"
+# key와 key 사이를 value로 인식하여 정확히 분리 (value가 여러 줄이거나 비어 있어도 안전)
+TABLE_PAIR_PATTERN = re.compile(r'([^:\n]+):\s*((?:(?![^:\n]+:).)*)', re.DOTALL)
+TABLE_COLUMN_ORDER: List[str] = ["공정", "세부공정", "설비", "물질", "유해위험요인", "감소대책", "사고분류"]
 
 
 
 class ChainBase(BaseModel):
+    model_config = ConfigDict(ignored_types=(inline_method,))
+
     _model: BaseLanguageModel
     _embeddings: Embeddings
-    _prompt: Dict[str, str | list | dict]
+    _prompt_name: Optional[str] = None
     _chain: Dict[str, Any]
+    _lazy: bool = LAZY_CHAINS
+    _lazy_chain: Optional[LazyChain] = None
 
     @property
     def chain(self) -> Dict[str, Any]:
@@ -49,13 +63,13 @@ class ChainBase(BaseModel):
             self._model = model_call(value)
         except:
             print(f"Model not found: {value}")
-            from langchain_ollama import ChatOllama
-            if "gpt-oss" in value:
-                self._model = ChatOllama(model=value, base_url="ollama.seexr.co.kr")
-            else:
-                self._model = ChatOllama(model=value, base_url=OLLAMA_URL)
+            self._model = ollama_call(model=value, base_url=ollama_host(value))
             # self._model = quantized_model_call(value)
 
+    @property
+    def model_name(self) -> str:
+        return getattr(self._model, "model_name", None) or getattr(self._model, "model", None) or type(self._model).__name__
+
     @property
     def embeddings(self) -> Embeddings:
         return self._embeddings
@@ -67,20 +81,41 @@ class ChainBase(BaseModel):
     # Prompt
     @property
     def prompt(self) -> Dict[str, str | list | dict]:
-        return self._prompt
+        return prompt_registry.get(self._prompt_name)
     
     @prompt.setter
     def prompt(self, value: str):
-        with open(PROMPT_PATH, "r", encoding="utf-8") as f:
-            raw = yaml.safe_load(f)
-        self._prompt = raw[value]
+        prompt_registry.get(value)  # 없는 이름이면 여기서 KeyError
+        self._prompt_name = value
+
+    def prompt_chain(self, images_key: Optional[str] = None) -> Runnable:
+        """
+        현재 프롬프트(`self.prompt = "..."`)의 미리 만든 템플릿에 입력 dict를 채우는 단계.
+        `images_key`를 주면 해당 사진 목록을 image_url 메시지로 붙입니다 (입력에 없으면 사진 없이).
+        """
+        name = self._prompt_name
+
+        def fill(data):
+            values = {**data, IMAGES_PLACEHOLDER: image_messages(data.get(images_key) or []) if images_key else []}
+            return prompt_registry.chat(name).invoke(values)
+        return inline(fill)
 
     def parallel_init(self, *args, **kwargs) -> RunnableParallel:
-        @print_return
+        @trace
         def _parallel_init(*args, **kwargs) -> RunnableParallel:
-            return RunnableParallel(*args, **kwargs)
+            # `lambda x: x["key"]` 같은 단계가 async 요청마다 thread executor를 타지 않도록 inline 처리
+            steps = {k: inline(v) if callable(v) else v for step in args for k, v in step.items()}
+            steps.update({k: inline(v) if callable(v) else v for k, v in kwargs.items()})
+            return BatchedRunnableParallel(steps)
         return _parallel_init(*args, **kwargs)
 
+    def faiss_vectorstore(self, 
+                          file_name: str, 
+                          storage_kwargs: Optional[dict]={
+                              "allow_dangerous_deserialization": True
+                          }) -> VectorStore:
+        return vectorstore_registry.get(file_name, self.embeddings, **storage_kwargs)
+
     def faiss_retrieval(self, 
                         file_name: str, 
                         storage_kwargs: Optional[dict]={
@@ -90,9 +125,11 @@ class ChainBase(BaseModel):
                             "search_type": "similarity",  # similarity_score_threshold로 했을 때 의미가 없었음 (최소 `{'score_threshold': 0.4}` 이상).
                             "search_kwargs": {"k": 7}
                         }) -> Callable:
-        path = os.path.join(FAISS_PATH, file_name)
-        vectorstores: VectorStore = FAISS.load_local(path, self.embeddings, **storage_kwargs)
+        vectorstores: VectorStore = self.faiss_vectorstore(file_name, storage_kwargs)
         retriever: VectorStoreRetriever = vectorstores.as_retriever(**retriever_kwargs)
+        if retriever.search_type == "similarity" and isinstance(vectorstores, FAISS):
+            # `batch`/`abatch` (langserve `/batch`, 평가 sweep)는 질의 N개를 행렬 검색 한 번으로 처리
+            return FaissBatchRetriever(vectorstores, k=retriever.search_kwargs.get("k", 4), retriever=retriever)
         # @print_return
         # def retrieve(*args, **kwargs) -> Any:
         #     # print(f"Retrieving {args = }, {kwargs = }")
@@ -100,35 +137,83 @@ class ChainBase(BaseModel):
         # return retrieve
         return lambda *args, **kwargs: retriever.invoke(*args, **kwargs)
     
-    def template_call(self, type: str = "chat", *args_template, **kwargs_template) -> BasePromptTemplate:
+    def faiss_batch_retrieval(self, 
+                              file_name: str, 
+                              k: int = 7, 
+                              storage_kwargs: Optional[dict]={
+                                  "allow_dangerous_deserialization": True
+                              }) -> Callable[[List[str]], List[List[Document]]]:
+        """질의 목록 → 질의별 `Document` 목록. 임베딩 요청 한 번, (N, d) 행렬 `index.search` 한 번."""
+        return FaissBatchRetriever(self.faiss_vectorstore(file_name, storage_kwargs), k=k).retrieve_many
+
+    def context_packer(self, 
+                       file_name: str, 
+                       budget: Optional[int] = None, 
+                       render: Callable[[Document], str] = render_metadata, 
+                       storage_kwargs: Optional[dict]={
+                           "allow_dangerous_deserialization": True
+                       }) -> ContextPacker:
+        """`file_name` 인덱스의 검색 결과용 packer. `budget`을 주지 않으면 현재 모델의 예산(`CONTEXT_TOKEN_BUDGETS`)"""
+        return ContextPacker(
+            budget=budget or context_budget(self.model_name),
+            model=self.model_name,
+            store=self.faiss_vectorstore(file_name, storage_kwargs),
+            render=render
+        )
+
+    def pack_context(self, file_name: str, **packer_kwargs) -> InlineLambda:
+        """opt-in 단계: `retriever | self.pack_context(file_name) | self.format_docs`. `CONTEXT_PACKING=false`면 그대로 통과"""
+        if not CONTEXT_PACKING:
+            return inline(lambda docs: docs)
+        return InlineLambda(trace(self.context_packer(file_name, **packer_kwargs).pack, name="pack_context"), name="pack_context")
+
+    def hedged(self, build: Callable[[BaseLanguageModel], Runnable], validate: Callable[[Any], bool] = lambda output: output is not None) -> Runnable:
+        """
+        `build(model)`을 현재 모델과 2순위 모델(`HEDGE_SECONDARY`)로 각각 만들어 `HedgedRunnable`로 묶음.
+        e.g., `self.hedged(lambda model: model.with_structured_output(RiskAssessmentOutput), validate=...)`
+        """
+        primary = build(self.model)
+        address = secondary_address(self.model_name)
+        if not HEDGING or address is None:
+            return primary
+        secondary_model = model_call(address)
+        return HedgedRunnable(
+            primary=primary,
+            secondary=build(secondary_model),
+            primary_backend=backend_key(self.model),
+            secondary_backend=backend_key(secondary_model),
+            validate=validate,
+        )
+
+    def template_call(self, type: str = "chat", *args_template, **kwargs_template) -> InlineLambda:
         if type == "prompt":
-            @print_return
+            @trace
             def template(*args, **kwargs):
                 return PromptTemplate(*args_template, **kwargs_template).invoke(*args, **kwargs)
         elif type == "chat":
-            @print_return
+            @trace
             def template(*args, **kwargs):
                 return ChatPromptTemplate(*args_template, **kwargs_template).invoke(*args, **kwargs)
         elif type == "few-shot":
-            @print_return
+            @trace
             def template(*args, **kwargs):
                 return FewShotPromptTemplate(*args_template, **kwargs_template).invoke(*args, **kwargs)
         elif type == "pipeline":
-            @print_return
+            @trace
             def template(*args, **kwargs):
                 return PipelinePromptTemplate(*args_template, **kwargs_template).invoke(*args, **kwargs)
         else:
             raise ValueError(f"`type` not supported: {type = }")
-        return template
+        return inline(template)
 
-    @print_return
+    @trace
     def encode_image_url(self, file_path: str) -> str:
         with open(file_path, "rb") as file:
             base64_image = base64.b64encode(file.read()).decode('utf-8')
         file_ext = file_path.split(".")[-1]
         return f"data:image/{file_ext};base64, {base64_image}"
 
-    @print_return
+    @trace
     def image_preprocessor(self, image_paths: Union[str, List[str]]) -> List[str]:
         if isinstance(image_paths, str):
             image_paths = [image_paths]
@@ -139,6 +224,16 @@ class ChainBase(BaseModel):
             processed_images.append(image_path if _condition else self.encode_image_url(image_path))
         return processed_images
 
+    def image_stage(self, key: str = "site_image", processor: ImageProcessor = image_processor) -> Runnable:
+        """입력 dict의 `key` 사진 목록을 축소·중복 제거한 data URI 목록으로 교체 (이후 모든 vision 단계가 같은 목록을 사용)"""
+        def prepare(data):
+            return {**data, key: processor.prepare(data.get(key) or [])}
+
+        async def aprepare(data):
+            return {**data, key: await processor.aprepare(data.get(key) or [])}
+
+        return RunnableLambda(prepare, afunc=aprepare, name="image_stage")
+
     # Select Data
     def select_data(self, key: str) -> str:
         def _select_data(data):
@@ -157,57 +252,106 @@ class ChainBase(BaseModel):
 
     # Map Dictionary to String
     def get_dict2str(self, mapping: Dict[str, str]) -> Callable:
-        @print_return
+        @trace
         def dict2str(data) -> str:
             return self.mapper(mapping, **data)
-        return dict2str
+        return inline(dict2str)
 
     # Formatter Configuration
     def format_docs(self, docs: List[Document]) -> str:
         return "\n\n".join(doc.page_content for doc in docs)
     
+    @inline_method
     def format_docs(self, docs: List[Document]) -> str:
         return "\n\n".join(
             "\n".join(f"{key}: {value}" for key, value in doc.metadata.items())
             for doc in docs
             )
     
-    @print_return
+    @inline_method
+    @trace
     def format_table(self, docs: List[Document]) -> str:
         rows = []
         for doc in docs:
-            # key와 key 사이를 value로 인식하여 정확히 분리 (value가 여러 줄이거나 비어 있어도 안전)
-            pairs = re.findall(r'([^:\n]+):\s*((?:(?![^:\n]+:).)*)', doc.page_content, re.DOTALL)
+            pairs = TABLE_PAIR_PATTERN.findall(doc.page_content)
             row = {k.strip().lstrip("\ufeff"): v.strip() for k, v in pairs}
             rows.append(row)
         # 원하는 열 순서 지정
-        preferred_order = ["공정", "세부공정", "설비", "물질", "유해위험요인", "감소대책", "사고분류"]
-        all_keys = [k for k in preferred_order if any(k in row for row in rows)]
+        all_keys = [k for k in TABLE_COLUMN_ORDER if any(k in row for row in rows)]
         # 나머지 키는 알파벳순으로 뒤에 추가
-        extra_keys = sorted({k for row in rows for k in row if k not in preferred_order})
+        extra_keys = sorted({k for row in rows for k in row if k not in TABLE_COLUMN_ORDER})
         all_keys += [k for k in extra_keys if k not in all_keys]
-        table = Table(show_header=True, 
-                    header_style="bold magenta",
-                    box=ROUNDED,
-                    show_lines=True,
-                    width=175)
-        for key in all_keys:
-            table.add_column(key, no_wrap=False, overflow="fold")
-        for row in rows:
-            table.add_row(*(row.get(k, "") for k in all_keys))
-        console = Console(record=True)
-        console.print(table, crop=False, overflow="fold")
-        return console.export_text()
-
-    @print_return
+        return plain_table(all_keys, rows)
+
+    @inline_method
+    @trace
     def printer(self, data):
         return data
     
+    def with_response_cache(self, 
+                            chain: Runnable, 
+                            namespace: str, 
+                            mapping: Optional[Dict[str, str]] = None, 
+                            similarity: bool = RESPONSE_CACHE_SIMILARITY, 
+                            max_distance: float = RESPONSE_CACHE_DISTANCE, 
+                            hash_images: bool = RESPONSE_CACHE_HASH_IMAGES, 
+                            cache: ResponseCache = response_cache) -> Runnable:
+        """
+        같은 입력(또는 `similarity` 모드에서 임베딩 거리가 `max_distance` 이하인 입력)의 응답을 캐시에서 반환.
+        `site_image`가 있는 요청은 `hash_images`가 아니면 캐시를 거치지 않습니다.
+        """
+        similarity = similarity and mapping is not None
+
+        def prepare(data) -> Optional[Tuple[str, Optional[str], dict]]:
+            data = to_plain(data)
+            if not isinstance(data, dict):
+                return f"{namespace}:{canonical_hash(data)}:None", None, {}
+            images = data.get("site_image") or []
+            if images and not hash_images:
+                cache.bypass()
+                return None
+            image_digest = canonical_hash(images) if images else None
+            payload = {k: v for k, v in data.items() if k != "site_image"}
+            return f"{namespace}:{canonical_hash(payload)}:{image_digest}", image_digest, data
+
+        # `self.embeddings`는 `chain_call`에서 설정되므로 lazy 체인은 먼저 구성
+        def embed(plain: dict) -> List[float]:
+            if isinstance(chain, LazyChain):
+                chain.build()
+            return self.embeddings.embed_query(self.mapper(mapping, **plain))
+
+        async def aembed(plain: dict) -> List[float]:
+            if isinstance(chain, LazyChain):
+                await chain.abuild()
+            return await self.embeddings.aembed_query(self.mapper(mapping, **plain))
+
+        if not similarity:
+            return CachedChain(chain, namespace, prepare, max_distance=max_distance, cache=cache)
+        return CachedChain(chain, namespace, prepare, embed, aembed, max_distance=max_distance, cache=cache)
+
+    def build_chain(self, **chain_kwargs) -> Runnable:
+        """`chain_call(**chain_kwargs)`. lazy 모드에서는 첫 요청 때 구성하는 `LazyChain`을 반환합니다."""
+        if not self._lazy:
+            return self.chain_call(**chain_kwargs)
+        self._lazy_chain = LazyChain(lambda: self.chain_call(**chain_kwargs), name=type(self).__name__)
+        return self._lazy_chain
+
+    def warmup(self):
+        if self._lazy_chain is not None:
+            self._lazy_chain.build()
+
+    def registry_key(self) -> tuple:
+        """`ChainRegistry`에서 같은 체인인지 구분하는 key. 인스턴스별 설정이 있는 체인은 override 하세요."""
+        return (type(self).__name__,)
+
     def _register_chain(self, *args, **kwargs):
         raise NotImplementedError("`_register_chain` method not implemented.")
     
     def configure(self, **kwargs):
+        self._lazy = kwargs.pop("lazy", LAZY_CHAINS)
         self._register_chain(**kwargs)
+        # rate limiter는 LLM 호출의 `route` metadata로 우선순위를 정하므로 metering 여부와 상관없이 붙임
+        self.chain["chain"] = self.chain["chain"].with_config(metadata={"route": self.chain["path"]})
         return self.chain
 
 
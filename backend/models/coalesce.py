@@ -0,0 +1,268 @@
+"""
+같은 입력으로 동시에 들어온 체인 요청의 single-flight 처리.
+
+route별로 입력의 `canonical_hash`가 같은 요청이 실행 중이면 새로 실행하지 않고 그 결과(또는 stream)를 함께 받습니다.
+실행은 요청과 분리된 task로 돌아서 먼저 온 요청이 끊겨도 기다리는 요청이 남아 있으면 계속되고,
+기다리는 요청이 모두 사라지면 취소됩니다.
+뒤에 온 요청은 `COALESCE_MAX_WAIT`초까지만 기다리고 (stream이면 chunk 사이마다), 그때까지 결과가 없으면 직접 실행합니다.
+"""
+
+import asyncio, copy, os, threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from utils import get_logger
+
+from .cache import canonical_hash
+
+
+logger = get_logger(__name__)
+
+COALESCING: bool = os.getenv("COALESCING", "true").lower() == "true"
+COALESCE_MAX_WAIT: float = float(os.getenv("COALESCE_MAX_WAIT", "90"))  # seconds
+
+
+
+class Flight:
+    """실행 중인 요청 하나. `ainvoke`는 `task` 결과를, `astream`은 `chunks`를 구독자들이 나눠 받음"""
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.future: Future = Future()  # sync `invoke`
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.waiters = 0
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+
+def flight_key(mode: str, route: str, input: Any, config: Optional[RunnableConfig]) -> tuple:
+    """입력과 `configurable`, 붙은 callback 종류가 모두 같은 요청끼리만 합침 (handler 객체는 요청마다 새로 생기므로 종류만)"""
+    config = config or {}
+    callbacks = config.get("callbacks")
+    handlers = getattr(callbacks, "handlers", callbacks) or []
+    kinds = sorted({type(handler).__name__ for handler in handlers})
+    return mode, route, canonical_hash([input, config.get("configurable") or {}, kinds])
+
+
+
+class SingleFlight:
+    """`flight_key(mode, route, 입력, config)` → 실행 중인 `Flight`"""
+    def __init__(self, max_wait: float = COALESCE_MAX_WAIT):
+        self.max_wait = max_wait
+        self._flights: Dict[tuple, Flight] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, route: str, name: str):
+        with self._lock:
+            entry = self._stats.setdefault(route, {"leaders": 0, "followers": 0, "timeouts": 0, "cancelled": 0})
+            entry[name] += 1
+
+    def _join(self, key: tuple) -> tuple:
+        """(flight, leader 여부)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            flight.waiters = 1
+            return flight, True
+
+    def _land(self, key: tuple, flight: Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, key: tuple, flight: Flight):
+        """구독자가 빠짐. 아무도 남지 않으면 실행을 취소"""
+        with self._lock:
+            flight.waiters -= 1
+            orphaned = flight.waiters == 0 and not flight.done
+        if orphaned and flight.task is not None:
+            flight.task.cancel()
+            self._land(key, flight)
+            self._count(key[1], "cancelled")
+
+    # ── invoke ────────────────────────────────────────────────
+    def invoke(self, runnable: Runnable, route: str, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:
+        key = flight_key("invoke", route, input, config)
+        flight, leader = self._join(key)
+        if leader:
+            self._count(route, "leaders")
+            try:
+                result = runnable.invoke(input, config, **kwargs)
+            except BaseException as e:
+                flight.future.set_exception(e)
+                raise
+            else:
+                flight.future.set_result(result)
+                return result
+            finally:
+                flight.done = True
+                self._land(key, flight)
+
+        self._count(route, "followers")
+        try:
+            return copy.deepcopy(flight.future.result(timeout=self.max_wait))
+        except FutureTimeoutError:
+            self._count(route, "timeouts")
+            logger.warning(f"🔸 Coalesced request on {route} waited {self.max_wait}s; running it separately")
+            return runnable.invoke(input, config, **kwargs)
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+
+    async def ainvoke(self, runnable: Runnable, route: str, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:
+        key = flight_key("ainvoke", route, input, config)
+        flight, leader = self._join(key)
+        if leader:
+            self._count(route, "leaders")
+
+            async def run() -> Any:
+                try:
+                    return await runnable.ainvoke(input, config, **kwargs)
+                finally:
+                    flight.done = True
+                    self._land(key, flight)
+
+            flight.task = asyncio.create_task(run())
+        else:
+            self._count(route, "followers")
+
+        try:
+            if leader:
+                return await asyncio.shield(flight.task)
+            result = await asyncio.wait_for(asyncio.shield(flight.task), timeout=self.max_wait)
+            return copy.deepcopy(result)
+        except asyncio.TimeoutError:
+            if leader:
+                raise
+            self._count(route, "timeouts")
+            logger.warning(f"🔸 Coalesced request on {route} waited {self.max_wait}s; running it separately")
+            return await runnable.ainvoke(input, config, **kwargs)
+        finally:
+            self._leave(key, flight)
+
+    # ── stream ────────────────────────────────────────────────
+    async def astream(self, runnable: Runnable, route: str, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[Any]:
+        key = flight_key("astream", route, input, config)
+        flight, leader = self._join(key)
+        if leader:
+            self._count(route, "leaders")
+
+            async def run():
+                try:
+                    async for chunk in runnable.astream(input, config, **kwargs):
+                        flight.chunks.append(chunk)
+                        flight.notify()
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    flight.done = True
+                    flight.notify()
+                    self._land(key, flight)
+
+            flight.task = asyncio.create_task(run())
+        else:
+            self._count(route, "followers")
+
+        index, fallback = 0, False
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index] if leader else copy.deepcopy(flight.chunks[index])
+                    index += 1
+                if flight.done:
+                    if flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+                        raise flight.error
+                    break
+                changed = flight.changed
+                if leader:
+                    await changed.wait()
+                    continue
+                # 뒤에 온 요청은 chunk 사이마다 `max_wait`까지만 기다림
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.max_wait)
+                except asyncio.TimeoutError:
+                    fallback = True
+                    break
+        finally:
+            self._leave(key, flight)
+
+        if fallback:
+            self._count(route, "timeouts")
+            logger.warning(f"🔸 Coalesced stream on {route} had no output for {self.max_wait}s; running it separately")
+            # 이미 받은 chunk 수만큼은 건너뛰고 이어서 보냄
+            skipped = 0
+            async for chunk in runnable.astream(input, config, **kwargs):
+                if skipped < index:
+                    skipped += 1
+                    continue
+                yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "max_wait": self.max_wait,
+                "routes": {
+                    route: {**entry, "saved_runs": entry["followers"] - entry["timeouts"]}
+                    for route, entry in self._stats.items()
+                },
+            }
+
+
+single_flight = SingleFlight()
+
+
+
+class CoalescedChain(Runnable):
+    """route 하나에 등록되는 체인을 감싸서 같은 입력의 동시 요청을 한 번만 실행 (`batch`는 안쪽 체인의 `batch`로 그대로 전달)"""
+    def __init__(self, runnable: Runnable, route: str, flights: SingleFlight = single_flight):
+        self.runnable = runnable
+        self.route = route
+        self.flights = flights
+        self.name = getattr(runnable, "name", None)
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None):
+        return self.runnable.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None):
+        return self.runnable.get_output_schema(config)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.flights.invoke(self.runnable, self.route, input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self.flights.ainvoke(self.runnable, self.route, input, config, **kwargs)
+
+    def batch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        return self.runnable.batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+    async def abatch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        return await self.runnable.abatch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        yield from self.runnable.stream(input, config, **kwargs)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        async for chunk in self.flights.astream(self.runnable, self.route, input, config, **kwargs):
+            yield chunk
+
+
+def coalesced(runnable: Runnable, route: str) -> Runnable:
+    """`COALESCING=false`면 체인을 그대로 반환"""
+    return CoalescedChain(runnable, route) if COALESCING else runnable
+
+
+
+__all__ = ["CoalescedChain", "SingleFlight", "single_flight", "coalesced", "COALESCING"]
@@ -0,0 +1,429 @@
+"""
+GPT·Ollama backend 간 hedging / fallback (`HEDGING=true`일 때만, 기본은 꺼짐).
+
+- backend(OpenAI 모델, Ollama host)별로 최근 `HEDGE_WINDOW`건의 지연 시간(p50/p95)과 오류율을 집계합니다.
+- 1순위 backend가 `HEDGE_DELAY`초 (기본 `p95`: 1순위 backend의 최근 p95) 안에 답하지 않으면
+  2순위 backend에도 같은 요청을 보내고, 먼저 도착한 유효한 결과를 씁니다.
+- 연속 실패 `BREAKER_FAILURES`회 또는 오류율 `BREAKER_ERROR_RATE` 이상이면 circuit breaker가 열려
+  `BREAKER_COOLDOWN`초 동안 그 backend로 요청을 보내지 않습니다 (이후 한 건으로 상태 확인).
+- 요청마다 실제로 답한 backend를 1순위 backend의 `answered_by`에 집계합니다 (`/health/backends`).
+- 429(서버 자체의 `RateLimitExceeded` 포함)·잘못된 입력 오류는 backend 장애로 세지 않고, 2순위로 보내지도 않고 그대로 올립니다.
+"""
+
+import asyncio, contextvars, json, os, threading, time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from utils import RateLimitExceeded, get_logger
+
+
+logger = get_logger(__name__)
+
+HEDGING: bool = os.getenv("HEDGING", "false").lower() == "true"
+HEDGE_DELAY: str = os.getenv("HEDGE_DELAY", "p95")  # seconds 또는 "p50" / "p95"
+HEDGE_DELAY_DEFAULT: float = float(os.getenv("HEDGE_DELAY_DEFAULT", "30"))  # 표본이 적을 때
+HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW: int = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_WORKERS: int = int(os.getenv("HEDGE_WORKERS", "16"))
+# 1순위 모델 이름(앞부분 일치) → 2순위 `model_call` address
+# 기본값은 자체 호스팅 gpt-oss → OpenAI fallback만 (OpenAI 모델끼리는 다른 모델·단가의 결과가 섞이므로 직접 지정)
+HEDGE_SECONDARY: Dict[str, str] = json.loads(os.getenv("HEDGE_SECONDARY", "null")) or {
+    "gpt-oss": "openai/gpt-4.1",
+}
+BREAKER_FAILURES: int = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_ERROR_RATE: float = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_COOLDOWN: float = float(os.getenv("BREAKER_COOLDOWN", "30"))  # seconds
+# backend 장애가 아니라 요청 쪽 문제인 상태 코드 (breaker에 기록하지 않고, 2순위로 보내지도 않음)
+CLIENT_ERROR_STATUS: Tuple[int, ...] = (400, 413, 422, 429)
+
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+
+
+class BackendUnavailable(HTTPException):
+    """circuit breaker가 열려 있고 대신 보낼 backend도 없을 때 (503 + Retry-After)"""
+    def __init__(self, backend: str, retry_after: float):
+        retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(
+            status_code=503,
+            detail=f"Backend {backend} is unavailable; retry after {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTPException·OpenAI SDK 오류는 `status_code`, httpx 오류는 `response.status_code`"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_client_error(error: BaseException) -> bool:
+    """서버 자체의 429 (`RateLimitExceeded`), provider 429, 잘못된 입력 — backend가 건강해도 나는 오류"""
+    return isinstance(error, RateLimitExceeded) or error_status(error) in CLIENT_ERROR_STATUS
+
+
+def backend_key(model: BaseLanguageModel) -> str:
+    """Ollama는 host 단위(한 host의 장애는 모든 모델에 영향), 나머지는 `provider/model`"""
+    base_url = getattr(model, "base_url", None)
+    if "ollama" in type(model).__name__.lower() and base_url:
+        return f"ollama/{base_url}"
+    name = getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+    return f"{getattr(model, 'limiter_provider', type(model).__name__)}/{name}"
+
+
+
+class BackendHealth:
+    """backend 하나의 최근 지연 시간·성공 여부와 circuit breaker 상태"""
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+        self.hedges: Dict[str, int] = {"calls": 0, "hedged": 0, "secondary_wins": 0, "rerouted": 0}  # 1순위일 때
+        self.answered_by: Counter = Counter()  # 1순위일 때, 실제로 답한 backend
+
+    def percentile(self, q: float) -> Optional[float]:
+        return float(np.percentile(self.latencies, q)) if self.latencies else None
+
+    def error_rate(self) -> Optional[float]:
+        return 1 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else None
+
+    def state(self, now: float) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if now - self.opened_at < BREAKER_COOLDOWN else "half-open"
+
+
+
+class BackendRegistry:
+    def __init__(self):
+        self._backends: Dict[str, BackendHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> BackendHealth:
+        backend = self._backends.get(key)
+        if backend is None:
+            backend = self._backends.setdefault(key, BackendHealth())
+        return backend
+
+    def allow(self, key: str) -> bool:
+        """breaker가 닫혀 있으면 항상, half-open이면 확인용 한 건만 통과"""
+        with self._lock:
+            backend = self._get(key)
+            state = backend.state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half-open" and not backend.probing:
+                backend.probing = True
+                return True
+            backend.rejected += 1
+            return False
+
+    def release(self, key: str):
+        """확인용 요청이 결과 없이 취소된 경우 다음 요청이 다시 확인하도록"""
+        with self._lock:
+            self._get(key).probing = False
+
+    def count(self, key: str, name: str):
+        with self._lock:
+            self._get(key).hedges[name] += 1
+
+    def answered(self, key: str, backend: str):
+        with self._lock:
+            self._get(key).answered_by[backend] += 1
+
+    def retry_after(self, key: str) -> float:
+        with self._lock:
+            backend = self._get(key)
+            if backend.opened_at is None:
+                return 0.0
+            return max(0.0, BREAKER_COOLDOWN - (time.monotonic() - backend.opened_at))
+
+    def record(self, key: str, seconds: float, ok: bool):
+        with self._lock:
+            backend = self._get(key)
+            backend.outcomes.append(ok)
+            if ok:
+                backend.latencies.append(seconds)
+                backend.consecutive_failures = 0
+                if backend.opened_at is not None:
+                    logger.info(f"🔹 Circuit closed: {key}")
+                backend.opened_at, backend.probing = None, False
+                return
+            backend.consecutive_failures += 1
+            error_rate = backend.error_rate() or 0.0
+            tripped = (
+                backend.probing
+                or backend.consecutive_failures >= BREAKER_FAILURES
+                or (len(backend.outcomes) >= HEDGE_MIN_SAMPLES and error_rate >= BREAKER_ERROR_RATE)
+            )
+            if tripped and (backend.opened_at is None or backend.probing):
+                backend.opened_at, backend.probing = time.monotonic(), False
+                backend.trips += 1
+                logger.warning(f"🔸 Circuit opened: {key} ({backend.consecutive_failures} consecutive failures, error rate {error_rate:.2f})")
+
+    def latency(self, key: str, q: float = 50) -> Optional[float]:
+        """최근 성공 요청의 지연 시간 백분위수 (표본이 `HEDGE_MIN_SAMPLES`보다 적으면 None)"""
+        with self._lock:
+            backend = self._get(key)
+            return backend.percentile(q) if len(backend.latencies) >= HEDGE_MIN_SAMPLES else None
+
+    def hedge_delay(self, key: str) -> float:
+        if HEDGE_DELAY not in ("p50", "p95"):
+            return float(HEDGE_DELAY)
+        delay = self.latency(key, 50 if HEDGE_DELAY == "p50" else 95)
+        return HEDGE_DELAY_DEFAULT if delay is None else delay
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: {
+                    "state": backend.state(now),
+                    "samples": len(backend.outcomes),
+                    "p50_ms": None if backend.percentile(50) is None else round(backend.percentile(50) * 1000, 1),
+                    "p95_ms": None if backend.percentile(95) is None else round(backend.percentile(95) * 1000, 1),
+                    "error_rate": None if backend.error_rate() is None else round(backend.error_rate(), 4),
+                    "consecutive_failures": backend.consecutive_failures,
+                    "trips": backend.trips,
+                    "rejected": backend.rejected,
+                    **backend.hedges,
+                    "answered_by": dict(backend.answered_by),
+                }
+                for key, backend in self._backends.items()
+            }
+
+
+backend_registry = BackendRegistry()
+
+
+
+class HedgedRunnable(Runnable):
+    """
+    `primary`가 hedge 지연 시간 안에 유효한 결과를 못 내면 `secondary`에도 보내고 먼저 온 유효한 결과를 반환.
+    `primary`의 breaker가 열려 있으면 바로 `secondary`로 보냅니다.
+    stream은 hedging 없이 breaker만 거치고, 첫 chunk 전에 실패하면 `secondary`로 넘깁니다.
+    """
+    def __init__(self,
+                 primary: Runnable,
+                 secondary: Optional[Runnable],
+                 primary_backend: str,
+                 secondary_backend: Optional[str] = None,
+                 validate: Callable[[Any], bool] = lambda output: output is not None,
+                 registry: BackendRegistry = backend_registry):
+        self.primary = primary
+        self.secondary = secondary
+        self.primary_backend = primary_backend
+        self.secondary_backend = secondary_backend
+        self.validate = validate
+        self.registry = registry
+
+    def _count(self, name: str):
+        self.registry.count(self.primary_backend, name)
+
+    def _answered(self, backend: str):
+        self.registry.answered(self.primary_backend, backend)
+        if backend != self.primary_backend:
+            self._count("secondary_wins")
+            logger.info(f"🔹 {self.primary_backend} request answered by {backend}")
+
+    def _candidates(self) -> List[Tuple[Runnable, str]]:
+        candidates = [(self.primary, self.primary_backend)]
+        if self.secondary is not None and self.secondary_backend is not None:
+            candidates.append((self.secondary, self.secondary_backend))
+        return candidates
+
+    def _next(self, candidates: List[Tuple[Runnable, str]]) -> Optional[Tuple[Runnable, str]]:
+        """breaker가 막지 않는 다음 후보. 보내기 직전에 확인해야 half-open 확인용 자리를 헛되이 잡지 않음"""
+        while candidates:
+            runnable, backend = candidates.pop(0)
+            if self.registry.allow(backend):
+                return runnable, backend
+            if backend == self.primary_backend:
+                self._count("rerouted")
+        return None
+
+    def _first(self, candidates: List[Tuple[Runnable, str]]) -> Tuple[Runnable, str]:
+        first = self._next(candidates)
+        if first is None:
+            raise BackendUnavailable(self.primary_backend, self.registry.retry_after(self.primary_backend))
+        return first
+
+    def _checked(self, output: Any, backend: str, started: float) -> Any:
+        if not self.validate(output):
+            self.registry.record(backend, time.perf_counter() - started, ok=False)
+            raise ValueError(f"Invalid output from {backend}")
+        self.registry.record(backend, time.perf_counter() - started, ok=True)
+        return output
+
+    def _failed(self, backend: str, started: float, error: BaseException):
+        if is_client_error(error):
+            self.registry.release(backend)  # 확인용 요청이었다면 다음 요청이 다시 확인
+            return
+        self.registry.record(backend, time.perf_counter() - started, ok=False)
+
+    def _run(self, runnable: Runnable, backend: str, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            output = runnable.invoke(input, config, **kwargs)
+        except Exception as e:
+            self._failed(backend, started, e)
+            raise
+        return self._checked(output, backend, started)
+
+    async def _arun(self, runnable: Runnable, backend: str, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            output = await runnable.ainvoke(input, config, **kwargs)
+        except asyncio.CancelledError:
+            self.registry.release(backend)
+            raise
+        except Exception as e:
+            self._failed(backend, started, e)
+            raise
+        return self._checked(output, backend, started)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self._count("calls")
+        candidates = self._candidates()
+        delay = self.registry.hedge_delay(self.primary_backend)
+        pending: Dict[Future, str] = {}
+        error: Optional[BaseException] = None
+
+        def submit(runnable: Runnable, backend: str):
+            context = contextvars.copy_context()
+            pending[hedge_executor.submit(context.run, self._run, runnable, backend, input, config, **kwargs)] = backend
+
+        submit(*self._first(candidates))
+        while pending:
+            done, _ = wait(pending, timeout=delay if candidates else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    output = future.result()
+                except Exception as e:
+                    error = e
+                    if is_client_error(e):
+                        candidates.clear()  # 429·입력 오류는 2순위로 보내지 않음 (과부하를 키움)
+                    continue
+                self._answered(backend)
+                return output  # 늦게 끝나는 쪽은 결과를 버림 (thread는 취소할 수 없음)
+            # 지연 시간 초과 또는 1순위 실패 → 2순위 투입 (2순위 breaker가 열려 있으면 hedging 안 함)
+            if candidates and (following := self._next(candidates)) is not None:
+                self._count("hedged")
+                submit(*following)
+        raise error
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self._count("calls")
+        candidates = self._candidates()
+        delay = self.registry.hedge_delay(self.primary_backend)
+        pending: Dict[asyncio.Task, str] = {}
+        error: Optional[BaseException] = None
+
+        def submit(runnable: Runnable, backend: str):
+            pending[asyncio.create_task(self._arun(runnable, backend, input, config, **kwargs))] = backend
+
+        submit(*self._first(candidates))
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=delay if candidates else None, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        output = task.result()
+                    except Exception as e:
+                        error = e
+                        if is_client_error(e):
+                            candidates.clear()
+                        continue
+                    self._answered(backend)
+                    return output
+                if candidates and (following := self._next(candidates)) is not None:
+                    self._count("hedged")
+                    submit(*following)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # ── stream ────────────────────────────────────────────────
+    # 이미 내보낸 chunk는 되돌릴 수 없으므로 hedging 대신, 첫 chunk가 나오기 전에 실패하면 다음 후보로 넘김
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        self._count("calls")
+        candidates = self._candidates()
+        runnable, backend = self._first(candidates)
+        while True:
+            started, streamed = time.perf_counter(), False
+            try:
+                for chunk in runnable.stream(input, config, **kwargs):
+                    streamed = True
+                    yield chunk
+            except GeneratorExit:
+                self.registry.release(backend)
+                raise
+            except Exception as e:
+                self._failed(backend, started, e)
+                following = None if streamed or is_client_error(e) else self._next(candidates)
+                if following is None:
+                    raise
+                logger.warning(f"🔸 {backend} stream failed before output; switching to {following[1]}: {e}")
+                runnable, backend = following
+                continue
+            self.registry.record(backend, time.perf_counter() - started, ok=True)
+            self._answered(backend)
+            return
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        self._count("calls")
+        candidates = self._candidates()
+        runnable, backend = self._first(candidates)
+        while True:
+            started, streamed = time.perf_counter(), False
+            try:
+                async for chunk in runnable.astream(input, config, **kwargs):
+                    streamed = True
+                    yield chunk
+            except (GeneratorExit, asyncio.CancelledError):
+                self.registry.release(backend)
+                raise
+            except Exception as e:
+                self._failed(backend, started, e)
+                following = None if streamed or is_client_error(e) else self._next(candidates)
+                if following is None:
+                    raise
+                logger.warning(f"🔸 {backend} stream failed before output; switching to {following[1]}: {e}")
+                runnable, backend = following
+                continue
+            self.registry.record(backend, time.perf_counter() - started, ok=True)
+            self._answered(backend)
+            return
+
+
+def secondary_address(model_name: str) -> Optional[str]:
+    candidates = [name for name in HEDGE_SECONDARY if model_name.startswith(name)]
+    return HEDGE_SECONDARY[max(candidates, key=len)] if candidates else None
+
+
+
+__all__ = [
+    "HedgedRunnable",
+    "BackendRegistry",
+    "BackendUnavailable",
+    "backend_registry",
+    "backend_key",
+    "is_client_error",
+    "secondary_address",
+    "HEDGING",
+]
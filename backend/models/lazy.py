@@ -0,0 +1,71 @@
+import asyncio, os, threading, time
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from utils import get_logger
+
+
+logger = get_logger(__name__)
+
+LAZY_CHAINS: bool = os.getenv("LAZY_CHAINS", "true").lower() == "true"
+CHAIN_WARMUP: List[str] = [path.strip() for path in os.getenv("CHAIN_WARMUP", "").split(",") if path.strip()]  # e.g., "/gpt-4.1/pi-ratings,/gpt-4.1/checklist"
+
+
+
+class LazyChain(Runnable):
+    """
+    첫 요청이 들어올 때 `factory()`로 실제 체인을 만드는 Runnable.
+
+    langserve에는 이 객체를 그대로 등록하고, 모델·임베딩·FAISS 로딩은 첫 invoke로 미룹니다.
+    동시에 들어온 첫 요청들은 lock으로 한 번만 체인을 구성합니다.
+    """
+    def __init__(self, factory: Callable[[], Runnable], name: Optional[str] = None):
+        self.factory = factory
+        self.name = name
+        self.build_seconds: Optional[float] = None
+        self._runnable: Optional[Runnable] = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._runnable is not None
+
+    def build(self) -> Runnable:
+        if self._runnable is None:
+            with self._lock:
+                if self._runnable is None:
+                    started = time.perf_counter()
+                    self._runnable = self.factory()
+                    self.build_seconds = time.perf_counter() - started
+                    logger.info(f"🔹 Chain built: {self.name} in {self.build_seconds:.2f}s")
+        return self._runnable
+
+    async def abuild(self) -> Runnable:
+        # 체인 구성은 동기(FAISS 로딩 등)이므로 event loop를 막지 않도록 thread에서 수행
+        if self._runnable is not None:
+            return self._runnable
+        return await asyncio.to_thread(self.build)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.build().invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await (await self.abuild()).ainvoke(input, config, **kwargs)
+
+    def batch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        return self.build().batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+    async def abatch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        return await (await self.abuild()).abatch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        yield from self.build().stream(input, config, **kwargs)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        async for chunk in (await self.abuild()).astream(input, config, **kwargs):
+            yield chunk
+
+
+
+__all__ = ["LazyChain", "LAZY_CHAINS", "CHAIN_WARMUP"]
@@ -0,0 +1,87 @@
+import contextlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ensure_config, merge_configs
+
+from utils import METERING, MeteringCallbackHandler, UsageMeter, current_route, metering_handler, usage_meter
+
+
+
+class MeteredChain(Runnable):
+    """
+    route 하나에 등록되는 체인을 감싸서 요청 수를 세고, 하위 LLM 호출에 metering callback과
+    `route` metadata를 붙이는 Runnable. 임베딩 토큰은 `current_route` contextvar로 route에 귀속됩니다.
+    """
+    def __init__(self,
+                 runnable: Runnable,
+                 route: str,
+                 meter: UsageMeter = usage_meter,
+                 handler: MeteringCallbackHandler = metering_handler):
+        self.runnable = runnable
+        self.route = route
+        self.meter = meter
+        self.handler = handler
+        self.name = getattr(runnable, "name", None)
+
+    def _config(self, config: Optional[RunnableConfig]) -> RunnableConfig:
+        config = ensure_config(config)
+        callbacks = config.get("callbacks")
+        if isinstance(callbacks, list) and self.handler in callbacks:
+            return config
+        return merge_configs(config, {"callbacks": [self.handler], "metadata": {"route": self.route}})
+
+    @contextlib.contextmanager
+    def _metered(self, count: int = 1) -> Iterator[None]:
+        self.meter.record_request(self.route, count)
+        token = current_route.set(self.route)
+        try:
+            yield
+        finally:
+            try:
+                current_route.reset(token)
+            except ValueError:
+                # generator가 다른 context에서 닫힌 경우
+                pass
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None):
+        return self.runnable.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None):
+        return self.runnable.get_output_schema(config)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        with self._metered():
+            return self.runnable.invoke(input, self._config(config), **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        with self._metered():
+            return await self.runnable.ainvoke(input, self._config(config), **kwargs)
+
+    def batch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        configs = [self._config(c) for c in config] if isinstance(config, list) else self._config(config)
+        with self._metered(len(inputs)):
+            return self.runnable.batch(inputs, configs, return_exceptions=return_exceptions, **kwargs)
+
+    async def abatch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        configs = [self._config(c) for c in config] if isinstance(config, list) else self._config(config)
+        with self._metered(len(inputs)):
+            return await self.runnable.abatch(inputs, configs, return_exceptions=return_exceptions, **kwargs)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        with self._metered():
+            yield from self.runnable.stream(input, self._config(config), **kwargs)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        with self._metered():
+            async for chunk in self.runnable.astream(input, self._config(config), **kwargs):
+                yield chunk
+
+
+def metered(runnable: Runnable, route: str) -> Runnable:
+    """`METERING=false`면 체인을 그대로 반환"""
+    return MeteredChain(runnable, route) if METERING else runnable
+
+
+
+__all__ = ["MeteredChain", "metered"]
@@ -0,0 +1,129 @@
+"""
+RAG 참고자료(reference) context packer.
+
+검색 결과를 관련도 순서 그대로 보면서
+
+1. 이미 고른 문서와 임베딩 cosine 유사도가 `CONTEXT_DEDUPE_SIMILARITY` 이상인 문서는 버리고
+   (벡터는 새로 임베딩하지 않고 FAISS 인덱스에서 `reconstruct`),
+2. 남은 문서를 모델별 토큰 예산(`CONTEXT_TOKEN_BUDGETS`) 안에서 앞에서부터 채웁니다.
+
+토큰 수는 `utils.num_tokens_from_string` (이름별로 캐시된 tiktoken encoder)로 셉니다.
+"""
+
+import json, os, threading, weakref
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+from utils import get_logger, normalize_text, num_tokens_from_string
+
+
+logger = get_logger(__name__)
+
+# 모델별 참고자료 토큰 예산. 이름이 `gpt-4.1-2025-04-14`처럼 길어도 가장 길게 일치하는 항목을 사용
+CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+    "gpt-4.1": 3000,
+    "gpt-4o": 3000,
+    "gpt-4o-mini": 2000,
+    "gpt-oss": 1500,
+    **json.loads(os.getenv("CONTEXT_TOKEN_BUDGETS", "{}")),  # e.g., '{"gpt-4o-mini": 1200}'
+}
+CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))  # 표에 없는 모델
+CONTEXT_DEDUPE_SIMILARITY: float = float(os.getenv("CONTEXT_DEDUPE_SIMILARITY", "0.95"))
+CONTEXT_PACKING: bool = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+
+_positions: "weakref.WeakKeyDictionary[FAISS, Dict[str, int]]" = weakref.WeakKeyDictionary()
+_positions_lock = threading.Lock()
+
+
+
+def context_budget(model: str) -> int:
+    candidates = [name for name in CONTEXT_TOKEN_BUDGETS if model == name or model.startswith(f"{name}-") or model.startswith(f"{name}:")]
+    return CONTEXT_TOKEN_BUDGETS[max(candidates, key=len)] if candidates else CONTEXT_TOKEN_BUDGET
+
+
+def render_metadata(doc: Document) -> str:
+    """`ChainBase.format_docs`가 문서 하나를 쓰는 모양"""
+    return "\n".join(f"{key}: {value}" for key, value in doc.metadata.items())
+
+
+def render_content(doc: Document) -> str:
+    """`ChainBase.format_table`처럼 본문을 쓰는 경우"""
+    return doc.page_content
+
+
+def docstore_positions(store: FAISS) -> Dict[str, int]:
+    """docstore id → 인덱스 위치 (store별로 한 번만 만듦)"""
+    positions = _positions.get(store)
+    if positions is None:
+        with _positions_lock:
+            positions = _positions.get(store)
+            if positions is None:
+                ids = store.index_to_docstore_id
+                pairs = ids.items() if isinstance(ids, dict) else enumerate(ids)
+                positions = _positions[store] = {doc_id: int(i) for i, doc_id in pairs}
+    return positions
+
+
+
+class ContextPacker:
+    """
+    `List[Document]` → 중복을 걷어내고 토큰 예산 안에 들어가는 `List[Document]`.
+
+    `store`가 없거나 벡터를 꺼낼 수 없으면 정규화한 본문이 같은 문서만 중복으로 봅니다.
+    예산보다 큰 문서가 맨 앞에 오더라도 최소 한 건은 남깁니다.
+    """
+    def __init__(self,
+                 budget: int,
+                 model: str,
+                 store: Optional[FAISS] = None,
+                 render: Callable[[Document], str] = render_metadata,
+                 threshold: float = CONTEXT_DEDUPE_SIMILARITY):
+        self.budget = budget
+        self.model = model
+        self.store = store
+        self.render = render
+        self.threshold = threshold
+
+    def _vectors(self, docs: List[Document]) -> Optional[np.ndarray]:
+        if self.store is None or not all(doc.id for doc in docs):
+            return None
+        try:
+            positions = docstore_positions(self.store)
+            vectors = np.stack([np.asarray(self.store.index.reconstruct(positions[doc.id]), dtype=np.float32) for doc in docs])
+        except (KeyError, RuntimeError, AttributeError) as e:
+            logger.debug(f"🔹 Context packer falls back to text dedupe: {e}")
+            return None
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def dedupe(self, docs: List[Document]) -> List[Document]:
+        vectors = self._vectors(docs)
+        kept: List[int] = []
+        seen = set()
+        for i, doc in enumerate(docs):
+            if vectors is None:
+                key = normalize_text(doc.page_content)
+                if key in seen:
+                    continue
+                seen.add(key)
+            elif kept and float(np.max(vectors[kept] @ vectors[i])) >= self.threshold:
+                continue
+            kept.append(i)
+        return [docs[i] for i in kept]
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        packed, used = [], 0
+        for doc in self.dedupe(docs):
+            tokens = num_tokens_from_string(self.render(doc), self.model)
+            if packed and used + tokens > self.budget:
+                continue  # 뒤에 더 짧은 문서가 있으면 그걸로 채움
+            packed.append(doc)
+            used += tokens
+        logger.debug(f"🔹 Context packed: {len(docs)} → {len(packed)} docs, {used}/{self.budget} tokens")
+        return packed
+
+
+
+__all__ = ["ContextPacker", "context_budget", "render_metadata", "render_content", "CONTEXT_PACKING", "CONTEXT_TOKEN_BUDGETS", "CONTEXT_TOKEN_BUDGET", "CONTEXT_DEDUPE_SIMILARITY"]
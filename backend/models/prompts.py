@@ -0,0 +1,153 @@
+import os, re, threading, time
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+
+from utils import get_logger, register_prompt, unregister_prompts
+
+
+logger = get_logger(__name__)
+
+PROMPT_PATH: str = "prompts.yaml"
+PROMPT_RELOAD_INTERVAL: float = float(os.getenv("PROMPT_RELOAD_INTERVAL", "1.0"))  # seconds, mtime 확인 간격
+IMAGES_PLACEHOLDER: str = "images"
+# "inline": YAML에 쓰인 순서 그대로 / "prefix": 변수 없는 문단을 system 쪽으로 모아 요청마다 같은 prefix를 만듦 (provider prefix cache)
+PROMPT_LAYOUT: str = os.getenv("PROMPT_LAYOUT", "inline")
+
+VARIABLE_PATTERN = re.compile(r"(?<!\{)\{[^{}\s]+\}(?!\})")
+
+
+
+def image_messages(images: List[str], numbered: bool = False) -> List[HumanMessage]:
+    """사진 목록 → 프롬프트 끝에 붙는 image_url 메시지 목록 (`numbered`면 사진마다 `사진 N` 표시를 앞에 붙임)"""
+    return [
+        HumanMessage(content=[
+            *([{"type": "text", "text": f"사진 {number}"}] if numbered else []),
+            {"type": "image_url", "image_url": {"url": image}},
+        ])
+        for number, image in enumerate(images, start=1)
+    ]
+
+
+def split_static(template: str) -> Tuple[List[str], List[str]]:
+    """템플릿 → (변수 없는 문단, 변수 있는 문단). 각각 원래 순서를 유지"""
+    blocks = [block for block in re.split(r"\n[ \t]*\n", template.strip("\n")) if block.strip()]
+    return [block for block in blocks if not VARIABLE_PATTERN.search(block)], [block for block in blocks if VARIABLE_PATTERN.search(block)]
+
+
+def prefix_layout(system: str, user: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    고정 지시문은 모두 앞(system)으로, 요청마다 바뀌는 작업 정보·reference는 뒤(user)로.
+    이후 사진 메시지가 붙으므로 요청 간 공유되는 prefix는 tool schema + system 전체가 됩니다.
+    """
+    if user is None:
+        return system, None
+    static, dynamic = split_static(user)
+    if static:
+        system = "\n\n".join([system.rstrip("\n"), *static])
+    return system, "\n\n".join(dynamic) or None
+
+
+def compile_chat_prompt(system: str, 
+                        user: Optional[str] = None, 
+                        layout: str = PROMPT_LAYOUT, 
+                        name: Optional[str] = None) -> ChatPromptTemplate:
+    """
+    `system`/`user` 템플릿 + 사진 메시지 자리(`images`)를 가진 `ChatPromptTemplate`.
+    `name`을 주면 metering이 응답의 `cached_tokens`를 이 이름으로 집계합니다.
+    """
+    if layout == "prefix":
+        system, user = prefix_layout(system, user)
+    if name is not None and not VARIABLE_PATTERN.search(system):
+        register_prompt(name, PromptTemplate.from_template(system).format())
+    messages: List[Any] = [("system", system)]
+    if user is not None:
+        messages.append(("user", user))
+    messages.append(MessagesPlaceholder(IMAGES_PLACEHOLDER, optional=True))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+
+class PromptRegistry:
+    """
+    `prompts.yaml`을 한 번만 읽고, 이름별 `ChatPromptTemplate`을 미리 만들어 두는 레지스트리.
+
+    파일의 mtime이 바뀌면(최대 `reload_interval`초마다 확인) 새로 읽은 뒤 한 번에 교체합니다.
+    읽는 도중 YAML이 깨져 있으면 기존 프롬프트를 계속 사용합니다.
+    """
+    def __init__(self, path: str = PROMPT_PATH, reload_interval: float = PROMPT_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        # (mtime, raw, compiled) — 통째로 교체해서 읽는 쪽은 lock 없이 일관된 snapshot을 봄
+        self._snapshot: Tuple[Optional[float], Dict[str, Any], Dict[str, ChatPromptTemplate]] = (None, {}, {})
+
+    def _load(self) -> Tuple[float, Dict[str, Any], Dict[str, ChatPromptTemplate]]:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, "r", encoding="utf-8") as f:
+            raw = yaml.safe_load(f)
+        compiled = {
+            name: compile_chat_prompt(entry["system"], entry.get("user"), name=name)
+            for name, entry in raw.items()
+            if isinstance(entry, dict) and isinstance(entry.get("system"), str)
+        }
+        return mtime, raw, compiled
+
+    def _refresh(self):
+        now = time.monotonic()
+        mtime = self._snapshot[0]
+        if mtime is not None and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            if self._snapshot[0] is not None and now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+            try:
+                if self._snapshot[0] == os.stat(self.path).st_mtime:
+                    return
+                snapshot = self._load()
+            except (OSError, yaml.YAMLError, KeyError, ValueError) as e:
+                if self._snapshot[0] is None:
+                    raise
+                logger.warning(f"🔸 Prompt reload failed, keeping previous prompts: {e}")
+                return
+            if self._snapshot[0] is not None:
+                self.reloads += 1
+                logger.info(f"🔹 Prompts reloaded: {self.path}")
+                # 바뀐 프롬프트는 `_load`에서 다시 등록되며 교체되고, 없어진 프롬프트는 여기서 지움
+                unregister_prompts([name for name in self._snapshot[2] if name not in snapshot[2]])
+            self._snapshot = snapshot
+
+    def get(self, name: str) -> Dict[str, Any]:
+        """YAML 원본 항목 (`{"system": ..., "user": ...}`)"""
+        self._refresh()
+        return self._snapshot[1][name]
+
+    def chat(self, name: str) -> ChatPromptTemplate:
+        """미리 만든 `ChatPromptTemplate`. 입력에 `images`(메시지 목록)를 주면 사진 메시지가 붙음"""
+        self._refresh()
+        return self._snapshot[2][name]
+
+    def names(self) -> List[str]:
+        self._refresh()
+        return list(self._snapshot[1])
+
+
+prompt_registry = PromptRegistry()
+
+
+
+__all__ = [
+    "PromptRegistry",
+    "prompt_registry",
+    "compile_chat_prompt",
+    "prefix_layout",
+    "image_messages",
+    "IMAGES_PLACEHOLDER",
+    "PROMPT_PATH",
+    "PROMPT_LAYOUT",
+]
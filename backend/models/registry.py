@@ -0,0 +1,84 @@
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+from utils import get_logger
+
+from .chain import ChainBase
+
+
+logger = get_logger(__name__)
+
+
+
+class ChainRegistry:
+    """
+    `(체인 클래스, 모델 설정)` 조합별로 체인을 한 번만 구성하는 레지스트리.
+
+    같은 조합을 다시 요청하면 이미 만든 route 정보를 돌려주고,
+    서로 다른 조합이 같은 `path`를 쓰려고 하면 `ValueError`를 냅니다.
+    """
+    def __init__(self):
+        self._routes: Dict[Tuple, Dict[str, Any]] = {}
+        self._chains: Dict[Tuple, ChainBase] = {}
+        self._paths: Dict[str, Tuple] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(chain: ChainBase, **kwargs) -> Tuple:
+        return chain.registry_key() + tuple(sorted(kwargs.items()))
+
+    def configure(self, chain: ChainBase, **kwargs) -> Dict[str, Any]:
+        key = self.key(chain, **kwargs)
+        with self._lock:
+            route = self._routes.get(key)
+            if route is not None:
+                return route
+
+            route = chain.configure(**kwargs)
+            owner = self._paths.get(route["path"])
+            if owner is not None and owner != key:
+                raise ValueError(f"Duplicate chain path: {route['path']} ({owner} vs {key})")
+
+            self._routes[key] = route
+            self._chains[key] = chain
+            self._paths[route["path"]] = key
+            logger.debug(f"🔹 Chain registered: {route['path']} ← {key}")
+            return route
+
+    def routes(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._routes.values())
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._paths)
+
+    def warmup(self, paths: Iterable[str], background: bool = True):
+        """lazy 체인 중 `paths`에 해당하는 체인을 미리 구성 (기본: 백그라운드 thread)"""
+        with self._lock:
+            targets = [self._chains[self._paths[path]] for path in paths if path in self._paths]
+
+        def _warmup():
+            for chain in targets:
+                try:
+                    chain.warmup()
+                except Exception as e:
+                    logger.warning(f"🔸 Chain warm-up failed: {chain.registry_key()}: {e}")
+
+        if background:
+            threading.Thread(target=_warmup, name="chain-warmup", daemon=True).start()
+        else:
+            _warmup()
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+            self._chains.clear()
+            self._paths.clear()
+
+
+chain_registry = ChainRegistry()
+
+
+
+__all__ = ["ChainRegistry", "chain_registry"]
@@ -4,6 +4,14 @@ from fastapi import APIRouter
 from langserve import add_routes
 from pydantic import BaseModel
 
+from utils import get_logger
+
+from .coalesce import coalesced
+from .metering import metered
+
+
+logger = get_logger(__name__)
+
 
 __all__ = ["BaseRouter"]
 
@@ -12,6 +20,7 @@ __all__ = ["BaseRouter"]
 class BaseRouter:
     def __init__(self, prefix: str, tags: List[str]):
         self.router = APIRouter(prefix=prefix, tags=tags)
+        self._chain_paths: set = set()
 
     def configure(self) -> APIRouter:
         self._register_routes()
@@ -22,9 +31,14 @@ class BaseRouter:
     
     def add_chain_routes(self, chains: List[dict]):
         for chain in chains:
+            if chain["path"] in self._chain_paths:
+                logger.warning(f"🔸 Skip duplicated chain route: {self.router.prefix}{chain['path']}")
+                continue
+            self._chain_paths.add(chain["path"])
+            route = f"{self.router.prefix}{chain['path']}"
             add_routes(
                 self.router, 
-                chain["chain"], 
+                metered(coalesced(chain["chain"], route=route), route=route),
                 path=chain["path"], 
                 input_type=chain.get("input_type", "auto"),
                 output_type=chain.get("output_type", "auto")
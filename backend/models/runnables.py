@@ -0,0 +1,85 @@
+import asyncio, functools, inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableLambda, RunnableParallel
+
+
+
+class InlineLambda(RunnableLambda):
+    """
+    `ainvoke`에서도 thread executor를 거치지 않고 event loop에서 바로 실행하는 `RunnableLambda`.
+
+    dict 조회, 문자열 포맷, 프롬프트 채우기처럼 I/O가 없는 짧은 단계용입니다.
+    함수처럼 직접 호출할 수도 있습니다.
+    """
+    def __init__(self, func: Callable[[Any], Any], name: Optional[str] = None):
+        async def afunc(input: Any) -> Any:
+            return func(input)
+        super().__init__(func, afunc=afunc, name=name or getattr(func, "__name__", None))
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.func(*args, **kwargs)
+
+
+def inline(func: Callable[[Any], Any]) -> InlineLambda:
+    """동기 함수 → `InlineLambda`. 이미 Runnable이거나 coroutine 함수면 그대로 반환"""
+    if isinstance(func, Runnable) or inspect.iscoroutinefunction(func):
+        return func
+    return InlineLambda(func)
+
+
+class inline_method:
+    """메서드용 `inline`. `self.printer`처럼 꺼낼 때마다 bound method를 감싼 `InlineLambda`를 돌려줍니다."""
+    def __init__(self, func: Callable):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance: Any, owner: type) -> Any:
+        if instance is None:
+            return self
+        return InlineLambda(self.func.__get__(instance, owner), name=self.func.__name__)
+
+
+
+class BatchedRunnableParallel(RunnableParallel):
+    """
+    `batch` / `abatch`를 입력별 `invoke`가 아니라 각 branch의 `batch`로 전달하는 `RunnableParallel`.
+
+    branch 안의 retriever가 `batch`를 구현하면(`FaissBatchRetriever`) N개 입력이
+    임베딩 요청 한 번, index 검색 한 번으로 처리됩니다.
+    `return_exceptions=True`면 branch 하나라도 실패한 입력은 dict 대신 그 예외 하나로 반환합니다.
+    """
+    @staticmethod
+    def _rows(steps: Dict[str, Any], outputs: Dict[str, List[Any]], size: int) -> List[Any]:
+        rows = []
+        for i in range(size):
+            row = {key: outputs[key][i] for key in steps}
+            rows.append(next((value for value in row.values() if isinstance(value, Exception)), row))
+        return rows
+
+    def batch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Dict[str, Any]]:
+        if not inputs:
+            return []
+        steps = self.steps__
+        with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+            futures = {
+                key: executor.submit(step.batch, inputs, config, return_exceptions=return_exceptions, **kwargs)
+                for key, step in steps.items()
+            }
+            outputs = {key: future.result() for key, future in futures.items()}
+        return self._rows(steps, outputs, len(inputs))
+
+    async def abatch(self, inputs: List[Any], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Dict[str, Any]]:
+        if not inputs:
+            return []
+        steps = self.steps__
+        results = await asyncio.gather(*(
+            step.abatch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+            for step in steps.values()
+        ))
+        return self._rows(steps, dict(zip(steps, results)), len(inputs))
+
+
+
+__all__ = ["BatchedRunnableParallel", "InlineLambda", "inline", "inline_method"]
@@ -0,0 +1,177 @@
+"""
+구조화 출력(structured output)의 행 단위 스트리밍.
+
+`with_structured_output(..., method="json_schema")`의 모델 단계만 떼어 JSON 텍스트를 token 단위로 받고,
+누적 텍스트를 부분 JSON으로 해석해 목록 필드(e.g., `위험성평가표`)의 항목이 완성될 때마다 내보냅니다.
+마지막에는 전체 텍스트를 스키마로 검증한 결과를 내보내며, 검증에 실패하면 `fallback`(일반 호출)로 다시 받습니다.
+"""
+
+import json
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple, Type, get_args, get_origin
+
+from pydantic import BaseModel, ValidationError
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessageChunk
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.utils.json import parse_partial_json
+
+from utils import get_logger
+
+
+logger = get_logger(__name__)
+
+
+
+def json_stream_model(model: BaseLanguageModel, schema: Type[BaseModel]) -> Runnable:
+    """`model.with_structured_output(schema)`에서 parser를 뺀 모델 단계 (content로 JSON 텍스트를 생성)"""
+    return model.with_structured_output(schema, method="json_schema").first
+
+
+def chunk_text(chunk: Any) -> str:
+    if isinstance(chunk, BaseMessageChunk):
+        content = chunk.content
+        if isinstance(content, list):
+            return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+        return content
+    return chunk if isinstance(chunk, str) else ""
+
+
+
+def has_objects(annotation: Any) -> bool:
+    """JSON으로 객체(`{}`)가 되는 타입이 들어 있는지 (pydantic 모델, dict)"""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return True
+    if get_origin(annotation) is dict or annotation is dict:
+        return True
+    return any(has_objects(arg) for arg in get_args(annotation))
+
+
+
+class PartialRows:
+    """
+    누적 JSON 텍스트 → 새로 완성된 `key` 목록 항목.
+
+    문자열 밖의 괄호 깊이를 따라가며 목록 항목의 `}`가 닫히는 순간 그 항목을 완성된 것으로 보고,
+    그런 chunk에서만 부분 JSON을 다시 해석합니다.
+    항목 깊이는 루트 객체 → `key` 목록 → 항목으로 `ITEM_DEPTH`이고, 같은 깊이에 다른 객체가 생기지 않도록
+    `key`가 루트의 `List[BaseModel]` 필드이며 객체를 담는 유일한 필드인지 생성할 때 확인합니다.
+    """
+    ITEM_DEPTH = 3  # `{` (루트) → `[` (`key`) → `{` (항목)
+
+    def __init__(self, schema: Type[BaseModel], key: str):
+        self.key = key
+        self.item_type: Type[BaseModel] = self.check_schema(schema, key)
+        self.text = ""
+        self.emitted = 0
+        self.closed = 0  # `}`까지 들어온 항목 수
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @staticmethod
+    def check_schema(schema: Type[BaseModel], key: str) -> Type[BaseModel]:
+        """`key` 항목 모델. 깊이 `ITEM_DEPTH`의 `}`가 `key` 항목만 뜻하는 스키마가 아니면 `TypeError`"""
+        annotation = schema.model_fields[key].annotation
+        args = get_args(annotation)
+        if get_origin(annotation) is not list or not args or not (isinstance(args[0], type) and issubclass(args[0], BaseModel)):
+            raise TypeError(f"{schema.__name__}.{key} must be List[BaseModel] to stream rows, got {annotation}")
+        others = [name for name, field in schema.model_fields.items() if name != key and has_objects(field.annotation)]
+        if others:
+            raise TypeError(f"{schema.__name__} has other object fields {others}; rows of `{key}` cannot be told apart by depth")
+        return args[0]
+
+    def _scan(self, text: str):
+        for char in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                if char == "}" and self._depth == self.ITEM_DEPTH:
+                    self.closed += 1
+                self._depth -= 1
+
+    def feed(self, text: str) -> List[Tuple[int, BaseModel]]:
+        self.text += text
+        closed = self.closed
+        self._scan(text)
+        if self.closed == closed:
+            return []
+        partial = parse_partial_json(self.text)
+        if not isinstance(partial, dict) or not isinstance(partial.get(self.key), list):
+            return []
+        complete = partial[self.key][:self.closed]
+
+        rows = []
+        for index in range(self.emitted, len(complete)):
+            try:
+                rows.append((index, self.item_type.model_validate(complete[index])))
+            except ValidationError as e:
+                logger.debug(f"🔹 Streamed row {index} is invalid; left for the final output: {e}")
+        self.emitted = max(self.emitted, len(complete))
+        return rows
+
+    def final(self, schema: Type[BaseModel]) -> BaseModel:
+        return schema.model_validate(json.loads(self.text))
+
+
+
+class StructuredRowStream:
+    """
+    `astream(input)` → `("row", index, item)` ... `("final", None, output)`.
+
+    - `model`: JSON 텍스트를 생성하는 모델 단계 (`json_stream_model`)
+    - `fallback`: 전체 결과 검증에 실패했을 때 다시 받을 일반 structured output 단계
+    """
+    def __init__(self,
+                 model: Runnable,
+                 schema: Type[BaseModel],
+                 key: str,
+                 fallback: Optional[Runnable] = None):
+        self.model = model
+        self.schema = schema
+        self.key = key
+        self.fallback = fallback
+        PartialRows.check_schema(schema, key)  # 체인을 만들 때 바로 실패하도록
+
+    def _final(self, rows: PartialRows) -> Optional[BaseModel]:
+        try:
+            return rows.final(self.schema)
+        except (ValueError, ValidationError) as e:
+            if self.fallback is None:
+                raise
+            logger.warning(f"🔸 Streamed {self.schema.__name__} is invalid; retrying without streaming: {e}")
+            return None
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None) -> Iterator[Tuple[str, Optional[int], BaseModel]]:
+        rows = PartialRows(self.schema, self.key)
+        try:
+            for chunk in self.model.stream(input, config):
+                for index, row in rows.feed(chunk_text(chunk)):
+                    yield "row", index, row
+        except ValueError as e:  # SDK가 스트림 끝에서 전체 응답을 파싱하다 실패 (잘린 JSON 등)
+            logger.debug(f"🔹 Structured stream ended with a parse error: {e}")
+        output = self._final(rows)
+        yield "final", None, output if output is not None else self.fallback.invoke(input, config)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None) -> AsyncIterator[Tuple[str, Optional[int], BaseModel]]:
+        rows = PartialRows(self.schema, self.key)
+        try:
+            async for chunk in self.model.astream(input, config):
+                for index, row in rows.feed(chunk_text(chunk)):
+                    yield "row", index, row
+        except ValueError as e:
+            logger.debug(f"🔹 Structured stream ended with a parse error: {e}")
+        output = self._final(rows)
+        yield "final", None, output if output is not None else await self.fallback.ainvoke(input, config)
+
+
+
+__all__ = ["StructuredRowStream", "PartialRows", "json_stream_model"]
@@ -0,0 +1,440 @@
+import asyncio, json, mmap, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
+
+from utils import get_logger
+
+
+logger = get_logger(__name__)
+
+FAISS_PATH: str = "assets/faiss"
+
+# Pickle-free, mmap 가능한 저장 형식
+MMAP_META: str = "mmap.json"
+MMAP_VECTORS: str = "vectors.f32"
+MMAP_NORMS: str = "norms.f32"
+MMAP_DOCSTORE: str = "docstore.bin"
+MMAP_OFFSETS: str = "docstore.idx"
+DOCSTORE_COLUMNS: Tuple[str, ...] = ("id", "page_content", "metadata")
+METRIC_INNER_PRODUCT: int = 0
+METRIC_L2: int = 1
+SEARCH_CHUNK_ROWS: int = 65_536
+FAISS_SEARCH_WORKERS: int = int(os.getenv("FAISS_SEARCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# 비동기 경로의 FAISS 검색 전용 pool (기본 executor를 LLM·기타 작업과 나눠 쓰지 않도록)
+search_executor = ThreadPoolExecutor(max_workers=FAISS_SEARCH_WORKERS, thread_name_prefix="faiss-search")
+
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """`Embeddings` 인스턴스를 식별할 수 있는 모델 이름 (e.g., `text-embedding-3-large`)"""
+    return getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or type(embeddings).__name__
+
+
+def current_rss() -> Optional[int]:
+    """현재 프로세스의 RSS (bytes). `/proc`이 없는 환경에서는 `None`."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+
+class MmapFlatIndex:
+    """
+    `vectors.f32`를 mmap으로 연 brute-force 인덱스.
+
+    `faiss.IndexFlat`과 같은 `search` / `reconstruct` 인터페이스를 제공하므로
+    langchain `FAISS` 벡터스토어의 `index` 자리에 그대로 넣을 수 있습니다.
+    벡터는 page cache에 한 번만 올라가고 모든 uvicorn worker가 공유합니다.
+    """
+    def __init__(self, vectors: np.ndarray, norms: np.ndarray, metric_type: int = METRIC_L2):
+        self.vectors = vectors
+        self.norms = norms
+        self.metric_type = metric_type
+
+    @property
+    def ntotal(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def d(self) -> int:
+        return self.vectors.shape[1]
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return np.array(self.vectors[int(i)], dtype=np.float32)
+
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        return np.array(self.vectors[i0:i0 + n], dtype=np.float32)
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        n = x.shape[0]
+        k = max(int(k), 1)
+        ascending = self.metric_type == METRIC_L2
+        fill = np.inf if ascending else -np.inf
+        best_d = np.full((n, k), fill, dtype=np.float32)
+        best_i = np.full((n, k), -1, dtype=np.int64)
+        q_norms = np.einsum("ij,ij->i", x, x)[:, None] if ascending else None
+
+        for start in range(0, self.ntotal, SEARCH_CHUNK_ROWS):
+            block = self.vectors[start:start + SEARCH_CHUNK_ROWS]
+            scores = x @ block.T
+            if ascending:
+                # ||x - v||² = ||x||² - 2x·v + ||v||² (faiss `IndexFlatL2`과 같은 squared L2)
+                scores = q_norms - 2.0 * scores + self.norms[start:start + SEARCH_CHUNK_ROWS][None, :]
+            ids = np.broadcast_to(np.arange(start, start + block.shape[0], dtype=np.int64), scores.shape)
+            best_d = np.concatenate([best_d, scores.astype(np.float32)], axis=1)
+            best_i = np.concatenate([best_i, ids], axis=1)
+            order = np.argsort(best_d if ascending else -best_d, axis=1, kind="stable")[:, :k]
+            best_d = np.take_along_axis(best_d, order, axis=1)
+            best_i = np.take_along_axis(best_i, order, axis=1)
+        return best_d, best_i
+
+
+
+class MmapDocstore(Docstore):
+    """
+    `docstore.bin` (열 단위로 이어 붙인 UTF-8 데이터)와 `docstore.idx` (열별 offset)를 mmap으로 읽는 docstore.
+    요청된 행만 그때그때 decode 합니다.
+    """
+    def __init__(self, data: mmap.mmap, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets  # shape: (len(DOCSTORE_COLUMNS), n + 1)
+        self._positions: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return self._offsets.shape[1] - 1
+
+    def _cell(self, column: str, row: int) -> str:
+        col = DOCSTORE_COLUMNS.index(column)
+        start, end = int(self._offsets[col, row]), int(self._offsets[col, row + 1])
+        return self._data[start:end].decode("utf-8")
+
+    def id_at(self, row: int) -> str:
+        return self._cell("id", row)
+
+    def document_at(self, row: int) -> Document:
+        return Document(
+            id=self.id_at(row),
+            page_content=self._cell("page_content", row),
+            metadata=json.loads(self._cell("metadata", row)),
+        )
+
+    def search(self, search: str) -> Document | str:
+        if self._positions is None:
+            self._positions = {self.id_at(row): row for row in range(len(self))}
+        row = self._positions.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.document_at(row)
+
+
+
+class MmapDocstoreIds(Sequence):
+    """`index_to_docstore_id` 대용. 인덱스 위치 → docstore id"""
+    def __init__(self, docstore: MmapDocstore):
+        self._docstore = docstore
+
+    def __len__(self) -> int:
+        return len(self._docstore)
+
+    def __getitem__(self, i):
+        return self._docstore.id_at(int(i))
+
+    def values(self) -> List[str]:
+        return list(self)
+
+
+
+def convert_to_mmap(path: str, embeddings: Optional[Embeddings] = None) -> Dict[str, Any]:
+    """`FAISS.save_local` 결과(`index.faiss` + `index.pkl`)를 mmap 형식으로 변환 (오프라인 1회)"""
+    store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    index = store.index
+    if index.metric_type not in (METRIC_L2, METRIC_INNER_PRODUCT):
+        raise ValueError(f"Unsupported FAISS metric: {index.metric_type = }")
+
+    vectors = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+    norms = np.einsum("ij,ij->i", vectors, vectors).astype(np.float32)
+    vectors.tofile(os.path.join(path, MMAP_VECTORS))
+    norms.tofile(os.path.join(path, MMAP_NORMS))
+
+    ids = [store.index_to_docstore_id[i] for i in range(index.ntotal)]
+    docs = [store.docstore.search(_id) for _id in ids]
+    columns = {
+        "id": [str(_id).encode("utf-8") for _id in ids],
+        "page_content": [doc.page_content.encode("utf-8") for doc in docs],
+        "metadata": [json.dumps(doc.metadata, ensure_ascii=False).encode("utf-8") for doc in docs],
+    }
+    offsets = np.zeros((len(DOCSTORE_COLUMNS), len(ids) + 1), dtype=np.uint64)
+    position = 0
+    with open(os.path.join(path, MMAP_DOCSTORE), "wb") as f:
+        for col, column in enumerate(DOCSTORE_COLUMNS):
+            for row, cell in enumerate(columns[column]):
+                offsets[col, row] = position
+                f.write(cell)
+                position += len(cell)
+            offsets[col, len(ids)] = position
+    offsets.tofile(os.path.join(path, MMAP_OFFSETS))
+
+    meta = {
+        "ntotal": int(index.ntotal),
+        "dim": int(index.d),
+        "metric_type": int(index.metric_type),
+        "distance_strategy": str(store.distance_strategy.value),
+        "normalize_L2": bool(store._normalize_L2),
+        "columns": list(DOCSTORE_COLUMNS),
+    }
+    with open(os.path.join(path, MMAP_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def load_mmap(path: str, embeddings: Embeddings, **kwargs) -> FAISS:
+    """mmap 형식 디렉토리를 unpickle 없이 `FAISS` 벡터스토어로 로드"""
+    with open(os.path.join(path, MMAP_META), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    ntotal, dim = meta["ntotal"], meta["dim"]
+
+    vectors = np.memmap(os.path.join(path, MMAP_VECTORS), dtype=np.float32, mode="r", shape=(ntotal, dim))
+    norms = np.memmap(os.path.join(path, MMAP_NORMS), dtype=np.float32, mode="r", shape=(ntotal,))
+    offsets = np.memmap(os.path.join(path, MMAP_OFFSETS), dtype=np.uint64, mode="r", shape=(len(meta["columns"]), ntotal + 1))
+    with open(os.path.join(path, MMAP_DOCSTORE), "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    docstore = MmapDocstore(data, offsets)
+    kwargs.setdefault("distance_strategy", DistanceStrategy(meta["distance_strategy"]))
+    kwargs.setdefault("normalize_L2", meta["normalize_L2"])
+    return FAISS(
+        embeddings,
+        MmapFlatIndex(vectors, norms, meta["metric_type"]),
+        docstore,
+        MmapDocstoreIds(docstore),
+        **kwargs
+    )
+
+
+
+def similarity_search_by_vectors(store: FAISS, vectors: Sequence[Sequence[float]], k: int = 4) -> List[List[Tuple[Document, float]]]:
+    """N개의 쿼리 벡터를 (N, d) float32 행렬로 묶어 `index.search` 한 번으로 검색"""
+    if len(vectors) == 0:
+        return []
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    if store._normalize_L2:
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    scores, indices = store.index.search(np.ascontiguousarray(matrix), k)
+
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        docs = []
+        for score, i in zip(row_scores, row_indices):
+            if i == -1:
+                continue
+            doc = store.docstore.search(store.index_to_docstore_id[int(i)])
+            if isinstance(doc, Document):
+                docs.append((doc, float(score)))
+        results.append(docs)
+    return results
+
+
+
+class FaissBatchRetriever(Runnable):
+    """
+    단건 `invoke`는 기존 `VectorStoreRetriever`와 같고,
+    `batch` / `abatch`는 N개 질의를 `embed_documents` 한 번 + `index.search` 한 번으로 처리하는 retriever.
+
+    비동기 경로는 `aembed_*`로 임베딩하고, CPU 검색만 `search_executor`에서 실행합니다.
+    """
+    def __init__(self, store: FAISS, k: int = 4, retriever: Optional[VectorStoreRetriever] = None):
+        self.store = store
+        self.k = k
+        self.retriever = retriever or store.as_retriever(search_kwargs={"k": k})
+
+    async def asearch(self, vectors: Sequence[Sequence[float]]) -> List[List[Document]]:
+        loop = asyncio.get_running_loop()
+        searched = await loop.run_in_executor(search_executor, similarity_search_by_vectors, self.store, vectors, self.k)
+        return [[doc for doc, _ in docs] for docs in searched]
+
+    def _relevance(self, searched: List[List[Tuple[Document, float]]]) -> List[List[Tuple[Document, float]]]:
+        # 거리(L2)·내적 모두 "클수록 관련 있음" 점수로 맞춤 (다른 질의의 결과끼리 다시 정렬할 때 사용)
+        relevance = self.store._select_relevance_score_fn()
+        return [[(doc, relevance(score)) for doc, score in docs] for docs in searched]
+
+    def retrieve_with_relevance(self, queries: List[str], k: Optional[int] = None) -> List[List[Tuple[Document, float]]]:
+        if not queries:
+            return []
+        vectors = self.store.embedding_function.embed_documents(list(queries))
+        return self._relevance(similarity_search_by_vectors(self.store, vectors, k or self.k))
+
+    async def aretrieve_with_relevance(self, queries: List[str], k: Optional[int] = None) -> List[List[Tuple[Document, float]]]:
+        if not queries:
+            return []
+        vectors = await self.store.embedding_function.aembed_documents(list(queries))
+        loop = asyncio.get_running_loop()
+        searched = await loop.run_in_executor(search_executor, similarity_search_by_vectors, self.store, vectors, k or self.k)
+        return self._relevance(searched)
+
+    async def _aretrieve(self, input: str) -> List[Document]:
+        vector = await self.store.embedding_function.aembed_query(input)
+        return (await self.asearch([vector]))[0]
+
+    def invoke(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> List[Document]:
+        return self.retriever.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> List[Document]:
+        return await self._acall_with_config(self._aretrieve, input, config, run_type="retriever")
+
+    def retrieve_many(self, queries: List[str]) -> List[List[Document]]:
+        if not queries:
+            return []
+        vectors = self.store.embedding_function.embed_documents(list(queries))
+        return [[doc for doc, _ in docs] for docs in similarity_search_by_vectors(self.store, vectors, self.k)]
+
+    async def aretrieve_many(self, queries: List[str]) -> List[List[Document]]:
+        if not queries:
+            return []
+        vectors = await self.store.embedding_function.aembed_documents(list(queries))
+        return await self.asearch(vectors)
+
+    # 임베딩 요청 한 번에 묶이므로 실패하면 모든 입력이 같은 예외
+    def batch(self, inputs: List[str], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        try:
+            return self.retrieve_many(inputs)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return [e] * len(inputs)
+
+    async def abatch(self, inputs: List[str], config=None, *, return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        try:
+            return await self.aretrieve_many(inputs)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return [e] * len(inputs)
+
+
+
+class VectorStoreRegistry:
+    """
+    프로세스 단위로 공유되는 FAISS 인덱스 레지스트리.
+
+    `(file_name, embedding model)` 별로 최초 요청 시 한 번만 `load_local` 하고,
+    이후에는 모든 체인이 같은 `VectorStore` 인스턴스를 공유합니다.
+    """
+    def __init__(self, root: str = FAISS_PATH):
+        self.root = root
+        self._stores: Dict[Tuple[str, str], VectorStore] = {}
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, file_name: str, embeddings: Embeddings, **storage_kwargs) -> VectorStore:
+        key = (file_name, embedding_model_name(embeddings))
+        store = self._stores.get(key)
+        if store is not None:
+            self._stats[key]["hits"] += 1
+            return store
+
+        # 같은 인덱스를 동시에 여러 번 읽지 않도록 key 단위로 잠금
+        with self._lock_for(key):
+            store = self._stores.get(key)
+            if store is None:
+                store = self._load(key, embeddings, **storage_kwargs)
+                self._stores[key] = store
+            else:
+                self._stats[key]["hits"] += 1
+        return store
+
+    def _load(self, key: Tuple[str, str], embeddings: Embeddings, **storage_kwargs) -> VectorStore:
+        file_name, model_name = key
+        path = os.path.join(self.root, file_name)
+        is_mmap = os.path.exists(os.path.join(path, MMAP_META))
+        rss_before = current_rss()
+        started = time.perf_counter()
+        if is_mmap:
+            storage_kwargs.pop("allow_dangerous_deserialization", None)
+            store = load_mmap(path, embeddings, **storage_kwargs)
+        else:
+            store = FAISS.load_local(path, embeddings, **storage_kwargs)
+        elapsed = time.perf_counter() - started
+        rss_after = current_rss()
+
+        index = getattr(store, "index", None)
+        ntotal = getattr(index, "ntotal", 0)
+        dim = getattr(index, "d", 0)
+        self._stats[key] = {
+            "file_name": file_name,
+            "embeddings": model_name,
+            "format": "mmap" if is_mmap else "pickle",
+            "ntotal": ntotal,
+            "dim": dim,
+            "vector_bytes": ntotal * dim * 4,
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            "load_seconds": round(elapsed, 4),
+            "loaded_at": time.time(),
+            "hits": 0,
+        }
+        logger.info(f"🔹 FAISS loaded: {file_name} ({model_name}) {ntotal=} {dim=} in {elapsed:.2f}s")
+        return store
+
+    def clear(self):
+        with self._guard:
+            self._stores.clear()
+            self._stats.clear()
+            self._locks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        items = [dict(stat) for stat in self._stats.values()]
+        return {
+            "count": len(items),
+            "total_load_seconds": round(sum(item["load_seconds"] for item in items), 4),
+            "total_vector_bytes": sum(item["vector_bytes"] for item in items),
+            "rss_bytes": current_rss(),
+            "stores": items,
+        }
+
+
+vectorstore_registry = VectorStoreRegistry()
+
+
+
+__all__ = [
+    "VectorStoreRegistry",
+    "vectorstore_registry",
+    "embedding_model_name",
+    "MmapFlatIndex",
+    "MmapDocstore",
+    "convert_to_mmap",
+    "load_mmap",
+    "similarity_search_by_vectors",
+    "FaissBatchRetriever",
+    "search_executor",
+    "FAISS_SEARCH_WORKERS",
+]
+
+
+if __name__ == "__main__":
+    # python -m models.vectorstore faiss_law_bgem3 "faiss_K+S+O_Train_v7_10" ...
+    import sys
+
+    for file_name in sys.argv[1:] or sorted(os.listdir(FAISS_PATH)):
+        path = os.path.join(FAISS_PATH, file_name)
+        if not os.path.exists(os.path.join(path, "index.faiss")):
+            logger.warning(f"🔸 Skip {file_name}: `index.faiss` not found.")
+            continue
+        logger.info(f"🔹 {file_name}: {convert_to_mmap(path)}")
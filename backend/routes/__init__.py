@@ -4,6 +4,8 @@ Endpoints implementation for Backend.
 
 from fastapi import FastAPI
 
+from models import chain_registry, CHAIN_WARMUP
+
 ##### Home UI ######
 from .home import HomeRouter
 
@@ -37,4 +39,5 @@ def configure_routers(app: FastAPI) -> FastAPI:
     for router in routers:
         router = router.configure()
         app.include_router(router)
+    chain_registry.warmup(CHAIN_WARMUP)
     return app
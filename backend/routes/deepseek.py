@@ -1,14 +1,14 @@
-from langchain_ollama import ChatOllama
 from langserve import add_routes
 
 # from chains import configure_chains
 
 from models import BaseRouter
+from utils import ollama_call
 
 
 OLLAMA_URL = "http://snucem1.iptime.org:11434"
 
-deepseek_r1 = ChatOllama(model="deepseek-r1:32b", base_url=OLLAMA_URL)
+deepseek_r1 = ollama_call(model="deepseek-r1:32b", base_url=OLLAMA_URL)
 # deepseek_r1_chains = configure_chains(incorporation="ollama", 
 #                                      model="deepseek-r1:32b", 
 #                                      embeddings="text-embedding-ada-002")
@@ -1,5 +1,6 @@
-from models import BaseRouter
+from models import BaseRouter, backend_registry, cascade_stats, image_hazard_cache, response_cache, single_flight, vectorstore_registry
 from schemas import BaseResponse
+from utils import client_registry, embedding_cache, image_processor, rate_limiters, usage_meter
 
 class HealthRouterV1(BaseRouter):
     def __init__(self):
@@ -13,6 +14,83 @@ class HealthRouterV1(BaseRouter):
             response_model=BaseResponse,
             description="Health check endpoint to verify if the service is running."
         )
+        self.router.add_api_route(
+            path="/faiss",
+            endpoint=self.faiss_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Load time and memory stats of the FAISS indexes shared by all chains."
+        )
+        self.router.add_api_route(
+            path="/embeddings",
+            endpoint=self.embedding_cache_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Hit rate of the query-embedding cache used by the retrievers."
+        )
+        self.router.add_api_route(
+            path="/response-cache",
+            endpoint=self.response_cache_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Hit, bypass and eviction counts of the chain response cache."
+        )
+        self.router.add_api_route(
+            path="/images",
+            endpoint=self.image_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Bytes and estimated vision tokens saved by site-image downscaling and dedupe."
+        )
+        self.router.add_api_route(
+            path="/image-hazards",
+            endpoint=self.image_hazard_cache_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Hit and miss counts of the per-photo hazard cache (perceptual hash)."
+        )
+        self.router.add_api_route(
+            path="/metering",
+            endpoint=self.metering_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Token usage and cost per route and model, with cost per request."
+        )
+        self.router.add_api_route(
+            path="/clients",
+            endpoint=self.client_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Shared LLM/embedding clients and HTTP connection-pool utilization per provider."
+        )
+        self.router.add_api_route(
+            path="/rate-limits",
+            endpoint=self.rate_limit_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Token-bucket levels, queue depth by priority, waits and shed requests per provider/model."
+        )
+        self.router.add_api_route(
+            path="/backends",
+            endpoint=self.backend_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Rolling p50/p95 latency, error rate, circuit-breaker state and hedged requests per backend."
+        )
+        self.router.add_api_route(
+            path="/cascade",
+            endpoint=self.cascade_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="Draft-model acceptance, escalation rates by reason, and cost/latency saved per cascade route."
+        )
+        self.router.add_api_route(
+            path="/coalescing",
+            endpoint=self.coalescing_stats,
+            methods=["GET"],
+            response_model=BaseResponse,
+            description="In-flight shared executions and coalesced (follower) requests per chain route."
+        )
 
     def health_check(self):
         return BaseResponse(
@@ -23,5 +101,104 @@ class HealthRouterV1(BaseRouter):
             error=None
         )
 
+    def faiss_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="FAISS index registry stats",
+            data=vectorstore_registry.stats(),
+            error=None
+        )
+
+    def embedding_cache_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Query-embedding cache stats",
+            data=embedding_cache.stats(),
+            error=None
+        )
+
+    def response_cache_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Chain response cache stats",
+            data=response_cache.stats(),
+            error=None
+        )
+
+    def image_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Site-image preprocessing stats",
+            data=image_processor.stats(),
+            error=None
+        )
+
+    def image_hazard_cache_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Per-photo hazard cache stats",
+            data=image_hazard_cache.stats(),
+            error=None
+        )
+
+    def metering_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Token and cost metering stats",
+            data=usage_meter.stats(),
+            error=None
+        )
+
+    def client_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Shared client registry stats",
+            data=client_registry.stats(),
+            error=None
+        )
+
+    def rate_limit_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="LLM rate limiter stats",
+            data=rate_limiters.stats(),
+            error=None
+        )
+
+    def backend_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Backend latency and circuit-breaker stats",
+            data=backend_registry.stats(),
+            error=None
+        )
+
+    def cascade_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Model cascade stats",
+            data=cascade_stats.stats(),
+            error=None
+        )
+
+    def coalescing_stats(self):
+        return BaseResponse(
+            status="ok",
+            code=200,
+            message="Single-flight request coalescing stats",
+            data=single_flight.stats(),
+            error=None
+        )
+
 __all__ = ["HealthRouterV1"]
 
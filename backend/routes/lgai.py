@@ -1,14 +1,14 @@
-from langchain_ollama import ChatOllama
 from langserve import add_routes
 
 # from chains import configure_chains
 
 from models import BaseRouter
+from utils import ollama_call
 
 
 OLLAMA_URL = "http://snucem1.iptime.org:11434"
 
-exaone_35 = ChatOllama(model="exaone3.5:latest", base_url=OLLAMA_URL)
+exaone_35 = ollama_call(model="exaone3.5:latest", base_url=OLLAMA_URL)
 # exaone_35_chains = configure_chains(incorporation="ollama", 
 #                                      model="exaone3.5:latest", 
 #                                      embeddings="text-embedding-ada-002")
@@ -1,4 +1,4 @@
-from typing import Dict, List, Literal
+from typing import Dict, List, Literal, Optional
 
 from langserve import CustomUserType
 from pydantic import BaseModel, Field
@@ -219,6 +219,27 @@ class RiskAssessmentOutput(BaseModel):
     )
 
 
+# 위험성평가 일괄 요청의 입력 필드
+class BulkRiskAssessmentInput(BaseModel):
+    items: List[RiskAssessmentInput] = Field(
+        description="위험성평가 대상 작업 목록. 일일 작업계획의 작업별 입력을 한 번에 전달합니다."
+    )
+
+
+# 위험성평가 일괄 요청의 작업별 결과
+class BulkRiskAssessmentResult(BaseModel):
+    index: int = Field(description="`items` 안에서의 입력 순서 (0부터 시작). 결과는 완료되는 순서대로 전달됩니다.")
+    output: Optional[RiskAssessmentOutput] = Field(None, description="해당 작업의 위험성평가 결과")
+    error: Optional[str] = Field(None, description="해당 작업 처리 중 발생한 오류 메시지")
+
+
+class RiskAssessmentStreamEvent(BaseModel):
+    event: Literal["row", "final"] = Field(description="`row`: 생성이 끝난 위험성평가표 항목 하나, `final`: 검증을 마친 전체 결과")
+    index: Optional[int] = Field(None, description="`row` 이벤트의 위험성평가표 내 순서 (0부터 시작)")
+    row: Optional[RiskItemV3] = Field(None, description="`row` 이벤트의 위험성평가표 항목")
+    output: Optional[RiskAssessmentOutput] = Field(None, description="`final` 이벤트의 전체 위험성평가 결과")
+
+
 # 위험성평가 자동화 실험을 위한 모듈 의 입력 필드
 class RiskAssessmentEvalInputV1(BaseModel):
     process_major_category: str = Field(
@@ -325,6 +346,10 @@ __all__ = [
     "RiskAssessmentInput", 
     "RiskAssessmentOutput", 
 
+    "BulkRiskAssessmentInput",
+    "BulkRiskAssessmentResult",
+    "RiskAssessmentStreamEvent",
+
     "risk_assessment_map",
 
     "RiskAssessmentEvalInputV2", 
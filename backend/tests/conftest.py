@@ -0,0 +1,5 @@
+import os, sys
+
+# 테스트는 `backend/`를 기준으로 import (`models`, `utils`, `chains`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
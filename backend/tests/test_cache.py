@@ -0,0 +1,97 @@
+import asyncio
+
+from langchain_core.runnables import Runnable, RunnableGenerator
+
+from models.cache import CachedChain, ResponseCache, canonical_hash
+
+
+def prepare(data):
+    return f"ns:{canonical_hash(data)}", None, {}
+
+
+class Recorder(Runnable):
+    """batch 호출을 기록하는 가짜 체인"""
+    def __init__(self):
+        self.invokes = []
+        self.batches = []
+
+    def invoke(self, input, config=None, **kwargs):
+        self.invokes.append(input)
+        return {"echo": input}
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        self.batches.append(list(inputs))
+        return [ValueError(x) if x == "bad" else {"echo": x} for x in inputs] if return_exceptions else [{"echo": x} for x in inputs]
+
+    async def abatch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        return self.batch(inputs, config, return_exceptions=return_exceptions)
+
+
+def test_exact_hit_and_single_miss_count():
+    cache = ResponseCache()
+    assert cache.get("k") is None
+    cache.set("k", 1, "ns")
+    assert cache.get("k") == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_similar_lookup_counts_once():
+    cache = ResponseCache()
+    cache.set("a", "A", "ns", vector=[1.0, 0.0])
+    assert cache.get("b", count_miss=False) is None
+    assert cache.lookup_similar("ns", [0.99, 0.01], max_distance=0.05) == "A"
+    assert cache.lookup_similar("ns", [0.0, 1.0], max_distance=0.05) is None
+    assert (cache.similar_hits, cache.misses) == (1, 1)
+
+
+def test_evicted_entries_drop_empty_indexes():
+    cache = ResponseCache(maxsize=2)
+    for i in range(5):
+        cache.set(f"k{i}", i, "ns", image_digest=f"img{i}", vector=[1.0, float(i)])
+    assert len(cache._indexes) == 2
+
+
+def test_expired_entries_are_not_served():
+    cache = ResponseCache(ttl=1)
+    cache.set("a", "A", "ns", vector=[1.0, 0.0])
+    cache._entries["a"].created -= 10
+    assert cache.lookup_similar("ns", [1.0, 0.0], max_distance=0.05) is None
+    assert not cache._indexes
+
+
+def test_batch_sends_misses_in_one_call():
+    inner, cache = Recorder(), ResponseCache()
+    chain = CachedChain(inner, "ns", prepare, cache=cache)
+    chain.invoke("a")
+    results = chain.batch(["a", "b", "b", "c"])
+    assert [r["echo"] for r in results] == ["a", "b", "b", "c"]
+    assert inner.batches == [["b", "c"]]
+    assert cache.get(prepare("b")[0]) == {"echo": "b"}
+
+
+def test_abatch_returns_exceptions_without_caching_them():
+    inner, cache = Recorder(), ResponseCache()
+    chain = CachedChain(inner, "ns", prepare, cache=cache)
+    results = asyncio.run(chain.abatch(["ok", "bad"], return_exceptions=True))
+    assert results[0] == {"echo": "ok"} and isinstance(results[1], ValueError)
+    assert cache.get(prepare("bad")[0]) is None
+
+
+def test_stream_passes_chunks_through_and_caches_the_whole():
+    def chunks(inputs):
+        for _ in inputs:
+            yield from ([0], [1], [2])
+
+    cache = ResponseCache()
+    chain = CachedChain(RunnableGenerator(chunks), "ns", prepare, cache=cache)
+    assert list(chain.stream("x")) == [[0], [1], [2]]
+    assert list(chain.stream("x")) == [[0, 1, 2]]
+    assert cache.hits == 1
+
+
+def test_bypassed_inputs_skip_the_cache():
+    inner, cache = Recorder(), ResponseCache()
+    chain = CachedChain(inner, "ns", lambda data: None, cache=cache)
+    chain.invoke("a")
+    chain.invoke("a")
+    assert len(inner.invokes) == 2 and not cache._entries
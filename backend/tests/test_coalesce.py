@@ -0,0 +1,78 @@
+import asyncio
+
+from langchain_core.runnables import Runnable
+
+from models.coalesce import SingleFlight, flight_key
+
+
+class Slow(Runnable):
+    """실행 횟수를 세는 가짜 체인"""
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.runs = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        self.runs += 1
+        return {"echo": input}
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        self.runs += 1
+        await asyncio.sleep(self.delay)
+        return {"echo": input}
+
+    async def astream(self, input, config=None, **kwargs):
+        self.runs += 1
+        yield 1
+        if self.runs == 1:
+            await asyncio.sleep(self.delay)  # 첫 실행만 두 번째 chunk가 늦음
+        yield 2
+
+
+def test_concurrent_requests_run_once():
+    flights, chain = SingleFlight(), Slow()
+
+    async def main():
+        return await asyncio.gather(*(flights.ainvoke(chain, "/r", {"a": 1}, None) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert chain.runs == 1
+    assert all(result == {"echo": {"a": 1}} for result in results)
+    assert results[0] is not results[1]  # 뒤에 온 요청은 복사본
+
+
+def test_different_configurable_is_not_merged():
+    flights, chain = SingleFlight(), Slow()
+
+    async def main():
+        return await asyncio.gather(
+            flights.ainvoke(chain, "/r", "x", {"configurable": {"model": "a"}}),
+            flights.ainvoke(chain, "/r", "x", {"configurable": {"model": "b"}}),
+        )
+
+    asyncio.run(main())
+    assert chain.runs == 2
+
+
+def test_flight_key_ignores_handler_identity():
+    class Handler:
+        pass
+
+    assert flight_key("ainvoke", "/r", "x", {"callbacks": [Handler()]}) == flight_key("ainvoke", "/r", "x", {"callbacks": [Handler()]})
+    assert flight_key("ainvoke", "/r", "x", {"callbacks": [Handler()]}) != flight_key("ainvoke", "/r", "x", None)
+
+
+def test_stream_follower_falls_back_between_chunks():
+    flights, chain = SingleFlight(max_wait=0.05), Slow(delay=0.5)
+
+    async def collect():
+        return [chunk async for chunk in flights.astream(chain, "/r", "x", None)]
+
+    async def main():
+        leader = asyncio.create_task(collect())
+        await asyncio.sleep(0.01)
+        follower = await collect()
+        return await leader, follower
+
+    leader, follower = asyncio.run(main())
+    assert leader == follower == [1, 2]
+    assert flights.stats()["routes"]["/r"]["timeouts"] == 1
@@ -0,0 +1,95 @@
+import asyncio, time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+import models.hedging as hedging
+from models.hedging import BREAKER_FAILURES, BackendRegistry, BackendUnavailable, HedgedRunnable
+
+
+class ClientError(Exception):
+    status_code = 429
+
+
+def backend(answer: str, delay: float = 0.0, error: Exception = None, calls: list = None):
+    """`answer`를 돌려주는 가짜 backend. 호출 순서를 `calls`에 기록"""
+    def run(input):
+        if calls is not None:
+            calls.append(answer)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return answer
+
+    async def arun(input):
+        if calls is not None:
+            calls.append(answer)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return answer
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def trip(registry: BackendRegistry, key: str):
+    for _ in range(BREAKER_FAILURES):
+        registry.record(key, 0.0, ok=False)
+
+
+@pytest.fixture(autouse=True)
+def short_delay(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DELAY", "0.05")
+
+
+def test_slow_primary_is_answered_by_secondary():
+    registry = BackendRegistry()
+    hedged = HedgedRunnable(backend("a", delay=0.5), backend("b"), "a", "b", registry=registry)
+
+    assert hedged.invoke("x") == "b"
+    assert asyncio.run(hedged.ainvoke("x")) == "b"
+    stats = registry.stats()["a"]
+    assert stats["hedged"] == 2 and stats["secondary_wins"] == 2
+
+
+def test_client_error_is_not_hedged():
+    registry, calls = BackendRegistry(), []
+    hedged = HedgedRunnable(backend("a", error=ClientError(), calls=calls), backend("b", calls=calls), "a", "b", registry=registry)
+
+    with pytest.raises(ClientError):
+        hedged.invoke("x")
+    assert calls == ["a"]
+    assert registry.stats()["a"]["samples"] == 0  # breaker에 기록하지 않음
+
+
+def test_open_secondary_is_not_hedged():
+    registry, calls = BackendRegistry(), []
+    trip(registry, "b")
+    hedged = HedgedRunnable(backend("a", delay=0.2, calls=calls), backend("b", calls=calls), "a", "b", registry=registry)
+
+    assert hedged.invoke("x") == "a"
+    assert calls == ["a"]
+    assert registry.stats()["a"]["hedged"] == 0
+
+
+def test_open_primary_is_rerouted():
+    registry = BackendRegistry()
+    trip(registry, "a")
+    hedged = HedgedRunnable(backend("a"), backend("b"), "a", "b", registry=registry)
+
+    assert hedged.invoke("x") == "b"
+    assert registry.stats()["a"]["rerouted"] == 1
+
+    trip(registry, "b")
+    with pytest.raises(BackendUnavailable) as info:
+        hedged.invoke("x")
+    assert info.value.status_code == 503
+    assert int(info.value.headers["Retry-After"]) >= 1
+
+
+def test_stream_fails_over_before_first_chunk():
+    registry = BackendRegistry()
+    hedged = HedgedRunnable(backend("a", error=RuntimeError("down")), backend("b"), "a", "b", registry=registry)
+
+    assert list(hedged.stream("x")) == ["b"]
+    assert registry.stats()["a"]["answered_by"] == {"b": 1}
@@ -0,0 +1,38 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from models.packing import CONTEXT_TOKEN_BUDGET, ContextPacker, context_budget, render_content
+from utils import num_tokens_from_string
+
+
+def test_context_budget_uses_longest_prefix():
+    assert context_budget("gpt-4.1-2025-04-14") == 3000
+    assert context_budget("gpt-4o-mini") == 2000
+    assert context_budget("gpt-4o-2024-08-06") == 3000
+    assert context_budget("gpt-oss:20b") == 1500
+    assert context_budget("gpt-4.10") == CONTEXT_TOKEN_BUDGET  # 이름 경계가 아닌 곳에서는 일치로 보지 않음
+
+
+def test_text_dedupe_without_store():
+    docs = [Document("비계 작업 중 추락"), Document(" 비계  작업 중 추락 "), Document("중장비 협착")]
+    packed = ContextPacker(10_000, "gpt-4.1", render=render_content).pack(docs)
+    assert [doc.page_content for doc in packed] == ["비계 작업 중 추락", "중장비 협착"]
+
+
+def test_vector_dedupe_with_store():
+    store = FAISS.from_embeddings(
+        [("추락", [1.0, 0.0, 0.0]), ("추락 위험", [0.99, 0.05, 0.0]), ("협착", [0.0, 1.0, 0.0])],
+        DeterministicFakeEmbedding(size=3),
+    )
+    docs = store.similarity_search_by_vector([1.0, 0.0, 0.0], k=3)
+    packed = ContextPacker(10_000, "gpt-4.1", store=store, render=render_content).pack(docs)
+    assert [doc.page_content for doc in packed] == ["추락", "협착"]
+
+
+def test_budget_skips_overflow_and_keeps_one():
+    long, short = Document("위험 " * 200), Document("추락")
+    budget = num_tokens_from_string(render_content(long), "gpt-4.1") - 1
+
+    assert ContextPacker(budget, "gpt-4.1", render=render_content).pack([long, short]) == [long]
+    assert ContextPacker(budget, "gpt-4.1", render=render_content).pack([short, long, Document("협착")]) == [short, Document("협착")]
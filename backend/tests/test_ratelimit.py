@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from utils.ratelimit import DEFAULT_PRIORITY, RateLimitExceeded, RateLimiter, route_priority
+
+
+def test_route_priority():
+    assert route_priority("/gpt-4.1/pi-ratings/bulk") == 1
+    assert route_priority("/gpt-4.1/pi-ratings") == 0
+    assert route_priority("/eval/gpt-4.1/pi-ratings") == 2
+    assert route_priority(None) == route_priority("/unknown") == DEFAULT_PRIORITY
+
+
+def test_sheds_when_projected_wait_exceeds_max_wait():
+    limiter = RateLimiter("test", rpm=60, max_wait=0.5)
+    limiter.acquire(0, requests=60)  # bucket을 비움 → 다음 요청은 1초 뒤
+
+    with pytest.raises(RateLimitExceeded) as info:
+        limiter.acquire(0)
+    assert info.value.status_code == 429
+    assert info.value.headers["Retry-After"] == "1"
+    assert limiter.stats()["shed"] == 1
+
+
+def test_higher_priority_is_admitted_first():
+    limiter = RateLimiter("test", rpm=600, max_wait=5)  # 0.1초에 한 건
+    limiter.acquire(0, requests=600)
+    order = []
+
+    async def request(name: str, priority: int):
+        await limiter.aacquire(0, priority=priority)
+        order.append(name)
+
+    async def main():
+        low = asyncio.create_task(request("low", 2))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(low, request("high", 0))
+
+    asyncio.run(main())
+    assert order == ["high", "low"]
+
+
+def test_settle_returns_unused_tokens():
+    limiter = RateLimiter("test", tpm=1000)
+    limiter.acquire(800)
+    limiter.settle(800, 300)
+    assert limiter.stats()["tokens_available"] >= 700
@@ -0,0 +1,61 @@
+import json
+from typing import Dict, List
+
+import pytest
+from pydantic import BaseModel
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+from models.streaming import PartialRows, StructuredRowStream
+from schemas import RiskAssessmentOutput
+
+
+class Row(BaseModel):
+    name: str
+
+
+class Table(BaseModel):
+    title: str
+    rows: List[Row]
+
+
+def chunks(text: str, size: int = 3) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_row_is_emitted_when_its_brace_closes():
+    rows = PartialRows(Table, "rows")
+    assert rows.feed('{"title": "t", "rows": [{"name": "a"') == []
+    assert rows.feed('}, {"name": "b"') == [(0, Row(name="a"))]
+    assert rows.feed('}]}') == [(1, Row(name="b"))]
+    assert rows.final(Table) == Table(title="t", rows=[Row(name="a"), Row(name="b")])
+
+
+def test_braces_inside_strings_are_ignored():
+    text = json.dumps({"title": "}]{", "rows": [{"name": 'x}"{'}, {"name": "\\}"}]})
+    rows = PartialRows(Table, "rows")
+    emitted = [row for chunk in chunks(text) for row in rows.feed(chunk)]
+    assert emitted == [(0, Row(name='x}"{')), (1, Row(name="\\}"))]
+
+
+def test_check_schema_rejects_ambiguous_schemas():
+    class NotRows(BaseModel):
+        rows: List[str]
+
+    class Nested(BaseModel):
+        rows: List[Row]
+        extra: Dict[str, str]
+
+    with pytest.raises(TypeError):
+        PartialRows(NotRows, "rows")
+    with pytest.raises(TypeError):
+        StructuredRowStream(RunnableLambda(lambda x: x), Nested, "rows")
+    assert PartialRows.check_schema(RiskAssessmentOutput, "위험성평가표")
+
+
+def test_stream_falls_back_when_output_is_invalid():
+    def model(input):
+        yield '{"title": "t", "rows": [{"name": "a"}'  # 잘린 JSON
+
+    fallback = RunnableLambda(lambda input: Table(title="t", rows=[Row(name="a")]))
+    events = list(StructuredRowStream(RunnableGenerator(model), Table, "rows", fallback=fallback).stream("x"))
+    assert events == [("row", 0, Row(name="a")), ("final", None, Table(title="t", rows=[Row(name="a")]))]
@@ -1,9 +1,15 @@
 # from .auth import *
-# from .casher import *
 # from .db import *
 from .log import *
+from .embeddings import *
+from .images import *
+from .clients import *
+from .ratelimit import *
 from .models import *
+from .casher import *
+from .metering import *
 from .rich_print import *
 # from .session import *
 from .verbose import *
+from .tracing import *
 from .middleware import *
\ No newline at end of file
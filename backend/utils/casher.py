@@ -1,13 +1,26 @@
+import functools
+from typing import Optional
+
 import tiktoken
 
-from models import GPTModel, EncodingModel, encodings, gpt_model_dict
+from .log import get_logger
+from .models import EncodingModel, OpenAIModel, OpenAIPricing, get_data_dict, openai_encoding_models, openai_language_models
+
+
+logger = get_logger(__name__)
+
+DEFAULT_ENCODING: str = "o200k_base"
+
+gpt_model_dict = get_data_dict(openai_language_models)
+encodings = openai_encoding_models
+
 
 
-def get_model_instance(model: str) -> GPTModel | EncodingModel:
+def get_model_instance(model: str) -> OpenAIModel | EncodingModel:
     """입력된 모델 이름이 GPT 모델인지, Encoding 모델인지 확인 후 반환"""
     if model in gpt_model_dict:
         return gpt_model_dict[model]
-    
+
     for encoding in encodings:
         if model == encoding.name:
             return encoding
@@ -15,68 +28,111 @@ def get_model_instance(model: str) -> GPTModel | EncodingModel:
     raise ValueError(f"Unknown model or encoding: {model}")
 
 
+def find_model(model: str) -> Optional[OpenAIModel]:
+    """`gpt-4.1-2025-04-14`처럼 날짜가 붙은 이름은 가장 길게 일치하는 모델로 찾음"""
+    if model in gpt_model_dict:
+        return gpt_model_dict[model]
+    candidates = [name for name in gpt_model_dict if model.startswith(f"{name}-")]
+    return gpt_model_dict[max(candidates, key=len)] if candidates else None
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name: str) -> Optional[tiktoken.Encoding]:
+    """모델/encoding 이름 → tiktoken encoder (한 번만 생성). 준비할 수 없으면 `None`"""
+    try:
+        if any(name == encoding.name for encoding in encodings):
+            return tiktoken.get_encoding(name)
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"🔸 tiktoken encoding unavailable for {name}: {e}")
+        return None
+
+
 def num_tokens_from_string(context: str, encoding_name: str) -> int:
-    """주어진 문자열의 토큰 개수를 반환"""
-    encoding = tiktoken.get_encoding(encoding_name) \
-        if isinstance(get_model_instance(encoding_name), EncodingModel) \
-        else tiktoken.encoding_for_model(encoding_name)
-    return len(encoding.encode(context))
+    """주어진 문자열의 토큰 개수를 반환 (encoder를 쓸 수 없으면 4글자당 1토큰으로 추정)"""
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return (len(context) + 3) // 4
+    return len(encoding.encode(context, disallowed_special=()))
+
+
+def _pricing(model: str) -> OpenAIPricing:
+    _model = find_model(model)
+    if _model is None:
+        raise ValueError(f"{model} is not a valid GPT model.")
+    return _model.pricing
 
 
 def calc_input(context: str, encoding_name: str) -> float:
     """
     주어진 문맥(context)에서 입력 토큰 개수 기반으로 비용 계산
-    
+
     ```
         >> print(f"${calc_input(lorem, "gpt-4o"):,.2}")
         $0.0052
     ```
     """
-    _model = get_model_instance(encoding_name)
-
-    if isinstance(_model, GPTModel):
-        num_tokens = num_tokens_from_string(context, encoding_name)
-        if _model.pricing.input_price is not None:
-            return num_tokens * _model.pricing.input_price
+    pricing = _pricing(encoding_name)
+    if pricing.input_per_1M_tokens is None:
         raise ValueError(f"Model {encoding_name} does not have an input price.")
-    else:
-        num_tokens = num_tokens_from_string(context, encoding_name)
-    raise ValueError(f"{encoding_name} is not a valid GPT model.")
+    return num_tokens_from_string(context, encoding_name) * pricing.input_price
 
 
 def calc_output(context: str, encoding_name: str) -> float:
     """
     주어진 문맥(context)에서 출력 토큰 개수 기반으로 비용 계산
-    
+
     ```
         >> print(f"${calc_output(lorem, "gpt-4o"):,.2}")
         $0.021
     ```
     """
-    _model = get_model_instance(encoding_name)
-
-    if isinstance(_model, GPTModel):
-        num_tokens = num_tokens_from_string(context, encoding_name)
-        if _model.pricing.output_price is not None:
-            return num_tokens * _model.pricing.output_price
-        raise ValueError(f"Model {encoding_name} does not have an input price.")
-    else:
-        num_tokens = num_tokens_from_string(context, encoding_name)
-    raise ValueError(f"{encoding_name} is not a valid GPT model.")
+    pricing = _pricing(encoding_name)
+    if pricing.output_per_1M_tokens is None:
+        raise ValueError(f"Model {encoding_name} does not have an output price.")
+    return num_tokens_from_string(context, encoding_name) * pricing.output_price
 
 
 def calc_cost(context: str, encoding_name: str) -> float:
     """주어진 문맥(context)에서 임베딩 토큰 개수 기반으로 비용 계산"""
-    _model = get_model_instance(encoding_name)
-
-    if isinstance(_model, GPTModel):
-        num_tokens = num_tokens_from_string(context, encoding_name)
-        if _model.pricing.cost is not None:
-            return num_tokens * _model.pricing.cost
-        raise ValueError(f"Model {encoding_name} does not have an input price.")
-    else:
-        num_tokens = num_tokens_from_string(context, encoding_name)
-    raise ValueError(f"{encoding_name} is not a valid GPT model.")
+    pricing = _pricing(encoding_name)
+    if pricing.cost_per_1M_tokens is None:
+        raise ValueError(f"Model {encoding_name} does not have an embedding price.")
+    return num_tokens_from_string(context, encoding_name) * pricing.cost
 
 
-__all__ = []
\ No newline at end of file
+def usage_cost(model: str,
+               prompt_tokens: int = 0,
+               cached_tokens: int = 0,
+               completion_tokens: int = 0,
+               embedding_tokens: int = 0) -> Optional[float]:
+    """
+    토큰 사용량 → USD. `prompt_tokens`는 `cached_tokens`를 포함한 전체 입력 토큰.
+    캐시 단가가 없는 모델은 캐시 토큰도 일반 입력 단가로 계산합니다. 가격표에 없는 모델은 `None`.
+    """
+    _model = find_model(model)
+    if _model is None:
+        return None
+    pricing = _model.pricing
+    input_price = pricing.input_per_1M_tokens or 0.0
+    cached_price = pricing.cached_input_per_1M_tokens if pricing.cached_input_per_1M_tokens is not None else input_price
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * (pricing.output_per_1M_tokens or 0.0)
+        + embedding_tokens * (pricing.cost_per_1M_tokens or 0.0)
+    ) / 1_000_000
+
+
+__all__ = [
+    "get_encoding",
+    "num_tokens_from_string",
+    "calc_input",
+    "calc_output",
+    "calc_cost",
+    "usage_cost",
+    "find_model",
+]
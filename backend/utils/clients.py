@@ -0,0 +1,213 @@
+"""
+LLM·임베딩 client 레지스트리.
+
+`(provider, model, options)`마다 client 하나를 만들어 모든 체인·route가 공유하고,
+provider별로 keep-alive pool을 가진 httpx client 하나씩을 그 아래에 둡니다.
+`LLM_HTTP2=true`이고 `h2`가 설치되어 있으면 HTTP/2로 연결을 다중화합니다 (`pip install httpx[http2]`).
+"""
+
+import importlib.util, os, threading
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
+
+import httpx
+
+from .log import get_logger
+
+
+logger = get_logger(__name__)
+
+LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE: int = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))  # seconds
+LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "false").lower() == "true"
+
+T = TypeVar("T")
+
+
+
+class CountingTransport(httpx.BaseTransport):
+    """요청 수·동시 요청 수를 `ClientRegistry`에 알리는 transport wrapper"""
+    def __init__(self, wrapped: httpx.BaseTransport, registry: "ClientRegistry", provider: str):
+        self.wrapped = wrapped
+        self.counter = registry._counter(provider)
+        self.registry = registry
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.registry._started(self.counter)
+        try:
+            response = self.wrapped.handle_request(request)
+        except Exception:
+            self.registry._finished(self.counter, error=True)
+            raise
+        self.registry._finished(self.counter)
+        return response
+
+    def close(self):
+        self.wrapped.close()
+
+
+class CountingAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, wrapped: httpx.AsyncBaseTransport, registry: "ClientRegistry", provider: str):
+        self.wrapped = wrapped
+        self.counter = registry._counter(provider)
+        self.registry = registry
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.registry._started(self.counter)
+        try:
+            response = await self.wrapped.handle_async_request(request)
+        except Exception:
+            self.registry._finished(self.counter, error=True)
+            raise
+        self.registry._finished(self.counter)
+        return response
+
+    async def aclose(self):
+        await self.wrapped.aclose()
+
+
+def pool_stats(client: httpx.Client | httpx.AsyncClient) -> Dict[str, Any]:
+    """httpcore connection pool 상태 (httpx 내부 구조에 의존하므로 없으면 빈 값)"""
+    transport = getattr(client, "_transport", None)
+    pool = getattr(getattr(transport, "wrapped", transport), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for connection in connections if connection.is_idle()),
+        "http2": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+    }
+
+
+
+class ClientRegistry:
+    """
+    공유 client 레지스트리.
+
+    - `get(provider, model, factory, **options)`: 같은 key면 처음 만든 객체를 그대로 반환
+    - `http_client(provider)` / `http_async_client(provider)`: provider별 공유 httpx client
+    - `stats()`: provider별 요청 수, 동시 요청 수(최대값 포함), pool 사용률
+    """
+    def __init__(self,
+                 max_connections: int = LLM_MAX_CONNECTIONS,
+                 max_keepalive: int = LLM_MAX_KEEPALIVE,
+                 keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY,
+                 timeout: float = LLM_TIMEOUT,
+                 connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 http2: bool = LLM_HTTP2):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.http2 = http2 and self._h2_available()
+        self._lock = threading.RLock()
+        self._instances: Dict[Tuple[str, str, Tuple[Tuple[str, str], ...]], Any] = {}
+        self._http: Dict[str, List[httpx.Client | httpx.AsyncClient]] = {}
+        self._sync: Dict[str, httpx.Client] = {}
+        self._async: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _h2_available() -> bool:
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("🔸 LLM_HTTP2=true but `h2` is not installed; using HTTP/1.1")
+            return False
+        return True
+
+    def pool_kwargs(self) -> Dict[str, Any]:
+        """httpx client 생성 인자 (ollama처럼 client를 직접 넘길 수 없는 provider용)"""
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "timeout": httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            "http2": self.http2,
+        }
+
+    def _counter(self, provider: str) -> Dict[str, int]:
+        with self._lock:
+            return self._counters.setdefault(provider, {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "errors": 0})
+
+    def _started(self, counter: Dict[str, int]):
+        with self._lock:
+            counter["requests"] += 1
+            counter["in_flight"] += 1
+            counter["peak_in_flight"] = max(counter["peak_in_flight"], counter["in_flight"])
+
+    def _finished(self, counter: Dict[str, int], error: bool = False):
+        with self._lock:
+            counter["in_flight"] -= 1
+            counter["errors"] += error
+
+    def track(self, provider: str, client: httpx.Client | httpx.AsyncClient):
+        """직접 만들지 않은 httpx client도 pool 통계에 포함 (e.g., ollama)"""
+        with self._lock:
+            self._http.setdefault(provider, []).append(client)
+
+    def http_client(self, provider: str) -> httpx.Client:
+        with self._lock:
+            if provider not in self._sync:
+                kwargs = self.pool_kwargs()
+                transport = httpx.HTTPTransport(limits=kwargs.pop("limits"), http2=kwargs.pop("http2"))
+                self._sync[provider] = httpx.Client(transport=CountingTransport(transport, self, provider), **kwargs)
+                self.track(provider, self._sync[provider])
+            return self._sync[provider]
+
+    def http_async_client(self, provider: str) -> httpx.AsyncClient:
+        with self._lock:
+            if provider not in self._async:
+                kwargs = self.pool_kwargs()
+                transport = httpx.AsyncHTTPTransport(limits=kwargs.pop("limits"), http2=kwargs.pop("http2"))
+                self._async[provider] = httpx.AsyncClient(transport=CountingAsyncTransport(transport, self, provider), **kwargs)
+                self.track(provider, self._async[provider])
+            return self._async[provider]
+
+    def get(self, provider: str, model: str, factory: Callable[[], T], **options: Any) -> T:
+        key = (provider, model, tuple(sorted((name, repr(value)) for name, value in options.items())))
+        instance = self._instances.get(key)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(key)
+                if instance is None:
+                    instance = self._instances[key] = factory()
+                    logger.debug(f"🔹 Client created: {provider}/{model} {options or ''}")
+        return instance
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            instances = [f"{provider}/{model}" for provider, model, _ in self._instances]
+            http = {provider: list(clients) for provider, clients in self._http.items()}
+            counters = {provider: dict(counter) for provider, counter in self._counters.items()}
+        providers = {}
+        for provider, clients in http.items():
+            pools = [pool_stats(client) for client in clients]
+            connections = sum(pool["connections"] for pool in pools)
+            idle = sum(pool["idle"] for pool in pools)
+            capacity = self.max_connections * len(clients)
+            providers[provider] = {
+                **counters.get(provider, {}),
+                "clients": len(clients),
+                "connections": connections,
+                "idle": idle,
+                "http2_connections": sum(pool["http2"] for pool in pools),
+                "utilization": round((connections - idle) / capacity, 4) if capacity else None,
+            }
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "instances": instances,
+            "providers": providers,
+        }
+
+
+client_registry = ClientRegistry()
+
+
+
+__all__ = ["ClientRegistry", "client_registry", "pool_stats"]
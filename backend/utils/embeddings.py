@@ -0,0 +1,196 @@
+import asyncio, hashlib, os, re, sqlite3, threading, unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+
+EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_PATH: Optional[str] = os.getenv("EMBEDDING_CACHE_PATH") or None  # e.g., "cache/embeddings.sqlite3"
+
+# 캐시 miss로 실제 provider에 요청한 `(model, texts)`를 받는 hook (e.g., `utils.metering`)
+embedding_usage_hooks: List[Callable[[str, List[str]], None]] = []
+
+
+
+def normalize_text(text: str) -> str:
+    """캐시 key용 정규화: 유니코드 NFC + 공백 정리"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+
+class EmbeddingCache:
+    """
+    Query embedding 캐시.
+
+    메모리 LRU (`maxsize`) 위에 선택적으로 SQLite 디스크 캐시(`path`)를 둡니다.
+    디스크 캐시는 WAL 모드로 열어 여러 uvicorn worker가 같은 파일을 공유할 수 있습니다.
+    """
+    def __init__(self, maxsize: int = EMBEDDING_CACHE_SIZE, path: Optional[str] = EMBEDDING_CACHE_PATH):
+        self.maxsize = maxsize
+        self.path = path
+        self._lru: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    @property
+    def disk(self) -> bool:
+        return self._db is not None
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = array("f", row[0]).tolist()
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def set(self, key: str, vector: List[float]):
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    (key, array("f", vector).tobytes())
+                )
+
+    def _remember(self, key: str, vector: List[float]):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._lru),
+            "maxsize": self.maxsize,
+            "path": self.path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+embedding_cache = EmbeddingCache()
+
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    `Embeddings`를 감싸서 `(model, 정규화된 텍스트 hash)` 단위로 결과를 캐시합니다.
+    캐시에 없는 텍스트만 모아서 원래 모델에 한 번에 요청합니다.
+    디스크 캐시가 있으면 async 경로의 SQLite 조회·저장은 thread에서 실행합니다 (event loop를 막지 않도록).
+    """
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache = embedding_cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    @property
+    def model(self) -> str:
+        return getattr(self.embeddings, "model", None) or type(self.embeddings).__name__
+
+    def __getattr__(self, name: str) -> Any:
+        # `__init__` 전(`copy`·pickle 등)에는 `embeddings`가 없으므로 AttributeError로 (`hasattr` 등이 동작하도록)
+        try:
+            embeddings = self.__dict__["embeddings"]
+        except KeyError:
+            raise AttributeError(name) from None
+        return getattr(embeddings, name)
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str], Dict[str, List[int]]]:
+        vectors: List[Optional[List[float]]] = []
+        missing: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            key = embedding_key(self.model, text)
+            vector = self.cache.get(key)
+            vectors.append(vector)
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+        keys = list(missing)
+        return vectors, keys, missing
+
+    def _report(self, texts: List[str]):
+        for hook in embedding_usage_hooks:
+            hook(self.model, texts)
+
+    def _fill(self, vectors, keys, missing, results) -> List[List[float]]:
+        for key, vector in zip(keys, results):
+            self.cache.set(key, vector)
+            for i in missing[key]:
+                vectors[i] = vector
+        return vectors
+
+    async def _offload(self, func: Callable[..., Any], *args: Any) -> Any:
+        if not self.cache.disk:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, keys, missing = self._lookup(texts)
+        if not keys:
+            return vectors
+        requested = [texts[missing[key][0]] for key in keys]
+        results = self.embeddings.embed_documents(requested)
+        self._report(requested)
+        return self._fill(vectors, keys, missing, results)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_key(self.model, text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._report([text])
+            self.cache.set(key, vector)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, keys, missing = await self._offload(self._lookup, texts)
+        if not keys:
+            return vectors
+        requested = [texts[missing[key][0]] for key in keys]
+        results = await self.embeddings.aembed_documents(requested)
+        self._report(requested)
+        return await self._offload(self._fill, vectors, keys, missing, results)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = embedding_key(self.model, text)
+        vector = await self._offload(self.cache.get, key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._report([text])
+            await self._offload(self.cache.set, key, vector)
+        return vector
+
+
+
+__all__ = ["EmbeddingCache", "CachedEmbeddings", "embedding_cache", "embedding_usage_hooks", "normalize_text", "embedding_key"]
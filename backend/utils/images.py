@@ -0,0 +1,354 @@
+"""
+현장 사진 전처리.
+
+URL은 공유 HTTP client로 동시에 받아오고 (http/https, 공인 주소만, redirect마다 다시 확인, 최대 `IMAGE_MAX_BYTES`),
+base64 data URI는 디코딩한 뒤
+Pillow로 긴 변 `IMAGE_MAX_EDGE`·JPEG 품질 `IMAGE_QUALITY`로 줄여 다시 data URI로 만듭니다.
+바이트가 같은 사진은 한 장만 남깁니다.
+"""
+
+import asyncio, base64, binascii, hashlib, io, ipaddress, math, os, socket, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from PIL import Image, ImageOps
+
+from .log import get_logger
+
+
+logger = get_logger(__name__)
+
+IMAGE_MAX_EDGE: int = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_QUALITY: int = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_FETCH_TIMEOUT: float = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_FETCH_CONCURRENCY: int = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "8"))
+IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_MAX_BYTES: int = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_MAX_PIXELS: int = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+IMAGE_MAX_REDIRECTS: int = int(os.getenv("IMAGE_MAX_REDIRECTS", "5"))
+IMAGE_ALLOW_PRIVATE_HOSTS: bool = os.getenv("IMAGE_ALLOW_PRIVATE_HOSTS", "false").lower() == "true"  # 로컬 개발용
+
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS  # 넘으면 Pillow가 DecompressionBombWarning, 2배를 넘으면 오류
+
+
+
+def vision_tokens(width: int, height: int) -> int:
+    """OpenAI vision(`detail: high`) 이미지 토큰 추정: 2048 안으로 → 짧은 변 768 → 512px 타일당 170 + 85"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def decode_data_uri(image: str) -> Optional[bytes]:
+    if not image.startswith("data:"):
+        return None
+    _, _, payload = image.partition(",")
+    try:
+        return base64.b64decode(payload.strip(), validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def is_url(image: str) -> bool:
+    return image.startswith("http://") or image.startswith("https://")
+
+
+class UnsafeImageURL(ValueError):
+    """받아오지 않는 사진 URL (http/https가 아니거나 사설·link-local 등 내부 주소)"""
+
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global
+
+
+def check_url(url: str, addresses: Iterable[str]):
+    """scheme·host와 host가 가리키는 모든 주소를 확인 (하나라도 내부 주소면 거절)"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeImageURL(f"Unsupported image URL: {url[:120]}")
+    if IMAGE_ALLOW_PRIVATE_HOSTS:
+        return
+    addresses = list(addresses)
+    if not addresses or not all(is_public_address(address) for address in addresses):
+        raise UnsafeImageURL(f"Image host is not a public address: {parts.hostname}")
+
+
+def url_host(url: str) -> Tuple[str, int]:
+    parts = urlsplit(url)
+    return parts.hostname or "", parts.port or (443 if parts.scheme == "https" else 80)
+
+
+def resolve(url: str) -> List[str]:
+    host, port = url_host(url)
+    try:
+        return [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    except (OSError, UnicodeError) as e:
+        raise UnsafeImageURL(f"Image host could not be resolved: {host}: {e}") from e
+
+
+async def aresolve(url: str) -> List[str]:
+    host, port = url_host(url)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError) as e:
+        raise UnsafeImageURL(f"Image host could not be resolved: {host}: {e}") from e
+    return [info[4][0] for info in infos]
+
+
+def redirect_url(response: httpx.Response) -> str:
+    return str(response.url.join(response.headers["location"]))
+
+
+def check_length(response: httpx.Response, max_bytes: int):
+    length = response.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ValueError(f"Image is larger than {max_bytes} bytes ({length})")
+
+
+def dhash(raw: bytes, size: int = 8) -> int:
+    """difference hash (64bit). 크기·압축률만 다른 같은 사진은 Hamming 거리가 작게 나옴"""
+    with Image.open(io.BytesIO(raw)) as image:
+        image.draft("L", (size * 8, size * 8))  # JPEG은 디코딩 단계에서 바로 축소
+        pixels = list(ImageOps.exif_transpose(image).convert("L").resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left, right = pixels[row * (size + 1) + col], pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def image_hash(image: str) -> Optional[int]:
+    """data URI → dHash. URL이거나 디코딩할 수 없으면 `None`"""
+    raw = decode_data_uri(image)
+    if raw is None:
+        return None
+    try:
+        return dhash(raw)
+    except Exception:
+        return None
+
+
+
+class ImageProcessor:
+    """
+    `site_image` 목록 → 중복 없는 축소 data URI 목록.
+
+    받아오거나 디코딩하지 못한 항목은 원래 문자열 그대로 남깁니다 (모델 쪽에서 다시 시도).
+    """
+    def __init__(self,
+                 max_edge: int = IMAGE_MAX_EDGE,
+                 quality: int = IMAGE_QUALITY,
+                 timeout: float = IMAGE_FETCH_TIMEOUT,
+                 concurrency: int = IMAGE_FETCH_CONCURRENCY,
+                 max_bytes: int = IMAGE_MAX_BYTES):
+        self.max_edge = max_edge
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._client: Optional[httpx.Client] = None
+        self._aclients: Dict[int, httpx.AsyncClient] = {}
+        self._executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "images_in": 0,
+            "images_out": 0,
+            "duplicates": 0,
+            "fetched": 0,
+            "errors": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+        }
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(timeout=self.timeout, limits=self._limits(), follow_redirects=False)
+        return self._client
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        # AsyncClient는 event loop에 묶이므로 loop별로 하나씩
+        loop_id = id(asyncio.get_running_loop())
+        client = self._aclients.get(loop_id)
+        if client is None:
+            client = self._aclients[loop_id] = httpx.AsyncClient(timeout=self.timeout, limits=self._limits(), follow_redirects=False)
+        return client
+
+    def _count(self, **values: int):
+        with self._lock:
+            for key, value in values.items():
+                self._stats[key] += value
+
+    def compress(self, raw: bytes) -> Tuple[str, int, int, int]:
+        """원본 bytes → (data URI, 축소 후 bytes, 원본 토큰 추정, 축소 후 토큰 추정)"""
+        with Image.open(io.BytesIO(raw)) as source:
+            mime = Image.MIME.get(source.format, "image/jpeg")
+            image = ImageOps.exif_transpose(source)
+            tokens_in = vision_tokens(*image.size)
+            image.thumbnail((self.max_edge, self.max_edge))
+            tokens_out = vision_tokens(*image.size)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+        encoded = buffer.getvalue()
+        if len(encoded) >= len(raw) and tokens_in == tokens_out:
+            # 이미 작은 사진은 원본 그대로
+            encoded = raw
+        else:
+            mime = "image/jpeg"
+        return f"data:{mime};base64,{base64.b64encode(encoded).decode('ascii')}", len(encoded), tokens_in, tokens_out
+
+    def _compress(self, raw: bytes) -> Optional[Tuple[str, int, int, int]]:
+        try:
+            return self.compress(raw)
+        except Exception as e:
+            self._count(errors=1)
+            logger.warning(f"🔸 Image re-encode failed: {e}")
+            return None
+
+    def _finish(self, images: List[str], raws: List[Optional[bytes]], compressed: Dict[str, Any]) -> List[str]:
+        """입력 순서를 유지하면서 중복 제거 + 통계 집계 (중복 사진은 원래 보냈을 bytes·토큰만큼 절약으로 집계)"""
+        outputs, seen = [], set()
+        for image, raw in zip(images, raws):
+            result = None if raw is None else compressed.get(hashlib.sha256(raw).hexdigest())
+            if result is None:
+                outputs.append(image)
+                continue
+            uri, size, tokens_in, tokens_out = result
+            self._count(bytes_in=len(raw), tokens_in=tokens_in)
+            if uri in seen:
+                self._count(duplicates=1)
+                continue
+            seen.add(uri)
+            outputs.append(uri)
+            self._count(bytes_out=size, tokens_out=tokens_out)
+        self._count(images_in=len(images), images_out=len(outputs))
+        return outputs
+
+    @staticmethod
+    def _unique(raws: List[Optional[bytes]]) -> Dict[str, bytes]:
+        return {hashlib.sha256(raw).hexdigest(): raw for raw in raws if raw is not None}
+
+    def _read(self, chunks: Iterable[bytes]) -> bytes:
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) > self.max_bytes:
+                raise ValueError(f"Image is larger than {self.max_bytes} bytes")
+        return bytes(buffer)
+
+    def _get(self, url: str) -> bytes:
+        """redirect를 직접 따라가며 매 단계 주소를 확인하고, 본문은 `max_bytes`까지만 읽음"""
+        for _ in range(IMAGE_MAX_REDIRECTS + 1):
+            check_url(url, resolve(url))
+            with self.client.stream("GET", url) as response:
+                if response.is_redirect:
+                    url = redirect_url(response)
+                    continue
+                response.raise_for_status()
+                check_length(response, self.max_bytes)
+                return self._read(response.iter_bytes())
+        raise httpx.TooManyRedirects(f"Exceeded {IMAGE_MAX_REDIRECTS} redirects")
+
+    async def _aget(self, url: str) -> bytes:
+        for _ in range(IMAGE_MAX_REDIRECTS + 1):
+            check_url(url, await aresolve(url))
+            async with self.aclient.stream("GET", url) as response:
+                if response.is_redirect:
+                    url = redirect_url(response)
+                    continue
+                response.raise_for_status()
+                check_length(response, self.max_bytes)
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes():
+                    buffer += chunk
+                    if len(buffer) > self.max_bytes:
+                        raise ValueError(f"Image is larger than {self.max_bytes} bytes")
+                return bytes(buffer)
+        raise httpx.TooManyRedirects(f"Exceeded {IMAGE_MAX_REDIRECTS} redirects")
+
+    def _fetch(self, image: str) -> Optional[bytes]:
+        if not is_url(image):
+            return decode_data_uri(image)
+        try:
+            raw = self._get(image)
+            self._count(fetched=1)
+            return raw
+        except (httpx.HTTPError, httpx.InvalidURL, ValueError) as e:
+            self._count(errors=1)
+            logger.warning(f"🔸 Image fetch failed: {image[:120]}: {e}")
+            return None
+
+    async def _afetch(self, image: str, semaphore: asyncio.Semaphore) -> Optional[bytes]:
+        if not is_url(image):
+            return decode_data_uri(image)
+        try:
+            async with semaphore:
+                raw = await self._aget(image)
+            self._count(fetched=1)
+            return raw
+        except (httpx.HTTPError, httpx.InvalidURL, ValueError) as e:
+            self._count(errors=1)
+            logger.warning(f"🔸 Image fetch failed: {image[:120]}: {e}")
+            return None
+
+    def prepare(self, images: List[str]) -> List[str]:
+        if not images:
+            return []
+        raws = list(self._executor.map(self._fetch, images))
+        unique = self._unique(raws)
+        compressed = dict(zip(unique, self._executor.map(self._compress, unique.values())))
+        return self._finish(images, raws, compressed)
+
+    async def aprepare(self, images: List[str]) -> List[str]:
+        if not images:
+            return []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        raws = await asyncio.gather(*(self._afetch(image, semaphore) for image in images))
+        unique = self._unique(raws)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(self._executor, self._compress, raw) for raw in unique.values()))
+        return self._finish(images, raws, dict(zip(unique, results)))
+
+    def hashes(self, images: List[str]) -> List[Optional[int]]:
+        return [image_hash(image) for image in images]
+
+    async def ahashes(self, images: List[str]) -> List[Optional[int]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.hashes, images)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "max_edge": self.max_edge,
+            "quality": self.quality,
+            "bytes_saved": stats["bytes_in"] - stats["bytes_out"],
+            "tokens_saved": stats["tokens_in"] - stats["tokens_out"],
+        })
+        return stats
+
+
+image_processor = ImageProcessor()
+
+
+
+__all__ = ["ImageProcessor", "UnsafeImageURL", "image_processor", "vision_tokens", "dhash", "image_hash", "IMAGE_MAX_EDGE", "IMAGE_QUALITY"]
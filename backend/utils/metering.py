@@ -0,0 +1,284 @@
+"""
+토큰·비용 metering.
+
+- LLM 호출: `MeteringCallbackHandler`가 provider `usage_metadata`(prompt / cached prompt / completion 토큰)를 읽고,
+  값이 없으면 캐시된 tiktoken encoder로 메시지를 세어 추정합니다.
+- 임베딩: `CachedEmbeddings`가 캐시 miss로 실제 요청한 텍스트만 `embedding_usage_hooks`를 통해 집계합니다.
+- 비용은 `utils/models.py`의 `OpenAIPricing` 표(`cached_input_per_1M_tokens` 포함)로 계산합니다.
+- 프롬프트별로 provider prefix cache 적중(`cached_tokens`)과 지연 시간을 따로 집계합니다.
+  프롬프트 이름은 첫 system 메시지(고정 prefix)로 찾습니다 (`register_prompt`).
+- (route, model)별로 메모리에 합산하고, `METERING_FLUSH_INTERVAL`초마다 구간 합계를 JSON Lines(`METERING_PATH`)로 남깁니다.
+"""
+
+import atexit, contextvars, hashlib, json, os, threading, time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.outputs import LLMResult
+
+from .casher import num_tokens_from_string, usage_cost
+from .embeddings import embedding_usage_hooks
+from .log import get_logger
+
+
+logger = get_logger(__name__)
+
+METERING: bool = os.getenv("METERING", "true").lower() == "true"
+METERING_FLUSH_INTERVAL: float = float(os.getenv("METERING_FLUSH_INTERVAL", "60"))  # seconds, 0이면 flush 안 함
+METERING_PATH: str = os.getenv("METERING_PATH", os.path.join("logs", "metering.jsonl"))
+
+UNKNOWN_ROUTE: str = "-"
+USAGE_FIELDS: Tuple[str, ...] = ("calls", "prompt_tokens", "cached_tokens", "completion_tokens", "embedding_tokens", "estimated_tokens")
+PROMPT_FIELDS: Tuple[str, ...] = ("calls", "prompt_tokens", "cached_tokens", "cache_hits", "hit_seconds", "miss_seconds")
+
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar("metering_route", default=UNKNOWN_ROUTE)
+
+_prompt_prefixes: Dict[str, str] = {}  # prefix key → 프롬프트 이름
+_prompt_keys: Dict[str, str] = {}  # 프롬프트 이름 → 현재 prefix key
+_prompt_lock = threading.Lock()
+
+
+
+def prefix_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _forget_prompt(name: str):
+    key = _prompt_keys.pop(name, None)
+    if key is not None and _prompt_prefixes.get(key) == name:
+        del _prompt_prefixes[key]
+
+
+def register_prompt(name: str, system: str):
+    """렌더링된 system 메시지 → 프롬프트 이름 (prefix cache 집계용). 같은 이름을 다시 등록하면 이전 prefix는 지움"""
+    with _prompt_lock:
+        _forget_prompt(name)
+        key = _prompt_keys[name] = prefix_key(system)
+        _prompt_prefixes[key] = name
+
+
+def unregister_prompts(names: List[str]):
+    """hot reload로 사라진 프롬프트의 prefix를 지움"""
+    with _prompt_lock:
+        for name in names:
+            _forget_prompt(name)
+
+
+def prompt_name(messages: List[BaseMessage]) -> str:
+    if messages and isinstance(messages[0], SystemMessage) and isinstance(messages[0].content, str):
+        return _prompt_prefixes.get(prefix_key(messages[0].content), UNKNOWN_ROUTE)
+    return UNKNOWN_ROUTE
+
+
+
+class UsageMeter:
+    """(route, model)별 토큰·비용 합계와 route별 요청 수"""
+    def __init__(self, flush_interval: float = METERING_FLUSH_INTERVAL, path: str = METERING_PATH):
+        self.flush_interval = flush_interval
+        self.path = path
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._window: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._requests: Dict[str, int] = {}
+        self._window_requests: Dict[str, int] = {}
+        self._prompts: Dict[str, Dict[str, float]] = {}
+        self._window_prompts: Dict[str, Dict[str, float]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _empty() -> Dict[str, float]:
+        return {**{field: 0 for field in USAGE_FIELDS}, "cost": 0.0}
+
+    def _start(self):
+        if self._flusher is not None or self.flush_interval <= 0:
+            return
+        self._flusher = threading.Thread(target=self._run, name="metering-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def record_request(self, route: str, count: int = 1):
+        with self._lock:
+            self._start()
+            self._requests[route] = self._requests.get(route, 0) + count
+            self._window_requests[route] = self._window_requests.get(route, 0) + count
+
+    def record(self, route: str, model: str, **usage: int):
+        """`usage`: `USAGE_FIELDS` 중 일부. 가격표에 없는 모델(ollama 등)은 비용 0으로 합산"""
+        cost = usage_cost(
+            model,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            cached_tokens=usage.get("cached_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            embedding_tokens=usage.get("embedding_tokens", 0),
+        ) or 0.0
+        key = (route, model)
+        with self._lock:
+            self._start()
+            for bucket in (self._totals, self._window):
+                entry = bucket.setdefault(key, self._empty())
+                for field, value in usage.items():
+                    entry[field] += value
+                entry["cost"] += cost
+
+    def record_prompt(self, name: str, prompt_tokens: int, cached_tokens: int, seconds: float):
+        """provider가 돌려준 사용량으로만 집계 (추정치는 prefix cache 적중 여부를 알 수 없음)"""
+        hit = cached_tokens > 0
+        with self._lock:
+            self._start()
+            for bucket in (self._prompts, self._window_prompts):
+                entry = bucket.setdefault(name, {field: 0 for field in PROMPT_FIELDS})
+                entry["calls"] += 1
+                entry["prompt_tokens"] += prompt_tokens
+                entry["cached_tokens"] += cached_tokens
+                entry["cache_hits"] += hit
+                entry["hit_seconds" if hit else "miss_seconds"] += seconds
+
+    def record_embedding(self, model: str, texts: List[str]):
+        tokens = sum(num_tokens_from_string(text, model) for text in texts)
+        self.record(current_route.get(), model, calls=1, embedding_tokens=tokens)
+
+    def flush(self):
+        with self._lock:
+            window, requests, prompts = self._window, self._window_requests, self._window_prompts
+            self._window, self._window_requests, self._window_prompts = {}, {}, {}
+        if not window and not requests and not prompts:
+            return
+        now = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for (route, model), entry in window.items():
+                    f.write(json.dumps({"time": now, "route": route, "model": model, **entry}, ensure_ascii=False) + "\n")
+                for route, count in requests.items():
+                    f.write(json.dumps({"time": now, "route": route, "requests": count}, ensure_ascii=False) + "\n")
+                for name, entry in prompts.items():
+                    f.write(json.dumps({"time": now, "prompt": name, **entry}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"🔸 Metering flush failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = {key: dict(entry) for key, entry in self._totals.items()}
+            requests = dict(self._requests)
+            prompts = {name: dict(entry) for name, entry in self._prompts.items()}
+        routes: Dict[str, Dict[str, Any]] = {}
+        for (route, model), entry in sorted(totals.items()):
+            summary = routes.setdefault(route, {"requests": requests.get(route, 0), "cost": 0.0, "models": {}})
+            summary["models"][model] = {**entry, "cost": round(entry["cost"], 6)}
+            summary["cost"] += entry["cost"]
+        for route, count in requests.items():
+            routes.setdefault(route, {"requests": count, "cost": 0.0, "models": {}})
+        for summary in routes.values():
+            summary["cost_per_request"] = round(summary["cost"] / summary["requests"], 6) if summary["requests"] else None
+            summary["cost"] = round(summary["cost"], 6)
+        return {
+            "flush_interval": self.flush_interval,
+            "path": self.path,
+            "total_cost": round(sum(entry["cost"] for entry in totals.values()), 6),
+            "routes": routes,
+            "prompts": {name: self._prompt_summary(entry) for name, entry in sorted(prompts.items())},
+        }
+
+    @staticmethod
+    def _prompt_summary(entry: Dict[str, float]) -> Dict[str, Any]:
+        hits, misses = entry["cache_hits"], entry["calls"] - entry["cache_hits"]
+        return {
+            "calls": entry["calls"],
+            "prompt_tokens": entry["prompt_tokens"],
+            "cached_tokens": entry["cached_tokens"],
+            "cache_hit_rate": round(hits / entry["calls"], 4) if entry["calls"] else None,
+            "cached_token_ratio": round(entry["cached_tokens"] / entry["prompt_tokens"], 4) if entry["prompt_tokens"] else None,
+            "avg_latency_ms_hit": round(entry["hit_seconds"] / hits * 1000, 1) if hits else None,
+            "avg_latency_ms_miss": round(entry["miss_seconds"] / misses * 1000, 1) if misses else None,
+        }
+
+
+usage_meter = UsageMeter()
+
+
+
+def _model_name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+    params = kwargs.get("invocation_params") or {}
+    metadata = kwargs.get("metadata") or {}
+    return (
+        params.get("model_name") or params.get("model")
+        or metadata.get("ls_model_name")
+        or ((serialized or {}).get("kwargs") or {}).get("model_name")
+        or "unknown"
+    )
+
+
+
+class MeteringCallbackHandler(BaseCallbackHandler):
+    """
+    chat model 호출의 토큰 사용량을 `UsageMeter`에 기록하는 callback.
+
+    route는 호출 metadata의 `route`(`MeteredChain`이 넣어 줌)에서 가져옵니다.
+    """
+    run_inline = True  # 집계만 하므로 async 실행에서도 executor를 거치지 않음
+
+    def __init__(self, meter: UsageMeter = usage_meter):
+        self.meter = meter
+        self._runs: Dict[UUID, Tuple[str, str, List[List[BaseMessage]], float]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any) -> Any:
+        route = (kwargs.get("metadata") or {}).get("route") or current_route.get()
+        with self._lock:
+            self._runs[run_id] = (route, _model_name(serialized, kwargs), messages, time.perf_counter())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        route, model, messages, started = run
+        seconds = time.perf_counter() - started
+        model = (response.llm_output or {}).get("model_name") or model
+        usage = {"calls": 1, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "estimated_tokens": 0}
+
+        for prompt, generations in zip(messages, response.generations):
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if metadata:
+                    cached_tokens = (metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+                    usage["prompt_tokens"] += metadata.get("input_tokens", 0)
+                    usage["cached_tokens"] += cached_tokens
+                    usage["completion_tokens"] += metadata.get("output_tokens", 0)
+                    self.meter.record_prompt(prompt_name(prompt), metadata.get("input_tokens", 0), cached_tokens, seconds)
+                    continue
+                # usage를 돌려주지 않는 provider → tiktoken으로 추정 (tool call 인자도 출력으로 셈)
+                message = getattr(generation, "message", None)
+                output = generation.text or json.dumps(getattr(message, "tool_calls", None) or [], ensure_ascii=False, default=str)
+                prompt_tokens = num_tokens_from_string(get_buffer_string(prompt), model)
+                completion_tokens = num_tokens_from_string(output, model)
+                usage["prompt_tokens"] += prompt_tokens
+                usage["completion_tokens"] += completion_tokens
+                usage["estimated_tokens"] += prompt_tokens + completion_tokens
+
+        self.meter.record(route, model, **usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+
+metering_handler = MeteringCallbackHandler()
+
+if METERING:
+    embedding_usage_hooks.append(usage_meter.record_embedding)
+
+
+
+__all__ = ["UsageMeter", "usage_meter", "MeteringCallbackHandler", "metering_handler", "current_route", "register_prompt", "unregister_prompts", "prompt_name", "METERING"]
@@ -5,16 +5,20 @@ from typing import List, Dict, Optional
 from pydantic import BaseModel, computed_field
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.embeddings import Embeddings
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_anthropic import ChatAnthropic
-from langchain_ollama import ChatOllama, OllamaEmbeddings
+from langchain_ollama import ChatOllama
 # from langchain_huggingface import ChatHuggingFace, HuggingFaceEmbeddings
 
+from .clients import client_registry
+from .embeddings import CachedEmbeddings
+from .ratelimit import RateLimitedChatAnthropic, RateLimitedChatOllama, RateLimitedChatOpenAI, RateLimitedOpenAIEmbeddings
+
 
 load_dotenv()
 
 MILLION: int = 1_000_000
 # OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_URL: str = os.getenv("OLLAMA_URL", "http://snucem1.iptime.org:11434")
+GPT_OSS_URL: str = os.getenv("GPT_OSS_URL", "ollama.seexr.co.kr")  # gpt-oss 전용 host
 
 
 
@@ -130,6 +134,7 @@ INCS: List[Inc] = [
 def model_call(address: str) -> BaseLanguageModel | Embeddings:
     """
     address `{inc.}/{model name}` 구조.
+    같은 address는 `client_registry`에서 한 번만 만들고 공유합니다 (provider별 httpx pool 하나).
     """
     if not address.count('/') == 1:
         raise NameError()
@@ -139,14 +144,35 @@ def model_call(address: str) -> BaseLanguageModel | Embeddings:
     model = get_elements_by_names(model_name, models.language_models)
     
     if inc_name == "openai":
-        return OpenAIEmbeddings(model=model.name, api_key=os.getenv("OPENAI_API_KEY")) if model.is_embedding else \
-            ChatOpenAI(model=model.name, api_key=os.getenv("OPENAI_API_KEY"))
+        http_kwargs = {
+            "http_client": client_registry.http_client(inc_name),
+            "http_async_client": client_registry.http_async_client(inc_name),
+        }
+        return client_registry.get(inc_name, model.name, lambda: 
+            CachedEmbeddings(RateLimitedOpenAIEmbeddings(model=model.name, api_key=os.getenv("OPENAI_API_KEY"), **http_kwargs)) if model.is_embedding else \
+            RateLimitedChatOpenAI(model=model.name, api_key=os.getenv("OPENAI_API_KEY"), **http_kwargs)
+        )
     elif inc_name == "anthropic":
-        return ChatAnthropic(model=model.name, api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return client_registry.get(inc_name, model.name, lambda: RateLimitedChatAnthropic(model=model.name, api_key=os.getenv("ANTHROPIC_API_KEY")))
     else:
         return None  # HuggingFaceEmbeddings(model=model.name) if model.is_embedding else ChatHuggingFace(model=model.name)
 
 
+def ollama_call(model: str, base_url: str) -> ChatOllama:
+    """`(base_url, model)`별 공유 `ChatOllama` (rate limiter 포함). ollama client는 httpx client를 직접 받지 않으므로 pool 설정만 넘김"""
+    def build() -> ChatOllama:
+        chat = RateLimitedChatOllama(model=model, base_url=base_url, client_kwargs=client_registry.pool_kwargs())
+        for client in (chat._client, chat._async_client):
+            if client is not None:
+                client_registry.track("ollama", client._client)
+        return chat
+    return client_registry.get("ollama", f"{base_url}/{model}", build)
+
+
+def ollama_host(model: str) -> str:
+    return GPT_OSS_URL if "gpt-oss" in model else OLLAMA_URL
+
+
 # def quantized_model_call(address: str) -> BaseLanguageModel | Embeddings:
 #     """
 #     address `{inc.}/{model name}` 구조.
@@ -161,7 +187,7 @@ def model_call(address: str) -> BaseLanguageModel | Embeddings:
 #     return OllamaEmbeddings(model.name) if model.is_embedding else ChatOllama(model.name)
 
 
-__all__ = ["model_call"]  # , "quantized_model_call"]
+__all__ = ["model_call", "ollama_call", "ollama_host", "OLLAMA_URL", "GPT_OSS_URL"]  # , "quantized_model_call"]
 
 if __name__ == "__main__":
     llm = model_call("openai/gpt-4o")
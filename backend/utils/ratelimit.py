@@ -0,0 +1,448 @@
+"""
+LLM 호출 rate limiter / admission control.
+
+(provider, model)마다 분당 요청 수(RPM)·토큰 수(TPM) token bucket을 두고, 보내기 전에 요청 토큰을 추정해 자리를 예약합니다.
+
+- 대기열은 우선순위 순서입니다. route metadata로 정하며 `RATE_LIMIT_PRIORITIES` 중 처음 일치하는 값을 씁니다 (작을수록 먼저).
+- 예상 대기 시간이 `RATE_LIMIT_MAX_WAIT`를 넘으면 바로 `429 Too Many Requests` + `Retry-After`로 거절합니다.
+  provider가 돌려준 429도 같은 예외로 바꿉니다.
+- 응답의 실제 사용량으로 TPM bucket을 보정합니다.
+
+`model_call` / `ollama_call`이 만드는 모든 client는 `RateLimited*` 클래스이므로 같은 limiter를 공유합니다.
+"""
+
+import asyncio, contextvars, heapq, itertools, json, math, os, threading, time
+from typing import Any, AsyncIterator, ClassVar, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from .log import get_logger
+
+
+logger = get_logger(__name__)
+
+RATE_LIMIT: bool = os.getenv("RATE_LIMIT", "true").lower() == "true"
+RATE_LIMIT_MAX_WAIT: float = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))  # seconds
+RATE_LIMIT_OUTPUT_TOKENS: int = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "1500"))  # `max_tokens`가 없을 때 응답 토큰 추정
+RATE_LIMIT_IMAGE_TOKENS: int = int(os.getenv("RATE_LIMIT_IMAGE_TOKENS", "765"))  # 1024px 사진 한 장 (detail: high)
+# "provider" 또는 "provider/model" → {"rpm": ..., "tpm": ...} (0이면 제한 없음)
+RATE_LIMITS: Dict[str, Dict[str, float]] = {
+    "openai": {"rpm": 500, "tpm": 200_000},
+    "anthropic": {"rpm": 50, "tpm": 40_000},
+    "ollama": {"rpm": 60, "tpm": 0},
+    **json.loads(os.getenv("RATE_LIMITS", "{}")),  # e.g., '{"openai/gpt-4.1": {"rpm": 500, "tpm": 30000}}'
+}
+# route에 포함된 문자열 → 우선순위. 위에서부터 처음 일치하는 값
+RATE_LIMIT_PRIORITIES: Dict[str, int] = json.loads(os.getenv("RATE_LIMIT_PRIORITIES", "null")) or {
+    "/eval/": 2,
+    "/bulk": 1,
+    "/pi-ratings": 0,
+    "/checklist": 0,
+}
+DEFAULT_PRIORITY: int = 1
+
+_admitted: contextvars.ContextVar[bool] = contextvars.ContextVar("rate_limit_admitted", default=False)
+
+
+
+class RateLimitExceeded(HTTPException):
+    """대기열이 가득 차서 거절된 요청. FastAPI가 그대로 429 응답으로 돌려줌"""
+    def __init__(self, key: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=429,
+            detail=f"Rate limit exceeded for {key}; retry after {self.retry_after}s",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+def route_priority(route: Optional[str]) -> int:
+    if route:
+        for pattern, priority in RATE_LIMIT_PRIORITIES.items():
+            if pattern in route:
+                return priority
+    return DEFAULT_PRIORITY
+
+
+
+class TokenBucket:
+    """분당 `per_minute`만큼 채워지는 bucket (최대 `per_minute`)"""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self, amount: float) -> float:
+        return min(amount, self.capacity)
+
+    def wait_time(self, amount: float) -> float:
+        return max(0.0, (self.clamp(amount) - self.level) / self.rate)
+
+
+
+class _Waiter:
+    __slots__ = ("requests", "tokens", "priority", "granted", "cancelled", "event", "loop", "future")
+
+    def __init__(self, requests: int, tokens: int, priority: int):
+        self.requests = requests
+        self.tokens = tokens
+        self.priority = priority
+        self.granted = False
+        self.cancelled = False
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        if self.loop is not None and self.future is not None:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(True))
+
+
+
+class RateLimiter:
+    """RPM·TPM token bucket + 우선순위 대기열. 동기(thread)·비동기 호출이 같은 대기열을 씀"""
+    def __init__(self, key: str, rpm: float = 0, tpm: float = 0, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.key = key
+        self.max_wait = max_wait
+        self.requests_bucket = TokenBucket(rpm) if rpm else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._stats: Dict[str, float] = {"admitted": 0, "shed": 0, "provider_429": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def _buckets(self, waiter: _Waiter) -> List[Tuple[TokenBucket, float]]:
+        return [
+            (bucket, amount)
+            for bucket, amount in ((self.requests_bucket, waiter.requests), (self.tokens_bucket, waiter.tokens))
+            if bucket is not None
+        ]
+
+    def _dispatch(self) -> float:
+        """(lock 안에서) 맨 앞부터 들어갈 수 있는 만큼 통과시키고, 맨 앞이 더 기다려야 하는 시간을 반환"""
+        now = time.monotonic()
+        for bucket in (self.requests_bucket, self.tokens_bucket):
+            if bucket is not None:
+                bucket.refill(now)
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            wait = max((bucket.wait_time(amount) for bucket, amount in self._buckets(waiter)), default=0.0)
+            if wait > 0:
+                return wait
+            heapq.heappop(self._queue)
+            for bucket, amount in self._buckets(waiter):
+                bucket.level -= bucket.clamp(amount)
+            waiter.granted = True
+            waiter.wake()
+        return 0.0
+
+    def _projected_wait(self, waiter: _Waiter) -> float:
+        """(lock 안에서) 우선순위가 같거나 높은 대기 요청을 모두 보낸 뒤 이 요청이 나갈 때까지의 예상 시간"""
+        ahead = [queued for _, _, queued in self._queue if not queued.cancelled and queued.priority <= waiter.priority]
+        waits = [0.0]
+        if self.requests_bucket is not None:
+            amount = sum(queued.requests for queued in ahead) + waiter.requests
+            waits.append((amount - self.requests_bucket.level) / self.requests_bucket.rate)
+        if self.tokens_bucket is not None:
+            amount = sum(self.tokens_bucket.clamp(queued.tokens) for queued in ahead) + self.tokens_bucket.clamp(waiter.tokens)
+            waits.append((amount - self.tokens_bucket.level) / self.tokens_bucket.rate)
+        return max(waits)
+
+    def _enqueue(self, waiter: _Waiter) -> float:
+        with self._lock:
+            self._dispatch()
+            projected = self._projected_wait(waiter)
+            if projected > self.max_wait:
+                self._stats["shed"] += 1
+                raise RateLimitExceeded(self.key, projected)
+            heapq.heappush(self._queue, (waiter.priority, next(self._seq), waiter))
+            return self._dispatch()
+
+    def _give_up(self, waiter: _Waiter):
+        with self._lock:
+            if waiter.granted:
+                return
+            waiter.cancelled = True
+            self._stats["shed"] += 1
+            retry_after = self._projected_wait(waiter)
+        raise RateLimitExceeded(self.key, retry_after)
+
+    def _record_admitted(self, started: float):
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["admitted"] += 1
+            if waited > 0.001:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds"] += waited
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+
+    def acquire(self, tokens: int, priority: int = DEFAULT_PRIORITY, requests: int = 1):
+        waiter = _Waiter(requests, tokens, priority)
+        waiter.event = threading.Event()
+        started = time.monotonic()
+        delay = self._enqueue(waiter)
+        while not waiter.granted:
+            remaining = self.max_wait - (time.monotonic() - started)
+            if remaining <= 0:
+                self._give_up(waiter)  # 그 사이에 통과했으면 그냥 돌아옴
+                continue
+            waiter.event.wait(max(0.005, min(delay, remaining)))
+            with self._lock:
+                delay = self._dispatch()
+        self._record_admitted(started)
+
+    async def aacquire(self, tokens: int, priority: int = DEFAULT_PRIORITY, requests: int = 1):
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(requests, tokens, priority)
+        waiter.loop, waiter.future = loop, loop.create_future()
+        started = time.monotonic()
+        delay = self._enqueue(waiter)
+        while not waiter.granted:
+            remaining = self.max_wait - (time.monotonic() - started)
+            if remaining <= 0:
+                self._give_up(waiter)  # 그 사이에 통과했으면 그냥 돌아옴
+                continue
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), max(0.005, min(delay, remaining)))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                with self._lock:
+                    waiter.cancelled = not waiter.granted
+                raise
+            with self._lock:
+                delay = self._dispatch()
+        self._record_admitted(started)
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """추정치와 실제 사용량의 차이만큼 TPM bucket을 돌려주거나 더 씀"""
+        if actual is None or self.tokens_bucket is None:
+            return
+        with self._lock:
+            bucket = self.tokens_bucket
+            bucket.level = min(bucket.capacity, bucket.level + bucket.clamp(estimated) - actual)
+
+    def provider_limited(self, retry_after: float) -> RateLimitExceeded:
+        with self._lock:
+            self._stats["provider_429"] += 1
+        return RateLimitExceeded(self.key, retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._dispatch()
+            stats = dict(self._stats)
+            queued = [waiter for _, _, waiter in self._queue if not waiter.cancelled]
+            return {
+                "rpm": self.requests_bucket.capacity if self.requests_bucket else None,
+                "tpm": self.tokens_bucket.capacity if self.tokens_bucket else None,
+                "requests_available": round(self.requests_bucket.level, 1) if self.requests_bucket else None,
+                "tokens_available": round(self.tokens_bucket.level) if self.tokens_bucket else None,
+                "queued": len(queued),
+                "queued_by_priority": {str(p): sum(1 for w in queued if w.priority == p) for p in sorted({w.priority for w in queued})},
+                **{key: value for key, value in stats.items() if key not in ("wait_seconds", "max_wait_seconds")},
+                "avg_wait_ms": round(stats["wait_seconds"] / stats["waited"] * 1000, 1) if stats["waited"] else None,
+                "max_wait_ms": round(stats["max_wait_seconds"] * 1000, 1),
+                "max_queue_wait": self.max_wait,
+            }
+
+
+
+class RateLimiterRegistry:
+    def __init__(self, limits: Dict[str, Dict[str, float]] = RATE_LIMITS):
+        self.limits = limits
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str) -> RateLimiter:
+        key = f"{provider}/{model}"
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    limits = self.limits.get(key) or self.limits.get(provider) or {}
+                    limiter = self._limiters[key] = RateLimiter(key, rpm=limits.get("rpm", 0), tpm=limits.get("tpm", 0))
+        return limiter
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": RATE_LIMIT, "priorities": RATE_LIMIT_PRIORITIES, "limiters": {key: limiter.stats() for key, limiter in list(self._limiters.items())}}
+
+
+rate_limiters = RateLimiterRegistry()
+
+
+
+def estimate_tokens(messages: List[BaseMessage], model: str, max_tokens: Optional[int] = None) -> int:
+    """보내기 전 토큰 추정: 텍스트(캐시된 tiktoken encoder) + 사진당 고정값 + 응답 토큰 상한"""
+    from .casher import num_tokens_from_string  # utils.models → ratelimit → casher → utils.models 순환 import 방지
+
+    text, images = [], 0
+    for message in messages:
+        if isinstance(message.content, str):
+            text.append(message.content)
+            continue
+        for part in message.content:
+            if isinstance(part, str):
+                text.append(part)
+            elif part.get("type") == "text":
+                text.append(part.get("text", ""))
+            elif part.get("type") in ("image_url", "image"):
+                images += 1
+    return num_tokens_from_string("\n".join(text), model) + images * RATE_LIMIT_IMAGE_TOKENS + (max_tokens or RATE_LIMIT_OUTPUT_TOKENS)
+
+
+def _usage(result: ChatResult) -> Optional[int]:
+    totals = [
+        generation.message.usage_metadata.get("total_tokens")
+        for generation in result.generations
+        if getattr(generation.message, "usage_metadata", None)
+    ]
+    return sum(totals) if totals else None
+
+
+def _retry_after(error: Exception) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+
+class RateLimitedChatModel:
+    """
+    chat model mixin. `_generate` / `_agenerate` / `_stream` / `_astream` 앞에서 limiter를 통과합니다.
+    (`ChatOpenAI(streaming=True)._generate`처럼 내부에서 `_stream`을 다시 부르는 경우는 한 번만 셈)
+    """
+    limiter_provider: ClassVar[str] = "openai"
+
+    def _limiter_model(self) -> str:
+        return getattr(self, "model_name", None) or getattr(self, "model", None) or type(self).__name__
+
+    def _admission(self, messages: List[BaseMessage], run_manager: Any, kwargs: Dict[str, Any]) -> Tuple[RateLimiter, int, int]:
+        limiter = rate_limiters.get(self.limiter_provider, self._limiter_model())
+        route = (getattr(run_manager, "metadata", None) or {}).get("route")
+        max_tokens = kwargs.get("max_tokens") or getattr(self, "max_tokens", None)
+        return limiter, estimate_tokens(messages, self._limiter_model(), max_tokens), route_priority(route)
+
+    def _translate(self, limiter: RateLimiter, error: Exception):
+        if getattr(error, "status_code", None) == 429:
+            raise limiter.provider_limited(_retry_after(error)) from error
+        raise error
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if not RATE_LIMIT or _admitted.get():
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        limiter, tokens, priority = self._admission(messages, run_manager, kwargs)
+        limiter.acquire(tokens, priority)
+        token = _admitted.set(True)
+        try:
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except Exception as e:
+            self._translate(limiter, e)
+        finally:
+            _admitted.reset(token)
+        limiter.settle(tokens, _usage(result))
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if not RATE_LIMIT or _admitted.get():
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        limiter, tokens, priority = self._admission(messages, run_manager, kwargs)
+        await limiter.aacquire(tokens, priority)
+        token = _admitted.set(True)
+        try:
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except Exception as e:
+            self._translate(limiter, e)
+        finally:
+            _admitted.reset(token)
+        limiter.settle(tokens, _usage(result))
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[Any]:
+        if not RATE_LIMIT or _admitted.get():
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+        limiter, tokens, priority = self._admission(messages, run_manager, kwargs)
+        limiter.acquire(tokens, priority)
+        try:
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except Exception as e:
+            self._translate(limiter, e)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[Any]:
+        if not RATE_LIMIT or _admitted.get():
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+        limiter, tokens, priority = self._admission(messages, run_manager, kwargs)
+        await limiter.aacquire(tokens, priority)
+        try:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+        except Exception as e:
+            self._translate(limiter, e)
+
+
+class RateLimitedChatOpenAI(RateLimitedChatModel, ChatOpenAI):
+    limiter_provider: ClassVar[str] = "openai"
+
+
+class RateLimitedChatAnthropic(RateLimitedChatModel, ChatAnthropic):
+    limiter_provider: ClassVar[str] = "anthropic"
+
+
+class RateLimitedChatOllama(RateLimitedChatModel, ChatOllama):
+    limiter_provider: ClassVar[str] = "ollama"
+
+
+
+class RateLimitedOpenAIEmbeddings(OpenAIEmbeddings):
+    """임베딩 요청도 같은 limiter 사용 (응답 토큰 없음, 우선순위는 기본값)"""
+    def _admission(self, texts: List[str]) -> Tuple[RateLimiter, int]:
+        from .casher import num_tokens_from_string
+        return rate_limiters.get("openai", self.model), sum(num_tokens_from_string(text, self.model) for text in texts)
+
+    def embed_documents(self, texts: List[str], chunk_size: Optional[int] = None, **kwargs: Any) -> List[List[float]]:
+        if RATE_LIMIT and texts:
+            limiter, tokens = self._admission(texts)
+            limiter.acquire(tokens)
+        return super().embed_documents(texts, chunk_size=chunk_size, **kwargs)
+
+    async def aembed_documents(self, texts: List[str], chunk_size: Optional[int] = None, **kwargs: Any) -> List[List[float]]:
+        if RATE_LIMIT and texts:
+            limiter, tokens = self._admission(texts)
+            await limiter.aacquire(tokens)
+        return await super().aembed_documents(texts, chunk_size=chunk_size, **kwargs)
+
+
+
+__all__ = [
+    "RateLimiter",
+    "RateLimiterRegistry",
+    "RateLimitExceeded",
+    "rate_limiters",
+    "route_priority",
+    "estimate_tokens",
+    "RateLimitedChatOpenAI",
+    "RateLimitedChatAnthropic",
+    "RateLimitedChatOllama",
+    "RateLimitedOpenAIEmbeddings",
+    "RATE_LIMIT",
+]
@@ -0,0 +1,201 @@
+"""
+Span 단위 tracing.
+
+`TRACING=true`일 때만 동작합니다. 꺼져 있으면 `trace`는 함수를 그대로 돌려주고 `span`은 빈 context manager라서
+요청 경로에 추가 비용이 없습니다.
+
+- 샘플링은 root span에서 한 번 결정되고 하위 span은 그 결정을 따릅니다 (`TRACING_SAMPLE_RATE`).
+- span 값은 `TRACING_MAX_CHARS` 근처까지만 포맷하고 (큰 값 전체를 `repr`하지 않음), base64 이미지는 길이만 남깁니다.
+- 기록은 `QueueHandler` → 백그라운드 `QueueListener`가 JSON Lines 파일(`TRACING_PATH`)에 씁니다.
+"""
+
+import atexit, contextlib, contextvars, functools, inspect, json, logging, os, queue, random, re, time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from pydantic import BaseModel
+
+
+TRACING: bool = os.getenv("TRACING", "false").lower() == "true"
+TRACING_SAMPLE_RATE: float = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+TRACING_MAX_CHARS: int = int(os.getenv("TRACING_MAX_CHARS", "500"))
+TRACING_PATH: str = os.getenv("TRACING_PATH", os.path.join("logs", "traces.jsonl"))
+
+BASE64_PATTERN = re.compile(r"(data:[\w/+.-]+;base64,)\s*([A-Za-z0-9+/=]{64,})")
+UNSAMPLED = object()
+
+_current_span: contextvars.ContextVar[Optional[Any]] = contextvars.ContextVar("current_span", default=None)
+
+
+
+def _data_uri(text: str) -> Optional[str]:
+    """base64 data URI면 payload를 길이로 바꾼 문자열 (payload는 읽지 않음)"""
+    comma = text.find(",", 0, 100)
+    if text.startswith("data:") and comma > 0 and text[:comma].endswith(";base64"):
+        return f"{text[:comma + 1]}<{len(text) - comma - 1} chars>"
+    return None
+
+
+def bounded_repr(value: Any, budget: int = TRACING_MAX_CHARS) -> str:
+    """
+    `repr`과 비슷하지만 약 `budget`글자까지만 만듦.
+    큰 입력·출력(base64 사진이 든 프롬프트, 전체 `RiskAssessmentOutput` 등)을 요청 thread에서 통째로 문자열로 만들지 않도록
+    문자열은 앞부분만 자르고, 컨테이너·pydantic 모델은 예산이 남은 항목까지만 내려갑니다.
+    """
+    if budget <= 0:
+        return "…"
+    if isinstance(value, str):
+        return repr(_data_uri(value) or value[:budget + 1])
+    if isinstance(value, BaseModel):
+        fields = ((name, getattr(value, name, None)) for name in type(value).model_fields)
+        return f"{type(value).__name__}({_bounded_items(fields, budget, '=')})"
+    if isinstance(value, dict):
+        return "{" + _bounded_items(((repr(key), item) for key, item in value.items()), budget, ": ") + "}"
+    if isinstance(value, (list, tuple)):
+        brackets = "[]" if isinstance(value, list) else "()"
+        return brackets[0] + _bounded_items(((None, item) for item in value), budget) + brackets[1]
+    return repr(value)[:budget + 1]
+
+
+def _bounded_items(items: Iterator, budget: int, separator: str = "") -> str:
+    parts, used = [], 0
+    for key, item in items:
+        if used > budget:
+            parts.append("…")
+            break
+        prefix = f"{key}{separator}" if key is not None else ""
+        part = prefix + bounded_repr(item, budget - used - len(prefix))
+        parts.append(part)
+        used += len(part) + 2
+    return ", ".join(parts)
+
+
+def truncate(value: Any, max_chars: int = TRACING_MAX_CHARS) -> str:
+    """span 기록용 문자열. base64 payload는 길이로 바꾸고 `max_chars`에서 자름 (큰 값도 앞부분만 포맷)"""
+    if isinstance(value, str):
+        total = len(value)
+        text = _data_uri(value) or value[:max_chars * 2]
+    else:
+        total = None
+        text = bounded_repr(value, max_chars)
+    cut = total is not None and total > len(text)  # 잘린 문자열 끝까지 이어지는 payload는 실제로 더 김
+    text = BASE64_PATTERN.sub(lambda m: f"{m.group(1)}<{len(m.group(2))}{'+' if cut and m.end() == len(m.string) else ''} chars>", text)
+    if len(text) > max_chars:
+        rest = f"+{total - max_chars} chars" if total is not None and total > len(text) else f"+{len(text) - max_chars} chars"
+        return f"{text[:max_chars]}… ({rest})"
+    return text
+
+
+
+class _SpanQueueHandler(QueueHandler):
+    # 호출 thread에서는 포맷하지 않고 dict 그대로 queue에 넣음 (직렬화는 listener thread에서)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+
+class Tracer:
+    def __init__(self, enabled: bool = TRACING, sample_rate: float = TRACING_SAMPLE_RATE, path: str = TRACING_PATH):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.path = path
+        self._logger: Optional[logging.Logger] = None
+        self._listener: Optional[QueueListener] = None
+        if enabled:
+            self._start()
+
+    def _start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        file_handler = logging.FileHandler(self.path, encoding="utf-8")
+        file_handler.setFormatter(_JsonFormatter())
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        self._listener = QueueListener(records, file_handler)
+        self._listener.start()
+        atexit.register(self._listener.stop)
+
+        self._logger = logging.getLogger("tracing")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(_SpanQueueHandler(records))
+
+    def emit(self, record: Dict[str, Any]):
+        if self._logger is not None:
+            self._logger.info(record)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Dict[str, Any]]]:
+        """`with tracer.span("name") as s:` — `s["output"] = ...`로 결과를 남길 수 있음 (샘플링에서 빠지면 `None`)"""
+        if not self.enabled:
+            yield None
+            return
+        parent = _current_span.get()
+        if parent is UNSAMPLED or (parent is None and random.random() >= self.sample_rate):
+            token = _current_span.set(UNSAMPLED)
+            try:
+                yield None
+            finally:
+                _current_span.reset(token)
+            return
+
+        record = {
+            "trace_id": parent["trace_id"] if parent else os.urandom(8).hex(),
+            "span_id": os.urandom(8).hex(),
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "start": time.time(),
+            **{key: truncate(value) for key, value in attributes.items()},
+        }
+        token = _current_span.set(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = truncate(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            if "output" in record:
+                record["output"] = truncate(record["output"])
+            self.emit(record)
+
+    def trace(self, func: Optional[Callable] = None, *, name: Optional[str] = None) -> Callable:
+        """함수 호출을 span으로 기록하는 데코레이터. tracing이 꺼져 있으면 원래 함수를 그대로 반환"""
+        if func is None:
+            return functools.partial(self.trace, name=name)
+        if not self.enabled:
+            return func
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def awrapper(*args, **kwargs):
+                with self.span(span_name) as record:
+                    result = await func(*args, **kwargs)
+                    if record is not None:
+                        record["output"] = result
+                    return result
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.span(span_name) as record:
+                result = func(*args, **kwargs)
+                if record is not None:
+                    record["output"] = result
+                return result
+        return wrapper
+
+
+tracer = Tracer()
+trace = tracer.trace
+span = tracer.span
+
+
+
+__all__ = ["Tracer", "tracer", "trace", "span", "truncate", "bounded_repr", "TRACING"]
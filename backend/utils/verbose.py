@@ -1,4 +1,5 @@
 import functools
+from typing import Dict, List
 
 def print_return(func):
     """함수의 반환 값을 출력하는 데코레이터"""
@@ -9,4 +10,15 @@ def print_return(func):
         return result
     return wrapper
 
-__all__ = ["print_return"]
\ No newline at end of file
+def plain_table(columns: List[str], rows: List[Dict[str, str]]) -> str:
+    """열 이름과 행(dict) 목록 → 마크다운 형식의 텍스트 표 (셀 안 줄바꿈은 공백으로)"""
+    def cell(value) -> str:
+        return " ".join(str(value).split()).replace("|", "\\|")
+    lines = [
+        "| " + " | ".join(cell(column) for column in columns) + " |",
+        "|" + "|".join("---" for _ in columns) + "|",
+    ]
+    lines += ["| " + " | ".join(cell(row.get(column, "")) for column in columns) + " |" for row in rows]
+    return "\n".join(lines)
+
+__all__ = ["print_return", "plain_table"]
\ No newline at end of file